@@ -0,0 +1,143 @@
+import gzip
+import json
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Exists, Q
+from django.utils.dateparse import parse_datetime
+
+from .models import ArchiveSegment
+
+# Cold storage for old messages
+#
+# chat.retention moves messages past their conversation's retention age out
+# of the messages table into segment files, one ArchiveSegment row each:
+#   <ROOT>/<stream>/<first id>-<last id>.jsonl.gz
+# Each line is a message exactly as MessageSerializer rendered it when it was
+# archived, oldest first, so reading it back needs no joins and no
+# serialization. Segments are immutable; decoded ones are kept in a small
+# per-process LRU because paging back through a segment reads it repeatedly.
+#
+# Archived messages are always older than every message still in the table,
+# which lets MessageCursorPagination simply continue into the archive once
+# the hot rows run out. Segments hold whole threads; conversation pages skip
+# the replies, as they do in the table.
+
+def options():
+    return {
+        "ROOT": str(settings.BASE_DIR / "media" / "archive"),
+        "DEFAULT_DAYS": None,
+        "SEGMENT_SIZE": 1000,
+        "DELETE_BATCH": 1000,
+        "CACHED_SEGMENTS": 32,
+        **getattr(settings, "CHAT_RETENTION", {}),
+    }
+
+
+def root():
+    return Path(options()["ROOT"])
+
+
+def conversation_filter(channel_id=None, dm_group_id=None):
+    # The kwargs that select one conversation's rows, e.g. {"channel_id": 3}.
+    return {"channel_id": channel_id} if channel_id else {"dm_group_id": dm_group_id}
+
+
+class ArchivedMessage:
+    # One message read back from a segment. Pagination only needs the keyset;
+    # MessageSerializer returns `data` as is.
+    def __init__(self, data):
+        self.data = data
+        self.id = data["id"]
+        self.timestamp = parse_datetime(data["timestamp"])
+        self.key = (self.timestamp, self.id)
+
+
+# ------------------------ WRITING ------------------------
+
+def write_segment(name, rows):
+    # Written to a temporary file and renamed, so a segment is never seen half written.
+    path = root() / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+            for row in rows:
+                f.write(json.dumps(row, separators=(",", ":")).encode() + b"\n")
+        os.replace(temp, path)
+    except BaseException:
+        Path(temp).unlink(missing_ok=True)
+        raise
+    return path.stat().st_size
+
+
+def delete_segment_file(name):
+    (root() / name).unlink(missing_ok=True)
+
+
+# ------------------------ READING ------------------------
+
+def read_segment(name):
+    return read_segment_file(str(root() / name))
+
+
+@lru_cache(maxsize=options()["CACHED_SEGMENTS"])
+def read_segment_file(path):
+    with gzip.open(path, "rb") as f:
+        return tuple(ArchivedMessage(json.loads(line)) for line in f)
+
+
+def archived_flag(conversation):
+    # Selected as a column of the history query: whether the conversation has
+    # an archive, without a query of its own.
+    return Exists(ArchiveSegment.objects.filter(**conversation))
+
+
+def has_archive(conversation):
+    return ArchiveSegment.objects.filter(**conversation).exists()
+
+
+def older(conversation, cursor, limit):
+    # Up to `limit` archived messages before `cursor` (None: the newest), newest first.
+    segments = ArchiveSegment.objects.filter(**conversation)
+    if cursor is not None:
+        timestamp, pk = cursor
+        segments = segments.filter(Q(first_timestamp__lt=timestamp) | Q(first_timestamp=timestamp, first_message_id__lt=pk))
+    rows = []
+    for name in segments.order_by("-last_timestamp", "-last_message_id").values_list("path", flat=True)[:limit]:
+        for message in reversed(read_segment(name)):
+            if message.data.get("parent") is None and (cursor is None or message.key < cursor):
+                rows.append(message)
+                if len(rows) == limit:
+                    return rows
+    return rows
+
+
+def newer(conversation, cursor, inclusive, limit):
+    # Up to `limit` archived messages after `cursor`, oldest first.
+    timestamp, pk = cursor
+    id_lookup = "last_message_id__gte" if inclusive else "last_message_id__gt"
+    segments = ArchiveSegment.objects.filter(**conversation).filter(
+        Q(last_timestamp__gt=timestamp) | Q(last_timestamp=timestamp, **{id_lookup: pk})
+    )
+    rows = []
+    for name in segments.order_by("first_timestamp", "first_message_id").values_list("path", flat=True)[:limit]:
+        for message in read_segment(name):
+            if message.data.get("parent") is None and (message.key > cursor or (inclusive and message.key == cursor)):
+                rows.append(message)
+                if len(rows) == limit:
+                    return rows
+    return rows
+
+
+def find(pk):
+    # -> (segment, ArchivedMessage) for an archived message id, or (None, None).
+    segments = ArchiveSegment.objects.filter(min_message_id__lte=pk, max_message_id__gte=pk)
+    for segment in segments:
+        for message in read_segment(segment.path):
+            if message.id == pk:
+                return segment, message
+    return None, None
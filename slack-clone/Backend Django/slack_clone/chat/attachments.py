@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header
+
+from .models import Attachment
+
+# Content-addressed attachment store
+#
+# Layout under CHAT_ATTACHMENTS["ROOT"]:
+#   uploads/<session id>.part   a resumable upload, written in place chunk by chunk
+#   blobs/ab/cd/<sha256>        finished files, one per distinct content
+#
+# Request bodies and files are only ever touched BLOCK_SIZE bytes at a time,
+# so a large upload or download never holds the file in worker memory.
+
+BLOCK_SIZE = 64 * 1024
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class IncompleteChunk(Exception):
+    pass
+
+
+def config():
+    return settings.CHAT_ATTACHMENTS
+
+
+def root():
+    return Path(config()["ROOT"])
+
+
+def blob_name(sha256):
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def blob_path(sha256):
+    return root() / blob_name(sha256)
+
+
+def part_path(session):
+    return root() / "uploads" / f"{session.pk}.part"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ------------------------ UPLOADS ------------------------
+
+def parse_content_range(header):
+    # "bytes 0-1048575/5242880" -> (0, 1048575, 5242880)
+    match = CONTENT_RANGE_PATTERN.match(header or "")
+    if match is None:
+        return None
+    start, end, total = map(int, match.groups())
+    return (start, end, total) if start <= end < total else None
+
+
+def write_chunk(session, stream, start, length):
+    # Writes at the chunk's own offset, so retrying a chunk is idempotent.
+    path = part_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, "r+b") as f:
+        f.seek(start)
+        remaining = length
+        while remaining:
+            block = stream.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise IncompleteChunk(f"Body ended {remaining} bytes short of the Content-Range.")
+            f.write(block)
+            remaining -= len(block)
+
+
+def complete_upload(session):
+    # Hash the finished part file and move it into the blob store, unless the
+    # same bytes are already there, in which case the copy is simply dropped.
+    path = part_path(session)
+    sha256 = file_sha256(path)
+    target = blob_path(sha256)
+    if target.exists():
+        path.unlink()
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    attachment, _ = Attachment.objects.get_or_create(
+        sha256=sha256,
+        defaults={"size": session.size, "content_type": session.content_type},
+    )
+    attachment.uploaders.add(session.user_id)
+    session.attachment = attachment
+    session.save(update_fields=["attachment", "updated_at"])
+    return attachment
+
+
+def discard_upload(session):
+    part_path(session).unlink(missing_ok=True)
+    session.delete()
+
+
+# ------------------------ DOWNLOADS ------------------------
+
+class FileSlice:
+    # A file positioned at `start` that reads at most `length` bytes. It keeps
+    # fileno(), so WSGI servers with sendfile support (gunicorn) still send it
+    # zero-copy and stop at Content-Length; everything else reads it in blocks.
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def requested_range(request, size, etag):
+    # Single "bytes=" ranges only; anything else gets the whole file (RFC 9110
+    # lets servers ignore Range). Returns (start, end) or None.
+    header = request.headers.get("Range")
+    if not header or request.headers.get("If-Range", etag) != etag:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes ("bytes=-0" is unsatisfiable).
+        length = int(last)
+        return (max(0, size - length) if length else size), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    return None if last and int(last) < start else (start, end)
+
+
+def serve(request, attachment, filename):
+    etag = f'"{attachment.sha256}"'
+    content_type = attachment.content_type or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if etag in request.headers.get("If-None-Match", ""):
+        return HttpResponse(status=304, headers=headers)
+
+    header = config()["SENDFILE_HEADER"]
+    if header:
+        # The web server streams the file (and handles Range) itself.
+        if header == "X-Accel-Redirect":
+            location = config()["SENDFILE_PREFIX"] + blob_name(attachment.sha256)
+        else:
+            location = str(blob_path(attachment.sha256))
+        response = HttpResponse(content_type=content_type, headers={**headers, header: location})
+    else:
+        byte_range = requested_range(request, attachment.size, etag)
+        start, end = byte_range or (0, attachment.size - 1)
+        if byte_range is not None and start >= attachment.size:
+            headers["Content-Range"] = f"bytes */{attachment.size}"
+            return HttpResponse(status=416, headers=headers)
+
+        length = end - start + 1
+        body = FileSlice(open(blob_path(attachment.sha256), "rb"), start, length)
+        response = FileResponse(body, content_type=content_type, headers=headers)
+        response["Content-Length"] = length
+        if byte_range is not None:
+            response.status_code = 206
+            response["Content-Range"] = f"bytes {start}-{end}/{attachment.size}"
+
+    response["Content-Disposition"] = content_disposition_header(True, filename or attachment.sha256)
+    return response
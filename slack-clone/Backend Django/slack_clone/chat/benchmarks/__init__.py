@@ -0,0 +1,61 @@
+# Shared helpers for `python -m chat.benchmarks.<name>` scripts
+#
+# Benchmarks run against a throwaway test database (never the configured one)
+# and print one JSON report, so results can be diffed between commits.
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+
+
+def setup_django():
+    if str(PROJECT_DIR) not in sys.path:
+        sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "slack_clone.settings")
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "chat-bench.sqlite3"))
+    import django
+    django.setup()
+
+
+@contextmanager
+def throwaway_database():
+    from django.db import connection
+
+    if connection.vendor == "sqlite":
+        # On disk rather than in memory: multi-million row corpora don't fit.
+        test_name = os.path.join(tempfile.mkdtemp(prefix="chat-bench-"), "bench.sqlite3")
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = test_name
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+def emit(report, output=None):
+    text = json.dumps(report, indent=2, sort_keys=True, default=str)
+    if output:
+        Path(output).write_text(text + "\n")
+    print(text)
@@ -0,0 +1,115 @@
+"""Fan-out CPU benchmark for the WebSocket wire formats.
+
+    python -m chat.benchmarks.fanout --subscribers 1000 10000 --output fanout.json
+
+Delivers one broadcast event to N real MultiplexConsumer instances (each gets
+its own copy of the event, as from the channel layer) whose send() only
+records the frame, and measures process CPU time per fan-out. Two baselines
+show what the shared-frame formats replace: re-encoding the payload for every
+recipient, and compressing per socket the way permessage-deflate does.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import zlib
+
+from . import emit, setup_django
+
+
+def sample_payload(rng, content_bytes):
+    words = ["deploy", "review", "standup", "incident", "release", "ship", "merge", "test", "the", "a", "and", "to"]
+    content = ""
+    while len(content) < content_bytes:
+        content += rng.choice(words) + " "
+    return {
+        "id": 123456, "channel": 42, "dm_group": None,
+        "sender": {"id": 7, "username": "alice", "email": "alice@example.com"},
+        "sender_username": "alice", "content": content[:content_bytes],
+        "timestamp": "2026-10-18T10:00:00.123456Z", "is_read": False,
+        "attachment": None, "attachment_name": "", "attachment_url": None,
+    }
+
+
+def make_consumers(count, codec):
+    from chat.consumers import MultiplexConsumer
+
+    sent = []
+
+    async def send(text_data=None, bytes_data=None):
+        sent.append(text_data if text_data is not None else bytes_data)
+
+    consumers = []
+    for i in range(count):
+        consumer = MultiplexConsumer()
+        consumer.channel_name = f"bench.{i}"
+        consumer.codec = codec
+        consumer.send = send
+        consumers.append(consumer)
+    return consumers, sent
+
+
+async def fan_out(consumers, event, mode):
+    if mode == "per_recipient_json":
+        # The old handler: json.dumps(event["message"]) once per socket.
+        for consumer in consumers:
+            await consumer.send(text_data=json.dumps({"stream": event["group"], "data": dict(event["message"])}))
+    elif mode == "per_socket_deflate":
+        # permessage-deflate: the same JSON frame compressed once per socket.
+        for consumer in consumers:
+            text = consumer.frame(dict(event))
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            await consumer.send(bytes_data=compressor.compress(text.encode()) + compressor.flush())
+    else:
+        for consumer in consumers:
+            await consumer.chat_message(dict(event))
+
+
+def run(args):
+    from chat.broadcast import build_event
+    from chat.protocol import FORMATS, JSON, dumps
+
+    rng = random.Random(args.seed)
+    payload = sample_payload(rng, args.content_bytes)
+    modes = ["per_recipient_json", "per_socket_deflate"] + list(FORMATS)
+
+    results = {}
+    for count in args.subscribers:
+        for mode in modes:
+            consumers, sent = make_consumers(count, FORMATS.get(mode, JSON))
+            samples = []
+            for _ in range(args.rounds):
+                event = build_event(dumps(payload), group="channel_42", message=payload)
+                sent.clear()
+                started = time.process_time()
+                asyncio.run(fan_out(consumers, event, mode))
+                samples.append((time.process_time() - started) * 1000)
+            cpu_ms = statistics.median(samples)
+            results[f"{mode}@{count}"] = {
+                "subscribers": count,
+                "format": mode,
+                "cpu_ms_per_fanout": cpu_ms,
+                "cpu_us_per_subscriber": cpu_ms * 1000 / count,
+                "frame_bytes": len(sent[0]),
+                "distinct_frame_objects": len({id(frame) for frame in sent}),
+            }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--content-bytes", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    setup_django()
+    emit({"benchmark": "fanout", "content_bytes": args.content_bytes, "results": run(args)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""End-to-end load test of the REST and WebSocket paths.
+
+    python -m chat.benchmarks.loadtest --clients 2000 --output loadtest.json
+
+Boots slack_clone.asgi in this process, so requests and sockets go through
+the real routing, middleware, views and consumers, the configured channel
+layer and cache, and a throwaway database. --clients simulated users then run
+through each phase, at most --concurrency requests at a time:
+
+    login           POST /api/login/
+    bootstrap       GET /api/bootstrap/
+    history         GET the newest page of each of the user's channels, then
+                    --pages older pages by cursor
+    connect         open /ws/chat/ and subscribe to the user's channels
+    post_rest       POST /api/channels/<id>/messages/ (until the response)
+    post_websocket  {"type": "message"} on the socket (until the ack)
+    fanout          post started -> frame received, for every subscriber
+
+Every phase reports latency percentiles (ms), throughput and errors. Memory
+per open socket is the growth of the Python heap (tracemalloc) and of RSS
+across the connect phase, divided by the sockets opened; tracemalloc is only
+on during that phase, so its overhead shows in connect latency alone.
+
+Logins use a fast password hasher unless --real-password-hasher is given:
+PBKDF2 would dominate the login phase and every other phase's setup.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import time
+import tracemalloc
+from collections import Counter
+
+from . import emit, percentiles, setup_django, throwaway_database
+
+PASSWORD = "bench-password"
+
+
+class Failed(Exception):
+    pass
+
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.errors = Counter()
+        self.seconds = 0.0
+
+    async def run(self, jobs, concurrency):
+        # Each job is one timed request; failures are counted, not timed.
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(job):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await job()
+                except Exception as exc:
+                    self.errors[str(exc) or type(exc).__name__] += 1
+                else:
+                    self.samples.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed(job) for job in jobs))
+        self.seconds += time.perf_counter() - started
+
+    def report(self):
+        return {
+            "latency_ms": percentiles(self.samples),
+            "ok": len(self.samples),
+            "errors": dict(self.errors),
+            "seconds": self.seconds,
+            "per_second": len(self.samples) / self.seconds if self.seconds else None,
+        }
+
+
+class SimulatedClient:
+    def __init__(self, user, channel_ids):
+        self.user = user
+        self.channel_ids = channel_ids
+        self.token = None
+        self.before = {}  # channel id -> cursor of the next older page
+        self.socket = None
+
+
+def rss_bytes():
+    # Current resident set size, where /proc is available.
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def populate(args, rng):
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from chat.models import Channel, Message, Workspace
+
+    User = get_user_model()
+    password = make_password(PASSWORD)
+    users = User.objects.bulk_create([
+        User(username=f"bench{i}", email=f"bench{i}@example.com", password=password) for i in range(args.clients)
+    ])
+    workspace = Workspace.objects.create(name="bench")
+    Workspace.members.through.objects.bulk_create([
+        Workspace.members.through(workspace_id=workspace.id, user_id=user.id) for user in users
+    ])
+    channels = Channel.objects.bulk_create([Channel(workspace=workspace, name=f"bench{i}") for i in range(args.channels)])
+
+    clients, memberships = [], []
+    members = {channel.id: [] for channel in channels}
+    for user in users:
+        joined = rng.sample(channels, min(args.channels_per_user, len(channels)))
+        clients.append(SimulatedClient(user, [channel.id for channel in joined]))
+        for channel in joined:
+            memberships.append(Channel.members.through(channel_id=channel.id, user_id=user.id))
+            members[channel.id].append(user)
+    Channel.members.through.objects.bulk_create(memberships, batch_size=5000)
+
+    history = []
+    for channel in channels:
+        if members[channel.id]:
+            history += [
+                Message(channel=channel, sender=rng.choice(members[channel.id]), content=f"history {i}")
+                for i in range(args.history)
+            ]
+    Message.objects.bulk_create(history, batch_size=5000)
+    return clients, members
+
+
+async def request(application, method, path, token=None, body=None, timeout=30):
+    from channels.testing import HttpCommunicator
+
+    content = b"" if body is None else json.dumps(body).encode()
+    headers = [
+        (b"host", b"localhost"),
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(content)).encode()),
+    ]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    communicator = HttpCommunicator(application, method, path, body=content, headers=headers)
+    response = await communicator.get_response(timeout=timeout)
+    await communicator.wait(timeout)
+    if response["status"] >= 400:
+        raise Failed(f"HTTP {response['status']}")
+    return json.loads(response["body"]) if response["body"] else None
+
+
+async def receive_until(socket, frame_type, timeout):
+    while True:
+        frame = json.loads(await socket.receive_from(timeout=timeout))
+        if frame.get("type") == frame_type:
+            return frame
+        if frame.get("type") == "error":
+            raise Failed(f"error frame: {frame.get('message')}")
+
+
+class Fanout:
+    # Times every message frame from the moment its post started.
+    def __init__(self):
+        self.phase = Phase("fanout")
+        self.posted = {}  # content -> post start
+        self.acks = {}  # client id -> (post start, websocket post phase)
+        self.expected = 0
+        self.closed = Counter()
+        self.progress = asyncio.Event()
+
+    def expect(self, count):
+        self.expected += count
+
+    def settled(self):
+        return len(self.phase.samples) >= self.expected and not self.acks
+
+    async def drain(self, timeout):
+        # Until every expected frame and ack arrived, or timeout seconds passed.
+        deadline = time.perf_counter() + timeout
+        while not self.settled() and time.perf_counter() < deadline:
+            self.progress.clear()
+            try:
+                await asyncio.wait_for(self.progress.wait(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                pass
+
+    def delivered(self, content):
+        started = self.posted.get(content)
+        if started is not None:
+            self.phase.samples.append((time.perf_counter() - started) * 1000)
+
+    async def read(self, client):
+        while True:
+            output = await client.socket.receive_output(timeout=None)
+            if output["type"] == "websocket.close":
+                self.closed[output.get("code")] += 1
+                return
+            frame = json.loads(output["text"])
+            self.progress.set()
+            if frame.get("type") == "ack":
+                started, phase = self.acks.pop(frame.get("client_id"), (None, None))
+                if started is not None and "error" in frame:
+                    phase.errors["ack error: " + frame["error"]] += 1
+                elif started is not None:
+                    phase.samples.append((time.perf_counter() - started) * 1000)
+            elif "data" in frame:
+                self.delivered(frame["data"].get("content"))
+
+
+async def run(args, application=None):
+    from channels.testing import WebsocketCommunicator
+
+    if application is None:
+        from slack_clone.asgi import application
+
+    rng = random.Random(args.seed)
+    clients, members = await asyncio.to_thread(populate, args, rng)
+    phases = {name: Phase(name) for name in ("login", "bootstrap", "history", "connect", "post_rest", "post_websocket")}
+
+    # --- REST: login, bootstrap, history ---------------------------------
+    def login(client):
+        async def job():
+            body = {"username": client.user.username, "password": PASSWORD}
+            client.token = (await request(application, "POST", "/api/login/", body=body, timeout=args.timeout))["access"]
+        return job
+
+    def bootstrap(client):
+        async def job():
+            await request(application, "GET", "/api/bootstrap/", client.token, timeout=args.timeout)
+        return job
+
+    def history(client, channel_id, page):
+        async def job():
+            path = f"/api/channels/{channel_id}/messages/?page_size={args.page_size}"
+            if page:
+                if client.before.get(channel_id) is None:
+                    return  # reached the oldest message
+                path += f"&before={client.before[channel_id]}"
+            body = await request(application, "GET", path, client.token, timeout=args.timeout)
+            client.before[channel_id] = body["before"]
+        return job
+
+    await phases["login"].run([login(client) for client in clients], args.concurrency)
+    clients = [client for client in clients if client.token]
+    await phases["bootstrap"].run([bootstrap(client) for client in clients], args.concurrency)
+    for page in range(args.pages + 1):
+        jobs = [history(client, channel_id, page) for client in clients for channel_id in client.channel_ids]
+        await phases["history"].run(jobs, args.concurrency)
+
+    # --- WebSocket: connect and subscribe --------------------------------
+    def connect(client):
+        async def job():
+            socket = WebsocketCommunicator(application, f"/ws/chat/?token={client.token}")
+            connected, _ = await socket.connect(timeout=args.timeout)
+            if not connected:
+                raise Failed("rejected")
+            for channel_id in client.channel_ids:
+                await socket.send_json_to({"type": "subscribe", "stream": f"channel_{channel_id}"})
+                await receive_until(socket, "subscribed", args.timeout)
+            client.socket = socket
+        return job
+
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    heap_before = tracemalloc.get_traced_memory()[0]
+    await phases["connect"].run([connect(client) for client in clients], args.concurrency)
+    gc.collect()
+    heap_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rss_after = rss_bytes()
+    connected = [client for client in clients if client.socket is not None]
+    memory = {
+        "connections": len(connected),
+        "heap_bytes_per_connection": (heap_after - heap_before) / len(connected) if connected else None,
+        "rss_bytes_per_connection": (
+            (rss_after - rss_before) / len(connected) if connected and rss_before is not None else None
+        ),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+    # --- Posting and fan-out ---------------------------------------------
+    fanout = Fanout()
+    subscribers = Counter(channel_id for client in connected for channel_id in client.channel_ids)
+    readers = [asyncio.ensure_future(fanout.read(client)) for client in connected]
+    senders = [client for client in connected if client.channel_ids]
+    posts = iter(range(2 * args.posts))
+
+    def post_rest(client, channel_id):
+        async def job():
+            content = f"bench post {next(posts)}"
+            fanout.expect(subscribers[channel_id])
+            fanout.posted[content] = time.perf_counter()
+            await request(
+                application, "POST", f"/api/channels/{channel_id}/messages/", client.token,
+                body={"content": content}, timeout=args.timeout,
+            )
+        return job
+
+    def post_websocket(client, channel_id):
+        async def job():
+            number = next(posts)
+            content = f"bench post {number}"
+            fanout.expect(subscribers[channel_id])
+            fanout.posted[content] = started = time.perf_counter()
+            fanout.acks[number] = (started, phases["post_websocket"])
+            await client.socket.send_json_to({
+                "type": "message", "stream": f"channel_{channel_id}", "content": content, "client_id": number,
+            })
+        return job
+
+    def pick():
+        client = rng.choice(senders)
+        return client, rng.choice(client.channel_ids)
+
+    if senders:
+        await phases["post_rest"].run([post_rest(*pick()) for _ in range(args.posts)], args.concurrency)
+        # Sends return once the frame is queued; the ack is timed by the reader.
+        started = time.perf_counter()
+        await asyncio.gather(*(post_websocket(*pick())() for _ in range(args.posts)))
+        await fanout.drain(args.drain_timeout)
+        phases["post_websocket"].seconds = time.perf_counter() - started
+        if fanout.acks:
+            phases["post_websocket"].errors["no ack"] += len(fanout.acks)
+    fanout.phase.seconds = sum(phases[name].seconds for name in ("post_rest", "post_websocket"))
+
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    await asyncio.gather(*(client.socket.disconnect() for client in connected), return_exceptions=True)
+
+    report = {name: phase.report() for name, phase in phases.items()}
+    report["fanout"] = {
+        **fanout.phase.report(),
+        "expected": fanout.expected,
+        "missing": max(0, fanout.expected - len(fanout.phase.samples)),
+        "closed": {str(code): count for code, count in fanout.closed.items()},
+    }
+    return {"phases": report, "memory": memory, "members_per_channel": percentiles([len(m) for m in members.values()])}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--channels-per-user", type=int, default=3)
+    parser.add_argument("--history", type=int, default=500, help="messages per channel before the run")
+    parser.add_argument("--pages", type=int, default=2, help="older history pages per channel and client")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=200, help="posts over REST, and again over WebSocket")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=30, help="seconds per request")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for fan-out to finish")
+    parser.add_argument("--real-password-hasher", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+
+    settings.DEBUG = False  # no query log growing with every request
+    if not args.real_password_hasher:
+        settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+    with throwaway_database():
+        results = asyncio.run(run(args))
+    emit({
+        "benchmark": "loadtest",
+        "vendor": connection.vendor,
+        "channel_layer": settings.CHANNEL_LAYERS["default"]["BACKEND"],
+        "cache": settings.CACHES["default"]["BACKEND"],
+        "password_hasher": settings.PASSWORD_HASHERS[0],
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        **results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Search benchmark over a synthetic corpus.
+
+    python -m chat.benchmarks.search --messages 2000000 --output search.json
+
+Builds a Zipf-distributed corpus in a throwaway database, timing the
+incremental index maintenance during insert, then times ranked searches
+through the real endpoint for common, rare and prefix terms.
+"""
+import argparse
+import itertools
+import random
+import time
+
+from . import emit, percentiles, setup_django, throwaway_database
+
+
+def build_vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = {"".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size * 2)}
+    words = sorted(words)[:size]
+    rng.shuffle(words)
+    # Cumulative Zipf weights, precomputed so choices() stays O(log n) per word.
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+def populate(args, rng, words, cum_weights):
+    from django.contrib.auth import get_user_model
+    from chat.models import Channel, Message
+
+    User = get_user_model()
+    users = User.objects.bulk_create([User(username=f"bench{i}") for i in range(args.users)])
+    channels = Channel.objects.bulk_create([Channel(name=f"bench{i}") for i in range(args.channels)])
+    reader = users[0]
+    # The searching user belongs to a subset of channels, so scoping matters.
+    reader.channels.set(channels[: max(1, args.channels // 4)])
+
+    started = time.perf_counter()
+    remaining = args.messages
+    while remaining:
+        batch = min(args.batch, remaining)
+        Message.objects.bulk_create([
+            Message(
+                channel=rng.choice(channels),
+                sender=rng.choice(users),
+                content=" ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(4, 20))),
+            )
+            for _ in range(batch)
+        ])
+        remaining -= batch
+    elapsed = time.perf_counter() - started
+    return reader, {"seconds": elapsed, "messages_per_second": args.messages / elapsed}
+
+
+def run_queries(args, rng, words, reader):
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    client.force_authenticate(reader)
+    head, tail = words[:50], words[-1000:]
+    kinds = {
+        "common_term": lambda: rng.choice(head),
+        "rare_term": lambda: rng.choice(tail),
+        "two_terms": lambda: f"{rng.choice(head)} {rng.choice(tail)}",
+        "prefix": lambda: rng.choice(head)[:3],
+    }
+
+    results = {}
+    for kind, make_query in kinds.items():
+        samples = []
+        for _ in range(args.queries):
+            started = time.perf_counter()
+            response = client.get("/api/search/messages/", {"q": make_query()})
+            samples.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.content
+        results[kind] = percentiles(samples)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100, help="queries per query kind")
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.db import connection
+    from chat.search import get_search_backend
+
+    rng = random.Random(args.seed)
+    words, cum_weights = build_vocabulary(args.vocabulary, rng)
+    with throwaway_database():
+        reader, insert = populate(args, rng, words, cum_weights)
+        report = {
+            "benchmark": "search",
+            "vendor": connection.vendor,
+            "backend": type(get_search_backend()).__name__,
+            "corpus": {"messages": args.messages, "users": args.users, "channels": args.channels},
+            "insert": insert,
+            "latency_ms": run_queries(args, rng, words, reader),
+        }
+    emit(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
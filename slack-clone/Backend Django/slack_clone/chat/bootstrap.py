@@ -0,0 +1,127 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils.http import parse_etags
+
+from .broadcast import conversation_group, message_group
+from .event_log import DIRECTORY_VERSION_KEY, current_seqs, stream_version_key, user_version_key
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message, Workspace
+from .reactions import attach_reactions
+from .read_state import unread_counts
+from .serializers import ChannelSerializer, DirectMessageGroupSerializer, MessageSerializer, UserSerializer, WorkspaceSerializer
+
+# Initial client state in one request
+#
+# A user's workspaces, the channels in them (with is_member), their DM groups,
+# the DM participants' profiles, unread counts, each conversation's seq (the
+# baseline for reconnect catch-up) and the latest N messages of every
+# conversation they belong to, in a fixed number of queries.
+#
+# The ETag is computed before any query, from cache reads only: the user's
+# conversations (membership index), their seqs (which move on every new
+# message) and versions (message edits and deletes, DM group changes), a
+# per-user version (read cursors, memberships) and a global directory
+# version (workspace/channel/profile changes).
+# An unchanged client state answers If-None-Match with a 304 and at most the
+# membership load. Seqs are read before the data, so a change that races
+# with rendering only produces a fresher ETag on the next request.
+
+UNION_BATCH = 100  # conversations per UNION of latest_messages
+
+
+def state(user, limit):
+    # -> (etag, {stream: seq}) without touching the database when warm
+    streams = membership_index.get(user.id)
+    if streams is None:
+        streams = membership_index.load(user.id)
+    seqs = current_seqs(streams)
+    versions = cache.get_many(
+        [DIRECTORY_VERSION_KEY, user_version_key(user.id)] + [stream_version_key(stream) for stream in seqs]
+    )
+    parts = [
+        str(user.id), str(limit),
+        str(versions.get(DIRECTORY_VERSION_KEY, 0)), str(versions.get(user_version_key(user.id), 0)),
+    ] + [
+        f"{stream}={seq}.{versions.get(stream_version_key(stream), 0)}" for stream, seq in sorted(seqs.items())
+    ]
+    return 'W/"%s"' % hashlib.sha1(":".join(parts).encode()).hexdigest(), seqs
+
+
+def latest_messages(conversations, limit):
+    # The newest `limit` top-level messages of every conversation, grouped by
+    # conversation, oldest first. Thread replies are left out, as in the
+    # history endpoint.
+    if not conversations or limit <= 0:
+        return []
+    if connection.features.supports_slicing_ordering_in_compound:
+        # One LIMIT per UNION branch: a short backwards scan of the history
+        # index per conversation, however long the histories are. Batched, so
+        # a large workspace neither hits compound SELECT limits nor sends
+        # one IN list of every conversation's ids.
+        messages = []
+        for start in range(0, len(conversations), UNION_BATCH):
+            branches = [
+                Message.objects.filter(**conversation, parent__isnull=True)
+                .order_by("-timestamp", "-id").values_list("id", flat=True)[:limit]
+                for conversation in conversations[start:start + UNION_BATCH]
+            ]
+            ids = list(branches[0].union(*branches[1:], all=True))
+            messages += Message.objects.filter(id__in=ids).with_sender().order_by("timestamp", "id")
+        return messages
+    lookup = Q()
+    for conversation in conversations:
+        lookup |= Q(**conversation)
+    queryset = Message.objects.filter(lookup, parent__isnull=True).annotate(
+        rank=Window(
+            RowNumber(),
+            partition_by=[F("channel_id"), F("dm_group_id")],
+            order_by=[F("timestamp").desc(), F("id").desc()],
+        ),
+    ).filter(rank__lte=limit)
+    return list(queryset.with_sender().order_by("timestamp", "id"))
+
+
+def not_modified(etag, if_none_match):
+    # If-None-Match uses the weak comparison: W/"x" matches "x".
+    tags = parse_etags(if_none_match)
+    return "*" in tags or etag.removeprefix("W/") in {tag.removeprefix("W/") for tag in tags}
+
+
+def bootstrap(user, limit, seqs):
+    member_channels = Channel.members.through.objects.filter(channel_id=OuterRef("pk"), user_id=user.id)
+    channels = list(
+        Channel.objects.filter(Q(workspace__members=user) | Q(members=user))
+        .annotate(is_member=Exists(member_channels))
+        .distinct()
+        .order_by("id")
+    )
+    dm_groups = list(DirectMessageGroup.objects.filter(participants=user).prefetch_related("participants").order_by("id"))
+
+    conversations = [{"channel_id": channel.id} for channel in channels if channel.is_member]
+    conversations += [{"dm_group_id": group.id} for group in dm_groups]
+    messages = {conversation_group(**conversation): [] for conversation in conversations}
+    recent = attach_reactions(latest_messages(conversations, limit))
+    for message, data in zip(recent, MessageSerializer(recent, many=True).data):
+        messages[message_group(message)].append(data)
+
+    users = {user.id: user}
+    for group in dm_groups:
+        users.update((participant.id, participant) for participant in group.participants.all())
+
+    return {
+        "user": UserSerializer(user).data,
+        "workspaces": WorkspaceSerializer(Workspace.objects.filter(members=user).order_by("id"), many=True).data,
+        "channels": [
+            {**data, "is_member": channel.is_member}
+            for channel, data in zip(channels, ChannelSerializer(channels, many=True).data)
+        ],
+        "dm_groups": DirectMessageGroupSerializer(dm_groups, many=True).data,
+        "users": UserSerializer(sorted(users.values(), key=lambda u: u.id), many=True).data,
+        "unread": unread_counts(user),
+        "seq": {stream: seqs.get(stream, 0) for stream in messages},
+        "messages": messages,
+    }
@@ -0,0 +1,66 @@
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .event_log import record
+from .metrics import metrics
+from .protocol import dumps
+from .serializers import MessageSerializer
+
+
+# Single fan-out path for REST views and WebSocket consumers
+#
+# Payloads are encoded to JSON once here, before group_send, and consumers
+# forward the pre-encoded text (or its negotiated wire format, encoded once
+# per process by chat.protocol) instead of json.dumps-ing the same dict once
+# per recipient. Messages are numbered and logged for reconnect catch-up on
+# the way (chat.event_log).
+
+def conversation_group(channel_id=None, dm_group_id=None):
+    if channel_id:
+        return f"channel_{channel_id}"
+    if dm_group_id:
+        return f"dm_{dm_group_id}"
+    raise ValueError("A conversation needs a channel_id or a dm_group_id.")
+
+
+def user_group(user_id):
+    # Every multiplexed socket of a user joins this group (read cursors, etc.)
+    return f"user_{user_id}"
+
+
+def message_group(message):
+    return conversation_group(message.channel_id, message.dm_group_id)
+
+
+def build_event(text, event_type="chat.message", **extra):
+    # event_id lets each process encode a fan-out once (chat.protocol).
+    event = {"type": event_type, "text": text, "event_id": uuid.uuid4().hex, **extra}
+    if metrics.enabled:
+        event["sent_at"] = time.time()  # for the fan-out lag histogram
+    return event
+
+
+async def group_send_text(group, text, event_type="chat.message", **extra):
+    # "group" tells multiplexed sockets which stream the event belongs to.
+    started = metrics.start()
+    await get_channel_layer().group_send(group, build_event(text, event_type, group=group, **extra))
+    metrics.observe(metrics.group_send, started, event_type)
+
+
+async def group_send(group, payload, event_type="chat.message", **extra):
+    await group_send_text(group, dumps(payload), event_type, **extra)
+
+
+def broadcast_message(message, data=None):
+    # `data` lets callers that already serialized the message (e.g. to build
+    # the HTTP response) reuse it instead of serializing a second time.
+    if data is None:
+        started = metrics.start()
+        data = MessageSerializer(message).data
+        metrics.observe(metrics.serialize, started, "message")
+    group = message_group(message)
+    [text] = record([(group, data)])
+    async_to_sync(group_send_text)(group, text)
@@ -1,145 +1,393 @@
-import json
+import asyncio
+import re
+from abc import ABCMeta, abstractmethod
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth.models import AnonymousUser
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f"chat_{self.room_name}"
+from .broadcast import conversation_group, user_group
+from .event_log import current_seq, replay, replay_text
+from .membership import is_member_async, membership_index
+from .metrics import metrics
+from .models import Message, Workspace
+from .outbox import COALESCED, EVICTED_CLOSE_CODE, create_outbox
+from .presence import get_presence_buffer, options as presence_options, presence_workspace
+from .protocol import JSON, frame_cache, negotiate
+from .read_state import mark_read
+from .signaling import SIGNAL_TYPES, CallSession, options as signaling_options
+from .write_buffer import get_write_buffer
 
-        # Reject connection if not authenticated
-        if self.scope["user"] is None or isinstance(self.scope["user"], AnonymousUser):
-            await self.close()
-            return
+STREAM_PATTERN = re.compile(r"^(channel|dm)_(\d+)$")
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+# Frame types timed under their own label; anything else is "other".
+METERED_FRAMES = frozenset(
+    ("subscribe", "unsubscribe", "heartbeat", "typing", "call_join", "call_leave", "message", "read") + SIGNAL_TYPES
+)
 
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
+def stream_conversation(stream):
+    # "channel_5" -> {"channel_id": 5}, "dm_7" -> {"dm_group_id": 7}, else None
+    match = STREAM_PATTERN.match(stream or "")
+    if match is None:
+        return None
+    kind, pk = match.groups()
+    return {"channel_id": int(pk)} if kind == "channel" else {"dm_group_id": int(pk)}
+
+
+def query_last_seq(scope):
+    # ?last_seq=<n> on reconnect, for sockets bound to one stream
+    value = parse_qs(scope.get("query_string", b"").decode()).get("last_seq", [""])[0]
+    return int(value) if value.isdigit() else None
+
+
+def workspace_ids_for(user_id):
+    return frozenset(Workspace.members.through.objects.filter(user_id=user_id).values_list("workspace_id", flat=True))
+
+
+def is_workspace_member(user_id, workspace_id):
+    return Workspace.members.through.objects.filter(user_id=user_id, workspace_id=workspace_id).exists()
+
+
+class MessageWriteMixin:
+    # {"type": "message", "content": "...", "client_id": "..."} frames are
+    # saved through the shared write buffer; the sender gets an ack with the
+    # assigned id and everyone (sender included) gets the usual broadcast.
+    async def create_message(self, data, conversation):
+        content = data.get("content")
+        if not isinstance(content, str) or not content.strip():
+            await self.send_error("Message content is required.")
+            return
+
+        message = Message(sender=self.scope["user"], content=content, **conversation)
+        future = get_write_buffer().submit(message)
+        task = asyncio.ensure_future(self.send_ack(future, data.get("client_id")))
+        self.pending_acks.add(task)
+        task.add_done_callback(self.pending_acks.discard)
+
+    async def send_ack(self, future, client_id):
         try:
-            data = json.loads(text_data)
-            # WebRTC signaling support
-            if data.get("type") in ["webrtc_offer", "webrtc_answer", "webrtc_ice_candidate"]:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "webrtc_signal",
-                        "message": data,
-                        "sender_channel": self.channel_name
-                    }
-                )
-            else:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat_message",
-                        "message": data
-                    }
-                )
+            message = await future
         except Exception as e:
-            await self.send(text_data=json.dumps({"error": str(e)}))
+            frame = {"type": "ack", "client_id": client_id, "error": str(e)}
+        else:
+            frame = {"type": "ack", "client_id": client_id, "id": message.id}
+        await self.send_payload(frame)
 
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
 
-    async def webrtc_signal(self, event):
-        # Don't send the signal back to the sender
-        if event.get("sender_channel") != self.channel_name:
-            await self.send(text_data=json.dumps(event["message"]))
+# One authenticated socket, many channel/DM streams
+#
+# Control frames:
+#   {"type": "subscribe", "stream": "channel_5", "last_seq": 41}
+#       "last_seq" (optional) replays the stream's events since then, or
+#       answers "resync" when they are gone; see chat.event_log
+#   {"type": "unsubscribe", "stream": "channel_5"}
+#   {"type": "heartbeat"}   keeps the user online (see chat.presence)
+#   {"type": "call_join" / "call_leave", "stream": ...}   see chat.signaling
+# Every other frame names the stream it is for ({"stream": "dm_7", ...}) and
+# is one of "typing", "message", "read" or a WebRTC signal (chat.signaling);
+# anything else is answered with an error. Every outgoing event is wrapped
+# as {"stream": "...", "data": <payload>}. The wire format (JSON text,
+# MessagePack, optionally deflated) is negotiated on connect; see
+# chat.protocol. Outgoing frames go through a bounded queue per socket; see
+# chat.outbox.
+class MultiplexConsumer(MessageWriteMixin, AsyncWebsocketConsumer):
+    max_streams = 500
+    control_frames = True
+    outbox = None
+
+    async def websocket_connect(self, message):
+        started = metrics.start()
+        await super().websocket_connect(message)
+        metrics.observe(metrics.handshake, started, type(self).__name__)
 
-class DirectMessageConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.group_id = self.scope['url_route']['kwargs']['group_id']
-        self.room_group_name = f"dm_{self.group_id}"
+        self.streams = set()
+        self.pending_acks = set()
+        self.calls = {}  # stream -> CallSession
+        self.user_group = None
+        self.codec = JSON
+        self.workspace_ids = frozenset()
+        self.last_heartbeat = 0
 
         # Reject connection if not authenticated
         if self.scope["user"] is None or isinstance(self.scope["user"], AnonymousUser):
             await self.close()
             return
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        # Warm the membership index so subscribes are set lookups.
+        user_id = self.scope["user"].id
+        if membership_index.get(user_id) is None:
+            await database_sync_to_async(membership_index.load)(user_id)
+        self.workspace_ids = await database_sync_to_async(workspace_ids_for)(user_id)
+        for stream in self.initial_streams():
+            if not await self.can_join(stream):
+                await self.close()
+                return
+
+        self.codec, subprotocol = negotiate(self.scope)
+        await self.accept(subprotocol)
+        self.outbox = create_outbox(self.send_now, self.evicted)
+        if self.codec.compress:
+            await self.send_payload(self.codec.hello())
+        self.user_group = user_group(user_id)
+        await self.channel_layer.group_add(self.user_group, self.channel_name)
+        for stream in self.initial_streams():
+            await self.add_stream(stream)
+            if stream_conversation(stream):
+                await self.catch_up(stream, query_last_seq(self.scope))
+        self.last_heartbeat = asyncio.get_running_loop().time()
+        await get_presence_buffer().connected(user_id, self.workspace_ids)
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.outbox is not None:
+            self.outbox.stop()
+        for stream in list(self.calls):
+            await self.leave_call(stream, reply=False)
+        if self.user_group is not None:
+            await self.channel_layer.group_discard(self.user_group, self.channel_name)
+            await get_presence_buffer().disconnected(self.scope["user"].id, self.workspace_ids)
+        for stream in list(self.streams):
+            await self.discard_stream(stream)
+
+    def initial_streams(self):
+        return ()
 
-    async def receive(self, text_data):
+    async def can_join(self, stream):
+        workspace_id = presence_workspace(stream)
+        if workspace_id is not None:
+            return workspace_id in self.workspace_ids or await database_sync_to_async(is_workspace_member)(
+                self.scope["user"].id, workspace_id,
+            )
+        return stream_conversation(stream) is not None and await is_member_async(self.scope["user"].id, stream)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        started = metrics.start()
+        data = {}
         try:
-            data = json.loads(text_data)
-            # WebRTC signaling support
-            if data.get("type") in ["webrtc_offer", "webrtc_answer", "webrtc_ice_candidate"]:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "webrtc_signal",
-                        "message": data,
-                        "sender_channel": self.channel_name
-                    }
-                )
+            data = self.codec.decode(text_data, bytes_data)
+            frame_type = data.get("type")
+            if self.control_frames and frame_type == "subscribe":
+                await self.subscribe(data.get("stream"), data.get("last_seq"))
+                return
+            if self.control_frames and frame_type == "unsubscribe":
+                await self.unsubscribe(data.get("stream"))
+                return
+            if frame_type == "heartbeat":
+                await self.heartbeat()
+                return
+
+            stream = self.frame_stream(data)
+            if stream is None:
+                await self.send_error("Not subscribed to this stream.")
+            elif presence_workspace(stream) is not None:
+                await self.send_error("Presence streams are read-only.")
+            elif frame_type == "typing":
+                get_presence_buffer().typing_started(stream, self.scope["user"].id)
+            # WebRTC signaling goes to call peers, never to the whole stream
+            elif frame_type == "call_join":
+                await self.join_call(stream)
+            elif frame_type == "call_leave":
+                await self.leave_call(stream)
+            elif frame_type in SIGNAL_TYPES:
+                call = self.calls.get(stream)
+                if call is None or not await call.signal(data):
+                    await self.send_error("Join the call and address signaling to one of its peers.", stream=stream)
+            elif frame_type == "message":
+                await self.create_message(data, stream_conversation(stream))
+            elif frame_type == "read":
+                await self.mark_read(data, stream_conversation(stream))
             else:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat_message",
-                        "message": data
-                    }
-                )
+                # Nothing a client sends is relayed as is: every event on a
+                # stream is built by the server from a validated frame.
+                await self.send_error("Unsupported frame type.", stream=stream)
         except Exception as e:
-            await self.send(text_data=json.dumps({"error": str(e)}))
+            await self.send_error(str(e))
+        finally:
+            if started is not None and isinstance(data, dict):
+                frame_type = data.get("type")
+                label = frame_type if frame_type in METERED_FRAMES else "other"
+                metrics.frame_handled(self.frame_stream(data), label, started)
 
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
+    async def subscribe(self, stream, last_seq=None):
+        if stream_conversation(stream) is None and presence_workspace(stream) is None:
+            await self.send_error("Unknown stream.", stream=stream)
+            return
+        if stream not in self.streams:
+            if len(self.streams) >= self.max_streams:
+                await self.send_error("Too many subscriptions.", stream=stream)
+                return
+            if not await self.can_join(stream):
+                await self.send_error("Not a member of this conversation.", stream=stream)
+                return
+            await self.add_stream(stream)
+        reply = {"type": "subscribed", "stream": stream}
+        if stream_conversation(stream):
+            reply["seq"] = await self.catch_up(stream, last_seq)
+        await self.send_payload(reply)
 
-    async def webrtc_signal(self, event):
-        if event.get("sender_channel") != self.channel_name:
-            await self.send(text_data=json.dumps(event["message"]))
+    async def unsubscribe(self, stream):
+        await self.leave_call(stream, reply=False)
+        if stream in self.streams:
+            await self.discard_stream(stream)
+        await self.send_payload({"type": "unsubscribed", "stream": stream})
 
-class ChannelConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.channel_id = self.scope['url_route']['kwargs']['channel_id']
-        self.room_group_name = f"channel_{self.channel_id}"
+    async def add_stream(self, stream):
+        await self.channel_layer.group_add(stream, self.channel_name)
+        self.streams.add(stream)
+        metrics.stream_joined(stream)
 
-        # Reject connection if not authenticated
-        if self.scope["user"] is None or isinstance(self.scope["user"], AnonymousUser):
-            await self.close()
+    async def discard_stream(self, stream):
+        await self.channel_layer.group_discard(stream, self.channel_name)
+        self.streams.discard(stream)
+        metrics.stream_left(stream)
+
+    async def heartbeat(self):
+        # Clients beat every HEARTBEAT_INTERVAL; anything faster is dropped.
+        now = asyncio.get_running_loop().time()
+        if now - self.last_heartbeat < presence_options()["HEARTBEAT_INTERVAL"] / 2:
             return
+        self.last_heartbeat = now
+        await get_presence_buffer().heartbeat(self.scope["user"].id, self.workspace_ids)
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+    async def catch_up(self, stream, last_seq):
+        # -> the stream's latest seq, after sending what came after last_seq.
+        # Runs after group_add, so nothing published meanwhile is missed.
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool):
+            return await sync_to_async(current_seq)(stream)
+        seq, texts = await sync_to_async(replay)(stream, last_seq)
+        if texts is None:
+            await self.send_payload({"type": "resync", "stream": stream, "seq": seq})
+        elif texts:
+            await self.send_frame(self.codec.encode_json(replay_text(stream, seq, texts)))
+        return seq
 
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+    async def join_call(self, stream):
+        call = self.calls.get(stream)
+        if call is None:
+            call = self.calls[stream] = CallSession(
+                stream, self.scope["user"].id, self.channel_name,
+                batch_delay=signaling_options()["ICE_BATCH_DELAY"],
+            )
+            await call.join()
+        await self.send_payload({"type": "call_joined", "stream": stream, "peer_id": call.peer_id})
 
-    async def receive(self, text_data):
-        try:
-            data = json.loads(text_data)
-            # WebRTC signaling support
-            if data.get("type") in ["webrtc_offer", "webrtc_answer", "webrtc_ice_candidate"]:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "webrtc_signal",
-                        "message": data,
-                        "sender_channel": self.channel_name
-                    }
-                )
-            else:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        "type": "chat_message",
-                        "message": data
-                    }
-                )
-        except Exception as e:
-            await self.send(text_data=json.dumps({"error": str(e)}))
+    async def leave_call(self, stream, reply=True):
+        call = self.calls.pop(stream, None)
+        if call is not None:
+            await call.leave()
+        if reply:
+            await self.send_payload({"type": "call_left", "stream": stream})
+
+    def frame_stream(self, data):
+        stream = data.get("stream")
+        return stream if stream in self.streams else None
+
+    def frame(self, event):
+        # Encoded once per process and event, then shared by every socket.
+        return frame_cache.encode_event(self.codec, event, wrap=True)
+
+    async def mark_read(self, data, conversation):
+        message_id = data.get("message_id")
+        if not isinstance(message_id, int) or isinstance(message_id, bool):
+            await self.send_error("message_id must be an integer.")
+        elif not await database_sync_to_async(mark_read)(self.scope["user"], conversation, message_id):
+            await self.send_error("Message not found in this conversation.")
+
+    async def send_frame(self, frame, kind="message", key=None):
+        # Queued, never awaited: a slow client must not hold up this handler.
+        if self.outbox is None:
+            await self.send_now(frame)
+        else:
+            self.outbox.put(frame, kind, key)
+
+    async def send_now(self, frame):
+        started = metrics.start()
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+        metrics.observe(metrics.send, started)
+
+    async def send_payload(self, payload):
+        await self.send_frame(self.codec.encode(payload))
+
+    async def send_error(self, error, **extra):
+        await self.send_payload({"error": error, **extra})
+
+    async def send_event(self, event, frame):
+        kind = event.get("kind", "message")
+        key = (kind, event.get("group"), event.get("coalesce")) if kind in COALESCED else None
+        metrics.delivered(event)
+        await self.send_frame(frame, kind, key)
+
+    async def evicted(self, reason):
+        # The outbox gave up on this client (see chat.outbox).
+        await self.close(code=EVICTED_CLOSE_CODE)
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
+        await self.send_event(event, self.frame(event))
+
+    async def user_event(self, event):
+        # Events addressed to this user (e.g. read cursors from other devices)
+        await self.send_frame(frame_cache.encode_event(self.codec, event, wrap=False))
+
+    async def membership_revoked(self, event):
+        # Removed from a conversation (possibly in another process).
+        await self.leave_call(event["stream"], reply=False)
+        if event["stream"] in self.streams:
+            await self.discard_stream(event["stream"])
+            await self.send_frame(frame_cache.encode_event(self.codec, event, wrap=False))
+
+    async def call_peer(self, event):
+        # A peer joined, left, or (to us, as newcomers) says it is in the call.
+        call = self.calls.get(event["group"])
+        if call is None or event["peer_id"] == call.peer_id:
+            return
+        if event["action"] == "left":
+            call.peers.pop(event["peer_id"], None)
+        else:
+            call.peers[event["peer_id"]] = (event["user_id"], event["channel"])
+            if event["action"] == "joined":
+                await call.introduce(event["channel"])
+        await self.send_event(event, self.frame(event))
 
     async def webrtc_signal(self, event):
-        if event.get("sender_channel") != self.channel_name:
-            await self.send(text_data=json.dumps(event["message"]))
+        # Sent to this socket alone by a peer of one of its calls.
+        call = self.calls.get(event["group"])
+        if call is not None and event["peer_id"] in call.peers:
+            await self.send_event(event, self.frame(event))
+
+
+# Per-conversation URLs from before multiplexing: the socket is bound to one
+# stream, frames need no "stream" key and payloads are sent unwrapped.
+class SingleStreamConsumer(MultiplexConsumer, metaclass=ABCMeta):
+    control_frames = False
+
+    @abstractmethod
+    def stream_name(self):
+        """The stream this socket is bound to, from its URL route kwargs."""
+
+    def initial_streams(self):
+        return (self.stream_name(),)
+
+    def frame_stream(self, data):
+        return self.stream_name()
+
+    def frame(self, event):
+        return frame_cache.encode_event(self.codec, event, wrap=False)
+
+    async def membership_revoked(self, event):
+        if event["stream"] == self.stream_name():
+            await self.leave_call(event["stream"], reply=False)
+            await self.close()
+
+class DirectMessageConsumer(SingleStreamConsumer):
+    def stream_name(self):
+        return conversation_group(dm_group_id=self.scope['url_route']['kwargs']['group_id'])
+
+class ChannelConsumer(SingleStreamConsumer):
+    def stream_name(self):
+        return conversation_group(channel_id=self.scope['url_route']['kwargs']['channel_id'])
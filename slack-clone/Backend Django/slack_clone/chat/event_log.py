@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .protocol import dumps
+
+# Per-conversation event log for reconnect catch-up
+#
+# Every message broadcast to a conversation stream gets the stream's next
+# sequence number ("seq" in the payload), from a counter in the default cache
+# (cache.incr is atomic in Redis, so numbers are unique across workers). The
+# encoded event is also stored in a ring of SIZE slots per stream, slot
+# seq % SIZE, that expire after TTL seconds.
+#
+# A client that reconnects with the last seq it saw gets the events after it
+# in one "replay" frame, read with one get_many. If any of them was already
+# overwritten or expired it gets "resync" instead and reloads through REST.
+#
+# Events are logged before they are broadcast, so a replay right after
+# subscribing may overlap with live frames: clients drop seqs they have seen.
+
+def options():
+    return {"SIZE": 500, "TTL": 24 * 60 * 60, **getattr(settings, "CHAT_EVENT_LOG", {})}
+
+
+def seq_key(stream):
+    return f"chat:seq:{stream}"
+
+
+def slot_key(stream, seq, size):
+    return f"chat:log:{stream}:{seq % size}"
+
+
+def current_seq(stream):
+    return cache.get(seq_key(stream), 0)
+
+
+def current_seqs(streams):
+    keys = {seq_key(stream): stream for stream in streams}
+    found = cache.get_many(keys)
+    return {stream: found.get(key, 0) for key, stream in keys.items()}
+
+
+def reserve(stream, count):
+    # -> the first of `count` consecutive sequence numbers
+    key = seq_key(stream)
+    try:
+        last = cache.incr(key, count)
+    except ValueError:
+        cache.add(key, 0, None)
+        last = cache.incr(key, count)
+    return last - count + 1
+
+
+def record(items):
+    # [(stream, payload)] -> the payloads with their seq, as JSON text, in order.
+    opts = options()
+    by_stream = defaultdict(list)
+    for index, (stream, _) in enumerate(items):
+        by_stream[stream].append(index)
+
+    texts = [None] * len(items)
+    slots = {}
+    for stream, indexes in by_stream.items():
+        first = reserve(stream, len(indexes))
+        for seq, index in enumerate(indexes, first):
+            texts[index] = dumps({**items[index][1], "seq": seq})
+            slots[slot_key(stream, seq, opts["SIZE"])] = (seq, texts[index])
+    cache.set_many(slots, opts["TTL"])
+    return texts
+
+
+def replay_text(stream, seq, texts):
+    # One frame for the whole catch-up; the events are already JSON.
+    return '{"type":"replay","stream":%s,"seq":%d,"events":[%s]}' % (dumps(stream), seq, ",".join(texts))
+
+
+def replay(stream, last_seq):
+    # -> (current seq, texts of the events after last_seq), or
+    #    (current seq, None) when they are no longer all in the log.
+    size = options()["SIZE"]
+    current = current_seq(stream)
+    if last_seq > current or current - last_seq > size:
+        return current, None
+
+    seqs = range(last_seq + 1, current + 1)
+    keys = [slot_key(stream, seq, size) for seq in seqs]
+    found = cache.get_many(keys)
+    texts = []
+    for seq, key in zip(seqs, keys):
+        entry = found.get(key)
+        if entry is None or entry[0] != seq:
+            break
+        texts.append(entry[1])
+    else:
+        return current, texts
+
+    # A hole with newer events after it was evicted: replay can't fill it. A
+    # missing tail is events still being published, which arrive live.
+    if any(key in found and found[key][0] > seq for key in keys[len(texts):]):
+        return current, None
+    return last_seq + len(texts), texts
+
+
+# State versions for bootstrap ETags (chat.bootstrap)
+#
+# Counters for what seqs don't cover: a global one for the directory
+# (workspaces, channels, profiles), one per stream (message edits and
+# deletes, a DM group's name and participants) and one per user (read
+# cursors, memberships). Bumped by chat.signals.
+
+DIRECTORY_VERSION_KEY = "chat:version:directory"
+
+
+def user_version_key(user_id):
+    return f"chat:version:user:{user_id}"
+
+
+def stream_version_key(stream):
+    return f"chat:version:stream:{stream}"
+
+
+def bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def bump_directory():
+    bump(DIRECTORY_VERSION_KEY)
+
+
+def bump_users(user_ids):
+    for user_id in user_ids:
+        bump(user_version_key(user_id))
+
+
+def bump_streams(streams):
+    for stream in streams:
+        bump(stream_version_key(stream))
@@ -0,0 +1,166 @@
+import random
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils.module_loading import import_string
+
+# Read-through cache for conversation history pages
+#
+# The newest page of a busy channel is requested by every member who opens
+# it. MessageListCreateView keeps the rendered JSON of each page here, keyed
+# by conversation, page parameters and the conversation's version, so a hit
+# costs two cache reads and no query or serialization.
+#
+# Versions live in the default cache (shared by every worker) and are bumped
+# after each commit that creates, edits or deletes a message in the
+# conversation; pages under older versions are never read again and age out
+# of the backend. A missing version starts at a random value, so pages cached
+# under a version that was evicted can't come back.
+#
+# Concurrent misses for the same page in one process are single-flight: one
+# request renders, the others wait for its result.
+
+def options():
+    return {
+        "BACKEND": "chat.history_cache.LocalLRUBackend",
+        "MAX_BYTES": 64 * 1024 ** 2,
+        "CACHE_ALIAS": "default",
+        "TIMEOUT": 300,
+        **getattr(settings, "CHAT_HISTORY_CACHE", {}),
+    }
+
+
+def version_key(stream):
+    return f"chat:history:version:{stream}"
+
+
+class LocalLRUBackend:
+    # Per-process LRU bounded by the total size of the cached pages.
+    def __init__(self, max_bytes=64 * 1024 ** 2, **kwargs):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.size, "evictions": self.evictions}
+
+
+class DjangoCacheBackend:
+    # Shared between workers; eviction is up to the cache server.
+    def __init__(self, cache_alias="default", timeout=300, **kwargs):
+        self.cache = caches[cache_alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, body):
+        self.cache.set(key, body, self.timeout)
+
+    def stats(self):
+        return {}
+
+
+class HistoryCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.inflight = {}  # key -> Event set when the leader is done
+        self.lock = threading.Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.hits = self.misses = self.coalesced = self.invalidations = 0
+
+    def version(self, stream):
+        version = cache.get(version_key(stream))
+        if version is None:
+            cache.add(version_key(stream), random.getrandbits(48), None)
+            version = cache.get(version_key(stream))
+        return version
+
+    def invalidate(self, streams):
+        for stream in streams:
+            try:
+                cache.incr(version_key(stream))
+            except ValueError:
+                pass  # no version yet, so nothing cached either
+            self.invalidations += 1
+
+    def get_or_render(self, stream, params, render):
+        # -> the page's JSON bytes; render() produces them on a miss.
+        key = f"chat:history:{stream}:{self.version(stream)}:{params}"
+        body = self.backend.get(key)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        with self.lock:
+            event = self.inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self.inflight[key] = threading.Event()
+        if not leader:
+            # Someone is rendering this page: wait for it, then read it.
+            event.wait(timeout=5)
+            body = self.backend.get(key)
+            if body is not None:
+                self.coalesced += 1
+                return body
+
+        self.misses += 1
+        try:
+            body = render()
+            self.backend.set(key, body)
+        finally:
+            if leader:
+                with self.lock:
+                    del self.inflight[key]
+                event.set()
+        return body
+
+    def stats(self):
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else None,
+            "invalidations": self.invalidations,
+            **self.backend.stats(),
+        }
+
+
+def create_history_cache():
+    opts = options()
+    backend = import_string(opts["BACKEND"])(
+        max_bytes=opts["MAX_BYTES"], cache_alias=opts["CACHE_ALIAS"], timeout=opts["TIMEOUT"],
+    )
+    return HistoryCache(backend)
+
+
+history_cache = create_history_cache()
@@ -0,0 +1,388 @@
+import asyncio
+import base64
+import itertools
+import json
+import os
+import random
+import string
+import struct
+import time
+import weakref
+import zlib
+from collections import deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+# Sharded multi-process channel layer
+#
+# ChannelBroker is a small asyncio server holding channel queues and group
+# memberships, listening on a Unix socket. Run one broker per shard
+# (`manage.py runchannelbroker <socket>`), point every ASGI worker at the same
+# list of sockets, and BrokerChannelLayer hashes each channel and group onto
+# a shard. group_send reads the members from the group's shard and sends one
+# batched request per shard that holds member channels, so fan-out work is
+# spread across broker processes instead of running in a single one.
+#
+# Queues are dropped when the worker connection that received from them
+# closes, and a periodic sweep drops the ones whose messages have all
+# expired (channels nobody received from before going away), so the broker
+# holds no state for dead channels beyond one expiry.
+#
+# Frames are a 4-byte big-endian length followed by a JSON body; bytes
+# values travel as {"__bytes__": "<base64>"}.
+
+HEADER = struct.Struct(">I")
+
+
+def _default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    raise TypeError(f"{type(value).__name__} is not serializable by the channel broker")
+
+
+def _object_hook(value):
+    if len(value) == 1 and "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+
+def encode_frame(payload):
+    body = json.dumps(payload, default=_default, separators=(",", ":")).encode()
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(HEADER.size)
+    body = await reader.readexactly(HEADER.unpack(header)[0])
+    return json.loads(body, object_hook=_object_hook)
+
+
+def shard_for(name, shard_count):
+    return zlib.crc32(name.encode()) % shard_count
+
+
+class ChannelBroker:
+    def __init__(self, group_expiry=86400, sweep_interval=60):
+        self.group_expiry = group_expiry
+        self.sweep_interval = sweep_interval
+        self.next_sweep = time.time() + sweep_interval
+        self.queues = {}   # channel -> deque[(expires_at, message)]
+        self.waiters = {}  # channel -> deque[Future]
+        self.groups = {}   # group -> {channel: joined_at}
+        self.counters = {"delivered": 0, "full": 0, "expired": 0}
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        return await asyncio.start_unix_server(self.handle_connection, path=path)
+
+    async def serve_forever(self, path):
+        server = await self.serve(path)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        tasks = {}
+        receiving = set()  # channels read through this connection
+        try:
+            while True:
+                try:
+                    request = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request["op"] == "cancel":
+                    task = tasks.pop(request["target"], None)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                if request["op"] == "receive":
+                    receiving.add(request["args"]["channel"])
+                task = asyncio.ensure_future(self.dispatch(request, writer))
+                tasks[request["id"]] = task
+                task.add_done_callback(lambda _, request_id=request["id"]: tasks.pop(request_id, None))
+        finally:
+            for task in list(tasks.values()):
+                task.cancel()
+            # The worker that read these channels is gone, and its channel
+            # names are never reused.
+            for channel in receiving:
+                self.queues.pop(channel, None)
+            writer.close()
+
+    async def dispatch(self, request, writer):
+        try:
+            result = await getattr(self, "op_" + request["op"])(**request.get("args", {}))
+            response = {"id": request["id"], "result": result}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            response = {"id": request["id"], "error": f"{type(e).__name__}: {e}"}
+        if not writer.is_closing():
+            writer.write(encode_frame(response))
+
+    # ------------------------ QUEUES ------------------------
+
+    def push(self, channel, message, capacity, expiry):
+        self.sweep()
+        waiters = self.waiters.get(channel)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(message)
+                self.counters["delivered"] += 1
+                return True
+
+        queue = self.queues.setdefault(channel, deque())
+        self.expire(queue)
+        if len(queue) >= capacity:
+            self.counters["full"] += 1
+            return False
+        queue.append((time.time() + expiry, message))
+        return True
+
+    def expire(self, queue):
+        now = time.time()
+        while queue and queue[0][0] < now:
+            queue.popleft()
+            self.counters["expired"] += 1
+
+    def sweep(self):
+        now = time.time()
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + self.sweep_interval
+        for channel, queue in list(self.queues.items()):
+            self.expire(queue)
+            if not queue:
+                del self.queues[channel]
+
+    async def op_send(self, channel, message, capacity, expiry):
+        return self.push(channel, message, capacity, expiry)
+
+    async def op_send_many(self, channels, message, capacity, expiry):
+        # Returns the channels that were at capacity.
+        return [channel for channel in channels if not self.push(channel, message, capacity, expiry)]
+
+    async def op_receive(self, channel):
+        queue = self.queues.get(channel)
+        if queue:
+            self.expire(queue)
+            if queue:
+                _, message = queue.popleft()
+                if not queue:
+                    del self.queues[channel]
+                self.counters["delivered"] += 1
+                return message
+
+        future = asyncio.get_running_loop().create_future()
+        waiters = self.waiters.setdefault(channel, deque())
+        waiters.append(future)
+        try:
+            return await future
+        finally:
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self.waiters.pop(channel, None)
+
+    # ------------------------ GROUPS ------------------------
+
+    async def op_group_add(self, group, channel):
+        self.groups.setdefault(group, {})[channel] = time.time()
+
+    async def op_group_discard(self, group, channel):
+        members = self.groups.get(group)
+        if members:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    async def op_group_channels(self, group):
+        members = self.groups.get(group, {})
+        cutoff = time.time() - self.group_expiry
+        for channel in [c for c, joined_at in members.items() if joined_at < cutoff]:
+            del members[channel]
+        return list(members)
+
+    # ------------------------ ADMIN ------------------------
+
+    async def op_flush(self):
+        self.queues.clear()
+        self.groups.clear()
+
+    async def op_stats(self):
+        depths = [len(queue) for queue in self.queues.values()]
+        return {
+            **self.counters,
+            "channels": len(self.queues),
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "waiters": sum(len(w) for w in self.waiters.values()),
+            "groups": len(self.groups),
+        }
+
+
+class BrokerConnection:
+    def __init__(self, path):
+        self.path = path
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.writer = None
+        self.read_task = None
+        self.connecting = None
+
+    async def ensure_connected(self):
+        if self.writer is not None and not self.writer.is_closing():
+            return
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(self.connect())
+        try:
+            await asyncio.shield(self.connecting)
+        finally:
+            self.connecting = None
+
+    async def connect(self):
+        reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.read_task = asyncio.ensure_future(self.read_loop(reader))
+
+    async def read_loop(self, reader):
+        try:
+            while True:
+                response = await read_frame(reader)
+                future = self.pending.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(RuntimeError(response["error"]))
+                else:
+                    future.set_result(response["result"])
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Channel broker {self.path} went away: {e}"))
+            self.pending.clear()
+            self.writer.close()
+
+    async def request(self, op, **args):
+        await self.ensure_connected()
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(encode_frame({"id": request_id, "op": op, "args": args}))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # e.g. a consumer's blocking receive() being torn down
+            self.pending.pop(request_id, None)
+            if not self.writer.is_closing():
+                self.writer.write(encode_frame({"id": next(self.ids), "op": "cancel", "target": request_id}))
+            raise
+
+    async def close(self):
+        if self.read_task is not None:
+            self.read_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(self, hosts, expiry=60, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        if not hosts:
+            raise ValueError("BrokerChannelLayer needs at least one broker socket in 'hosts'.")
+        self.hosts = list(hosts)
+        self.client_prefix = "".join(random.choice(string.ascii_letters) for _ in range(8))
+        # asgiref runs sync views' async_to_sync calls on other event loops,
+        # so connections are kept per loop.
+        self.connections = weakref.WeakKeyDictionary()
+        self.metrics = {"sends": 0, "group_sends": 0, "fanout": 0, "channel_full": 0, "in_flight": 0}
+
+    def loop_connections(self):
+        loop = asyncio.get_running_loop()
+        connections = self.connections.get(loop)
+        if connections is None:
+            connections = self.connections[loop] = [BrokerConnection(path) for path in self.hosts]
+        return connections
+
+    def shard(self, name):
+        return self.loop_connections()[shard_for(name, len(self.hosts))]
+
+    async def call(self, name, op, **args):
+        self.metrics["in_flight"] += 1
+        try:
+            return await self.shard(name).request(op, **args)
+        finally:
+            self.metrics["in_flight"] -= 1
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        self.metrics["sends"] += 1
+        delivered = await self.call(
+            channel, "send", channel=channel, message=message,
+            capacity=self.get_capacity(channel), expiry=self.expiry,
+        )
+        if not delivered:
+            self.metrics["channel_full"] += 1
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        return await self.shard(channel).request("receive", channel=channel)
+
+    async def new_channel(self, prefix="specific."):
+        suffix = "".join(random.choice(string.ascii_letters) for _ in range(12))
+        return f"{prefix}.broker.{self.client_prefix}!{suffix}"
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.call(group, "group_add", group=group, channel=channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.call(group, "group_discard", group=group, channel=channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        self.metrics["group_sends"] += 1
+        channels = await self.call(group, "group_channels", group=group)
+        if not channels:
+            return
+
+        by_shard = {}
+        for channel in channels:
+            by_shard.setdefault(shard_for(channel, len(self.hosts)), []).append(channel)
+        results = await asyncio.gather(*(
+            self.call(
+                members[0], "send_many", channels=members, message=message,
+                capacity=self.get_capacity(members[0]), expiry=self.expiry,
+            )
+            for members in by_shard.values()
+        ))
+        self.metrics["fanout"] += len(channels)
+        # Full channels are skipped, as with the other layers; count them so
+        # slow consumers show up in stats().
+        self.metrics["channel_full"] += sum(len(full) for full in results)
+
+    async def flush(self):
+        await asyncio.gather(*(self.call_shard(index, "flush") for index in range(len(self.hosts))))
+
+    async def stats(self):
+        shards = await asyncio.gather(*(self.call_shard(index, "stats") for index in range(len(self.hosts))))
+        return {"client": dict(self.metrics), "shards": dict(zip(self.hosts, shards))}
+
+    async def call_shard(self, index, op, **args):
+        return await self.loop_connections()[index].request(op, **args)
+
+    async def close(self):
+        connections = self.connections.pop(asyncio.get_running_loop(), [])
+        await asyncio.gather(*(connection.close() for connection in connections))
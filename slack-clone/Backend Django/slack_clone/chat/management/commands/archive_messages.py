@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chat.retention import archive_expired
+
+
+class Command(BaseCommand):
+    help = "Move messages past their conversation's retention age into compressed archive segments."
+
+    def handle(self, *args, **options):
+        messages, segments = archive_expired()
+        self.stdout.write(f"Archived {messages} messages into {segments} segments.")
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+from chat.attachments import blob_path, discard_upload
+from chat.models import Attachment, UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete stale upload sessions and attachment files no message or archived message refers to."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than", type=int, default=settings.CHAT_ATTACHMENTS["SESSION_TTL"],
+            help="Grace period in seconds (default: CHAT_ATTACHMENTS['SESSION_TTL']).",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["older_than"])
+
+        sessions = 0
+        for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+            discard_upload(session)
+            sessions += 1
+
+        blobs = 0
+        for attachment in Attachment.objects.filter(
+            messages__isnull=True, archive_segments__isnull=True, created_at__lt=cutoff
+        ).iterator():
+            try:
+                attachment.delete()
+            except ProtectedError:
+                continue  # attached to a message since the query ran
+            blob_path(attachment.sha256).unlink(missing_ok=True)
+            blobs += 1
+
+        self.stdout.write(f"Pruned {sessions} upload sessions and {blobs} attachments.")
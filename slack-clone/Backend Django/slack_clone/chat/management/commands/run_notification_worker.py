@@ -0,0 +1,28 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from chat.notifications import drain, options, run_worker
+
+
+class Command(BaseCommand):
+    help = "Process queued message notifications and build per-user digests."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=options()["WORKERS"],
+            help="Worker threads (default: CHAT_NOTIFICATIONS['WORKERS']).",
+        )
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit.")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            jobs, digests = drain()
+            self.stdout.write(f"Processed {jobs} notification jobs and built {digests} digests.")
+            return
+
+        self.stdout.write(f"Notification worker running with {options['workers']} threads.")
+        try:
+            run_worker(options["workers"], threading.Event())
+        except KeyboardInterrupt:
+            pass
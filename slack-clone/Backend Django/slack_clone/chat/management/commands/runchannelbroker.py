@@ -0,0 +1,21 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from chat.layers import ChannelBroker
+
+
+class Command(BaseCommand):
+    help = "Run one channel-layer broker shard on a Unix socket (see chat.layers.BrokerChannelLayer)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("socket", help="Path of the Unix socket to listen on.")
+        parser.add_argument("--group-expiry", type=int, default=86400)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Channel broker listening on {options['socket']}")
+        broker = ChannelBroker(group_expiry=options["group_expiry"])
+        try:
+            asyncio.run(broker.serve_forever(options["socket"]))
+        except KeyboardInterrupt:
+            pass
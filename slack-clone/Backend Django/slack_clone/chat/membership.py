@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import F
+
+from .broadcast import conversation_group, group_send_text, user_group
+from .models import Channel, DirectMessageGroup
+
+# Membership index
+#
+# Per-user set of conversation groups ("channel_5", "dm_7") the user belongs
+# to, so REST permission checks and WebSocket subscribes are a set lookup
+# instead of a membership query. Sets are loaded in one query on first use
+# (or on connect), kept in a bounded LRU and dropped by chat.signals whenever
+# the user's channel members / DM participants rows change.
+#
+# Changes made in another worker process only reach this one through TTL
+# expiry, so a miss is always re-checked against the database before access
+# is refused: a user added elsewhere is never locked out, and a user removed
+# elsewhere keeps access for at most TTL seconds.
+
+
+def load_conversations(user_id):
+    channels = Channel.members.through.objects.filter(user_id=user_id).values_list("channel_id")
+    # Negative ids mark DM groups so both halves fit in one UNION.
+    dm_groups = (
+        DirectMessageGroup.participants.through.objects.filter(user_id=user_id)
+        .annotate(negated_id=F("directmessagegroup_id") * -1)
+        .values_list("negated_id")
+    )
+    return frozenset(
+        conversation_group(channel_id=pk) if pk > 0 else conversation_group(dm_group_id=-pk)
+        for (pk,) in channels.union(dm_groups, all=True)
+    )
+
+
+def is_member_in_db(user_id, stream):
+    kind, _, pk = stream.partition("_")
+    if kind == "channel":
+        return Channel.members.through.objects.filter(user_id=user_id, channel_id=pk).exists()
+    return DirectMessageGroup.participants.through.objects.filter(user_id=user_id, directmessagegroup_id=pk).exists()
+
+
+class MembershipIndex:
+    def __init__(self, max_users=50000, ttl=60):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.entries = OrderedDict()  # user_id -> (streams, expires_at)
+        # Bumped by every invalidation, so a load that raced with one isn't cached.
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        # Cached set or None; never touches the database.
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            streams, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return streams
+
+    def load(self, user_id):
+        generation = self.generation
+        streams = load_conversations(user_id)
+        self.set(user_id, streams, generation)
+        return streams
+
+    def set(self, user_id, streams, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries.pop(user_id, None)
+            self.entries[user_id] = (streams, time.time() + self.ttl)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+    def is_cached_member(self, user_id, stream):
+        return stream in (self.get(user_id) or ())
+
+    def is_member(self, user_id, stream):
+        generation = self.generation
+        streams = self.get(user_id)
+        if streams is None:
+            streams = self.load(user_id)
+        if stream in streams:
+            return True
+        if not is_member_in_db(user_id, stream):
+            return False
+        # Joined in another process since the set was loaded.
+        self.set(user_id, streams | {stream}, generation)
+        return True
+
+    def invalidate_users(self, user_ids):
+        with self.lock:
+            self.generation += 1
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+_index_options = getattr(settings, "CHAT_MEMBERSHIP_CACHE", {})
+membership_index = MembershipIndex(
+    max_users=_index_options.get("MAX_USERS", 50000),
+    ttl=_index_options.get("TTL", 60),
+)
+
+
+async def is_member_async(user_id, stream):
+    # Cache hits stay on the event loop; only misses go to a DB thread.
+    if membership_index.is_cached_member(user_id, stream):
+        return True
+    return await database_sync_to_async(membership_index.is_member)(user_id, stream)
+
+
+def revoke_streams(memberships):
+    # Tells every live socket of each (user_id, stream) pair to leave the
+    # stream; consumers in any process get it through the user's group.
+    for user_id, stream in memberships:
+        text = json.dumps({"type": "unsubscribed", "stream": stream, "reason": "membership_revoked"})
+        async_to_sync(group_send_text)(user_group(user_id), text, "membership.revoked", stream=stream)
@@ -0,0 +1,371 @@
+import cProfile
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+# Hot-path instrumentation, in Prometheus text format
+#
+# Histograms and counters for what costs time per socket, per frame or per
+# request: WebSocket handshakes, token resolution, frame handling, group
+# sends, fan-out size and lag, per-socket sends, serialization, and the time,
+# CPU and queries behind each HTTP view (chat.middleware.RequestMetrics-
+# Middleware). /api/metrics/ exposes them with the outbox and history cache
+# numbers; everything is per worker process, so scrape every worker.
+#
+# With ENABLED off every hook costs one attribute check: start() returns
+# None and observe(None) returns at once. Label values are bounded: views by
+# URL name, frames by type. Per-stream numbers (sockets, frame handling time,
+# deliveries) are kept only while the stream has a socket in this process, so
+# they are bounded by the live streams rather than every stream ever seen; a
+# stream that comes back starts from zero, which scrapers read as a counter
+# reset. Only the TOP_STREAMS busiest are exported.
+#
+# PROFILE_SAMPLE_RATE > 0 runs that fraction of HTTP requests under cProfile
+# and accumulates the stats per view (/api/metrics/profile/).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+RECENT_EVENTS = 1024
+
+
+def options():
+    return {
+        "ENABLED": True,
+        "TOP_STREAMS": 20,
+        "PROFILE_SAMPLE_RATE": 0.0,
+        "PROFILE_TOP": 40,
+        "SCRAPE_TOKEN": None,
+        **getattr(settings, "CHAT_METRICS", {}),
+    }
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class HistogramMetric:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}  # label values -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        for labels, values in sorted(series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                total += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{format_labels(self.labels, labels, le)} {total}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {values[-1]}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {total}"
+
+
+class CounterMetric:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, amount, *labels):
+        with self.lock:
+            self.series[labels] += amount
+
+    def samples(self):
+        with self.lock:
+            series = dict(self.series)
+        for labels, value in sorted(series.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+def family(name, kind, documentation, samples):
+    # One metric family computed at scrape time: [(label dict, value)].
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels.keys(), labels.values())} {value}")
+    return lines
+
+
+class Metrics:
+    def __init__(self, enabled=True, top_streams=20, profile_sample_rate=0.0, profile_top=40):
+        self.enabled = enabled
+        self.top_streams = top_streams
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_top = profile_top
+        self.metrics = []
+
+        self.handshake = self.histogram(
+            "chat_ws_handshake_seconds", "WebSocket connect handling, from the request to accept or reject.",
+            LATENCY_BUCKETS, ("consumer",),
+        )
+        self.auth = self.histogram(
+            "chat_ws_auth_seconds", "Resolving a WebSocket token to a user.", LATENCY_BUCKETS, ("result",),
+        )
+        self.receive = self.histogram(
+            "chat_ws_receive_seconds", "Handling one incoming WebSocket frame.", LATENCY_BUCKETS, ("frame",),
+        )
+        self.send = self.histogram("chat_ws_send_seconds", "Writing one frame to one socket.", LATENCY_BUCKETS)
+        self.group_send = self.histogram(
+            "chat_group_send_seconds", "channel_layer.group_send calls.", LATENCY_BUCKETS, ("event",),
+        )
+        self.fanout_sockets = self.histogram(
+            "chat_fanout_sockets", "Sockets in this process a broadcast event was delivered to.", SIZE_BUCKETS,
+        )
+        self.fanout_lag = self.histogram(
+            "chat_fanout_lag_seconds", "From group_send to the frame being queued for a socket.",
+            LATENCY_BUCKETS, ("kind",),
+        )
+        self.serialize = self.histogram(
+            "chat_serialize_seconds", "Serializing messages, history pages and wire frames.",
+            LATENCY_BUCKETS, ("what",),
+        )
+        self.request = self.histogram(
+            "chat_http_request_seconds", "HTTP request handling per view.", LATENCY_BUCKETS, ("view", "method"),
+        )
+        self.queries = self.histogram(
+            "chat_http_queries", "Database queries per HTTP request.", QUERY_BUCKETS, ("view", "method"),
+        )
+        self.query_seconds = self.counter(
+            "chat_http_query_seconds_total", "Time spent in database queries per view.", ("view", "method"),
+        )
+        self.cpu_seconds = self.counter(
+            "chat_http_cpu_seconds_total", "CPU time of the request thread per view.", ("view", "method"),
+        )
+        self.responses = self.counter(
+            "chat_http_responses_total", "HTTP responses per view and status class.", ("view", "method", "status"),
+        )
+
+        self.lock = threading.Lock()
+        self.stream_sockets = Counter()  # stream -> sockets subscribed in this process
+        self.stream_seconds = Counter()  # stream -> time spent handling its frames
+        self.stream_deliveries = Counter()  # stream -> frames queued for its sockets
+        self.profiles = {}  # view -> [samples, pstats.Stats]
+        self.recent_events = OrderedDict()  # event ids already counted by fanned_out
+
+    def histogram(self, *args):
+        metric = HistogramMetric(*args)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args):
+        metric = CounterMetric(*args)
+        self.metrics.append(metric)
+        return metric
+
+    # --- Hooks -----------------------------------------------------------
+
+    def start(self):
+        return time.perf_counter() if self.enabled else None
+
+    def observe(self, histogram, started, *labels):
+        if started is not None:
+            histogram.observe(time.perf_counter() - started, *labels)
+
+    def stream_joined(self, stream):
+        if self.enabled:
+            with self.lock:
+                self.stream_sockets[stream] += 1
+
+    def stream_left(self, stream):
+        if self.enabled:
+            with self.lock:
+                self.stream_sockets[stream] -= 1
+                if self.stream_sockets[stream] <= 0:
+                    del self.stream_sockets[stream]
+                    self.stream_seconds.pop(stream, None)
+                    self.stream_deliveries.pop(stream, None)
+
+    def frame_handled(self, stream, frame, started):
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self.receive.observe(elapsed, frame)
+        if stream is not None:
+            with self.lock:
+                if stream in self.stream_sockets:
+                    self.stream_seconds[stream] += elapsed
+
+    def delivered(self, event):
+        # A broadcast event was queued for one socket.
+        if not self.enabled:
+            return
+        if "sent_at" in event:
+            self.fanout_lag.observe(max(0.0, time.time() - event["sent_at"]), event.get("kind", "message"))
+        stream = event.get("group")
+        if stream is not None:
+            with self.lock:
+                if stream in self.stream_sockets:
+                    self.stream_deliveries[stream] += 1
+
+    def fanned_out(self, event):
+        # A broadcast event reached this process: observed once per event,
+        # however many sockets and wire formats it is encoded for.
+        event_id, stream = event.get("event_id"), event.get("group")
+        if event_id is None or stream is None:
+            return
+        with self.lock:
+            if event_id in self.recent_events:
+                return
+            self.recent_events[event_id] = None
+            if len(self.recent_events) > RECENT_EVENTS:
+                self.recent_events.popitem(last=False)
+            sockets = self.stream_sockets.get(stream, 0)
+        self.fanout_sockets.observe(sockets)
+
+    def profiler(self):
+        # A cProfile.Profile for a sampled request, or None.
+        if self.enabled and self.profile_sample_rate and random.random() < self.profile_sample_rate:
+            return cProfile.Profile()
+        return None
+
+    def add_profile(self, view, profiler):
+        with self.lock:
+            entry = self.profiles.get(view)
+            if entry is None:
+                self.profiles[view] = [1, pstats.Stats(profiler)]
+            else:
+                entry[0] += 1
+                entry[1].add(profiler)
+
+    # --- Export ----------------------------------------------------------
+
+    def profile_report(self):
+        with self.lock:
+            profiles = {view: (samples, stats.stats) for view, (samples, stats) in self.profiles.items()}
+        report = {}
+        for view, (samples, stats) in profiles.items():
+            rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[: self.profile_top]
+            report[view] = {
+                "samples": samples,
+                "functions": [
+                    {
+                        "function": f"{filename}:{line}({name})",
+                        "calls": calls,
+                        "tottime": tottime,
+                        "cumtime": cumtime,
+                    }
+                    for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+                ],
+            }
+        return report
+
+    def top(self, counter):
+        with self.lock:
+            return counter.most_common(self.top_streams)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += [f"# HELP {metric.name} {metric.documentation}", f"# TYPE {metric.name} {metric.kind}"]
+            lines += metric.samples()
+
+        with self.lock:
+            streams = len(self.stream_sockets)
+            sockets = sum(self.stream_sockets.values())
+        lines += family("chat_streams", "gauge", "Streams with a subscribed socket in this process.", [({}, streams)])
+        lines += family("chat_stream_subscriptions", "gauge", "Stream subscriptions in this process.", [({}, sockets)])
+        lines += family(
+            "chat_stream_sockets", "gauge", "Sockets subscribed per stream (busiest streams only).",
+            [({"stream": stream}, count) for stream, count in self.top(self.stream_sockets)],
+        )
+        lines += family(
+            "chat_stream_frame_seconds_total", "counter", "Time handling incoming frames per stream (busiest only).",
+            [({"stream": stream}, seconds) for stream, seconds in self.top(self.stream_seconds)],
+        )
+        lines += family(
+            "chat_stream_deliveries_total", "counter", "Frames queued for sockets per stream (busiest only).",
+            [({"stream": stream}, count) for stream, count in self.top(self.stream_deliveries)],
+        )
+        lines += self.render_outbox() + self.render_history_cache()
+        return "\n".join(lines) + "\n"
+
+    def render_outbox(self):
+        from .outbox import outbox_metrics
+
+        snapshot = outbox_metrics.snapshot()
+        lines = []
+        for key in ("connections", "queued_frames", "queued_bytes", "max_depth", "congested"):
+            lines += family(f"chat_outbox_{key}", "gauge", f"Outbox {key.replace('_', ' ')}.", [({}, snapshot[key])])
+        for key in ("frames_queued", "frames_sent", "frames_coalesced"):
+            lines += family(f"chat_outbox_{key}_total", "counter", f"Outbox {key.replace('_', ' ')}.", [({}, snapshot[key])])
+        lines += family(
+            "chat_outbox_frames_dropped_total", "counter", "Droppable frames shed by outboxes.",
+            [({"kind": kind}, count) for kind, count in sorted(snapshot["frames_dropped"].items())],
+        )
+        lines += family(
+            "chat_outbox_evictions_total", "counter", "Sockets closed by their outbox.",
+            [({"reason": reason}, count) for reason, count in sorted(snapshot["evicted"].items())],
+        )
+        return lines
+
+    def render_history_cache(self):
+        from .history_cache import history_cache
+
+        stats = history_cache.stats()
+        lines = []
+        for key in ("hits", "coalesced", "misses", "invalidations", "evictions"):
+            if key in stats:
+                lines += family(f"chat_history_cache_{key}_total", "counter", f"History cache {key}.", [({}, stats[key])])
+        for key in ("entries", "bytes"):
+            if key in stats:
+                lines += family(f"chat_history_cache_{key}", "gauge", f"History cache {key}.", [({}, stats[key])])
+        return lines
+
+    def reset_profiles(self):
+        with self.lock:
+            self.profiles.clear()
+
+    def reset(self):
+        # Counters and histograms; live gauges (sockets per stream) stay.
+        for metric in self.metrics:
+            with metric.lock:
+                metric.series.clear()
+        with self.lock:
+            self.stream_seconds.clear()
+            self.stream_deliveries.clear()
+            self.profiles.clear()
+
+
+def create_metrics():
+    opts = options()
+    return Metrics(
+        enabled=opts["ENABLED"],
+        top_streams=opts["TOP_STREAMS"],
+        profile_sample_rate=opts["PROFILE_SAMPLE_RATE"],
+        profile_top=opts["PROFILE_TOP"],
+    )
+
+
+metrics = create_metrics()
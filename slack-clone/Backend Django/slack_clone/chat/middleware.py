@@ -1,19 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
 from urllib.parse import parse_qs
-from channels.middleware import BaseMiddleware  
+from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
 
+from .metrics import metrics
+
 User = get_user_model()
 
+# Token -> user cache
+#
+# Bounded LRU keyed by the token's jti. Entries expire with the token (capped
+# at MAX_TTL so changes made in another worker process are picked up), and
+# chat.signals drops every entry of a user whenever that user is saved or
+# deleted, which covers deactivation.
+class TokenUserCache:
+    def __init__(self, max_size=50000, max_ttl=300):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.entries = OrderedDict()  # key -> (user, expires_at)
+        self.keys_by_user = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return user
+
+    def set(self, key, user, expires_at):
+        expires_at = min(expires_at, time.time() + self.max_ttl)
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (user, expires_at)
+            self.keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in self.keys_by_user.pop(user_id, ()):
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_user.clear()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.keys_by_user.get(entry[0].pk)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_user[entry[0].pk]
+
+
+_cache_options = getattr(settings, "CHAT_AUTH_CACHE", {})
+token_user_cache = TokenUserCache(
+    max_size=_cache_options.get("MAX_SIZE", 50000),
+    max_ttl=_cache_options.get("MAX_TTL", 300),
+)
+
+
 @database_sync_to_async
-def get_user_from_token(token_key):
+def load_user(user_id):
+    return User.objects.filter(id=user_id, is_active=True).first()
+
+
+async def get_user_from_token(token_key):
+    started = metrics.start()
+    user, result = await resolve_token(token_key)
+    metrics.observe(metrics.auth, started, result)
+    return user
+
+
+async def resolve_token(token_key):
+    # -> (user, "cached" / "loaded" / "invalid" / "inactive")
     try:
         token = AccessToken(token_key)
-        return User.objects.get(id=token["user_id"])
-    except Exception:
-        return AnonymousUser()
+        user_id = token["user_id"]
+    except (TokenError, KeyError):
+        return AnonymousUser(), "invalid"
+
+    key = token.get("jti") or f"user:{user_id}"
+    user = token_user_cache.get(key)
+    if user is not None:
+        return user, "cached"
+    user = await load_user(user_id)
+    if user is None:
+        return AnonymousUser(), "inactive"
+    token_user_cache.set(key, user, token["exp"])
+    return user, "loaded"
 
 class TokenAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
@@ -22,3 +114,57 @@ class TokenAuthMiddleware(BaseMiddleware):
 
         scope["user"] = await get_user_from_token(token_key)
         return await super().__call__(scope, receive, send)
+
+
+# Per-view HTTP metrics (see chat.metrics)
+#
+# Wall time, thread CPU time, status class and the number and duration of
+# default-database queries of every request, labelled by URL name. A sampled
+# fraction of requests also runs under cProfile.
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.enabled:
+            return self.get_response(request)
+
+        queries = QueryCounter()
+        profiler = metrics.profiler()
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        with connection.execute_wrapper(queries):
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    profiler = None  # another profiler is active in this thread
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+
+        match = request.resolver_match
+        labels = (match.view_name if match is not None else "unmatched", request.method)
+        metrics.request.observe(time.perf_counter() - started, *labels)
+        metrics.queries.observe(queries.count, *labels)
+        metrics.query_seconds.inc(queries.seconds, *labels)
+        metrics.cpu_seconds.inc(time.thread_time() - cpu_started, *labels)
+        metrics.responses.inc(1, *labels, f"{response.status_code // 100}xx")
+        if profiler is not None:
+            metrics.add_profile(labels[0], profiler)
+        return response
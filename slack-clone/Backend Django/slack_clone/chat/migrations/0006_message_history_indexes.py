@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Reverse-direction indexes for the auto-created membership tables. Django only
+# creates (owner_id, user_id) unique + single-column indexes; "which channels /
+# DMs / workspaces is this user in" needs (user_id, owner_id) to stay index-only.
+MEMBERSHIP_INDEXES = [
+    ("chat_channel_members_user_idx", "chat_channel_members", "user_id, channel_id"),
+    ("chat_workspace_members_user_idx", "chat_workspace_members", "user_id, workspace_id"),
+    ("chat_dmgroup_participants_user_idx", "chat_directmessagegroup_participants", "user_id, directmessagegroup_id"),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_file'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Build the composite indexes before dropping the FK indexes they cover.
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('channel__isnull', False)), fields=['channel', 'timestamp', 'id'], name='chat_msg_channel_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('dm_group__isnull', False)), fields=['dm_group', 'timestamp', 'id'], name='chat_msg_dm_group_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'timestamp'], name='chat_msg_sender_ts_idx'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='channel',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat.channel'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='dm_group',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat.directmessagegroup'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sender',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ] + [
+        migrations.RunSQL(
+            sql=f"CREATE INDEX {name} ON {table} ({columns})",
+            reverse_sql=f"DROP INDEX {name}",
+        )
+        for name, table, columns in MEMBERSHIP_INDEXES
+    ]
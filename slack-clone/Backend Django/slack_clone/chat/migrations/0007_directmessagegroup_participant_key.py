@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:02
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def key_for(user_ids):
+    # Same as DirectMessageGroup.key_for, frozen for this migration.
+    canonical = ",".join(str(pk) for pk in sorted(set(user_ids)))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def backfill_participant_keys(apps, schema_editor):
+    Group = apps.get_model("chat", "DirectMessageGroup")
+    Participant = Group.participants.through
+
+    participants = {}
+    for group_id, user_id in Participant.objects.values_list("directmessagegroup_id", "user_id").iterator():
+        participants.setdefault(group_id, []).append(user_id)
+
+    # Oldest group wins when duplicates already exist; the rest keep NULL.
+    seen = set()
+    for group_id in Group.objects.order_by("id").values_list("id", flat=True).iterator():
+        key = key_for(participants.get(group_id, []))
+        if key not in seen:
+            seen.add(key)
+            Group.objects.filter(id=group_id).update(participant_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directmessagegroup',
+            name='participant_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_participant_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='directmessagegroup',
+            name='participant_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
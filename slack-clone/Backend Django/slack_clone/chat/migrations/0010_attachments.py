@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+import hashlib
+import mimetypes
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def import_legacy_files(apps, schema_editor):
+    # 0005 stored uploads in Message.file, relative to MEDIA_ROOT. Copy every
+    # file that still exists into the blob store (layout frozen here, see
+    # chat.attachments) and point its message at it; the column is dropped
+    # below, and the original files are left where they were.
+    Message = apps.get_model("chat", "Message")
+    Attachment = apps.get_model("chat", "Attachment")
+    media_root = Path(settings.MEDIA_ROOT).resolve()
+    blobs = Path(settings.CHAT_ATTACHMENTS["ROOT"]) / "blobs"
+
+    legacy = Message.objects.exclude(file="").exclude(file=None).values_list("id", "sender_id", "file")
+    for message_id, sender_id, name in legacy.iterator():
+        source = media_root / name
+        if not source.is_file():
+            continue
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+
+        target = blobs / sha256[:2] / sha256[2:4] / sha256
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target)
+        attachment, _ = Attachment.objects.get_or_create(
+            sha256=sha256,
+            defaults={"size": source.stat().st_size, "content_type": mimetypes.guess_type(source.name)[0] or ""},
+        )
+        attachment.uploaders.add(sender_id)
+        Message.objects.filter(pk=message_id).update(attachment=attachment, attachment_name=os.path.basename(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('uploaders', models.ManyToManyField(related_name='attachments', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('received', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('attachment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.attachment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='chat.attachment'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(import_legacy_files, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='file',
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workspace',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_message_id', models.BigIntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('min_message_id', models.BigIntegerField()),
+                ('max_message_id', models.BigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attachments', models.ManyToManyField(blank=True, related_name='archive_segments', to='chat.attachment')),
+                ('channel', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chat.channel')),
+                ('dm_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chat.directmessagegroup')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('channel__isnull', False)), fields=['channel', 'last_timestamp', 'last_message_id'], name='chat_archive_channel_idx'), models.Index(condition=models.Q(('dm_group__isnull', False)), fields=['dm_group', 'last_timestamp', 'last_message_id'], name='chat_archive_dm_group_idx'), models.Index(fields=['min_message_id', 'max_message_id'], name='chat_archive_id_range_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,8 @@
+import hashlib
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 from django.db import models
@@ -11,6 +15,9 @@ class Workspace(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     members = models.ManyToManyField(User, related_name="workspaces")
+    # Messages older than this many days move to the archive (chat.retention);
+    # NULL keeps them in the messages table forever.
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
 
 class Channel(models.Model):
     workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name="channels", null=True, blank=True)
@@ -24,15 +31,238 @@ class DirectMessageGroup(models.Model):
     name = models.CharField(max_length=100, blank=True)  # Optional (e.g., "User1 & User2")
     participants = models.ManyToManyField(User, related_name="dm_groups")
     created_at = models.DateTimeField(auto_now_add=True)
+    # sha256 of the sorted participant ids, kept in sync by chat.signals.
+    # NULL only when another group already owns the same participant set.
+    participant_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    @staticmethod
+    def key_for(user_ids):
+        canonical = ",".join(str(pk) for pk in sorted({int(pk) for pk in user_ids}))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+class Attachment(models.Model):
+    # Content-addressed blob: one row and one file per distinct sha256, shared
+    # by every message that attaches the same bytes. See chat.attachments.
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Users who uploaded these bytes; only they may attach the blob to a message.
+    uploaders = models.ManyToManyField(User, related_name="attachments")
+
+class UploadSession(models.Model):
+    # A resumable upload in progress: chunks are appended to a part file until
+    # `received` reaches `size`, then the file is moved into the blob store.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions")
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    # Set once the upload is complete; kept so a lost final response can be recovered.
+    attachment = models.ForeignKey(Attachment, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class MessageQuerySet(models.QuerySet):
+    def with_sender(self):
+        # Read path for MessageSerializer: one JOIN each for the sender and the
+        # attachment, and only the columns the serializer actually renders.
+        return self.select_related("sender", "attachment").only(
+            "id", "channel_id", "dm_group_id", "content", "timestamp", "is_read", "attachment_name",
+            "parent_id", "reply_count", "last_reply_at", "reaction_count",
+            "sender__id", "sender__username", "sender__email",
+            "attachment__id", "attachment__size", "attachment__content_type",
+        )
+
+    def visible_to(self, user):
+        # Messages in conversations the user belongs to.
+        channel_ids = Channel.members.through.objects.filter(user=user).values("channel_id")
+        dm_group_ids = DirectMessageGroup.participants.through.objects.filter(user=user).values("directmessagegroup_id")
+        return self.filter(models.Q(channel_id__in=channel_ids) | models.Q(dm_group_id__in=dm_group_ids))
 
 class Message(models.Model):
     # Can belong to a Channel or a Direct Message (DM)
-    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=True, blank=True, related_name="messages")
-    dm_group = models.ForeignKey(DirectMessageGroup, on_delete=models.CASCADE, null=True, blank=True, related_name="messages")
-    sender = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The single-column FK indexes are covered by the composite indexes in Meta.
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=True, blank=True, related_name="messages", db_index=False)
+    dm_group = models.ForeignKey(DirectMessageGroup, on_delete=models.CASCADE, null=True, blank=True, related_name="messages", db_index=False)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # The blob is shared between messages; the filename belongs to the message.
+    attachment = models.ForeignKey(Attachment, on_delete=models.PROTECT, null=True, blank=True, related_name="messages")
+    attachment_name = models.CharField(max_length=255, blank=True)
+    # Thread replies point at the thread's first message. The counters are
+    # denormalized by chat.reactions with F() updates, so history pages need
+    # no per-message aggregates.
+    parent = models.ForeignKey("self", on_delete=models.CASCADE, null=True, blank=True, related_name="replies", db_index=False)
+    reply_count = models.PositiveIntegerField(default=0)
+    last_reply_at = models.DateTimeField(null=True, blank=True)
+    reaction_count = models.PositiveIntegerField(default=0)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # History pages: WHERE channel_id = ? ORDER BY timestamp, id (keyset)
+            models.Index(
+                fields=["channel", "timestamp", "id"],
+                name="chat_msg_channel_ts_idx",
+                condition=models.Q(channel__isnull=False),
+            ),
+            models.Index(
+                fields=["dm_group", "timestamp", "id"],
+                name="chat_msg_dm_group_ts_idx",
+                condition=models.Q(dm_group__isnull=False),
+            ),
+            models.Index(fields=["sender", "timestamp"], name="chat_msg_sender_ts_idx"),
+            # Thread pages: WHERE parent_id = ? ORDER BY timestamp, id (keyset)
+            models.Index(
+                fields=["parent", "timestamp", "id"],
+                name="chat_msg_parent_ts_idx",
+                condition=models.Q(parent__isnull=False),
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.sender.username}: {self.content[:20]}..."
\ No newline at end of file
+        return f"{self.sender.username}: {self.content[:20]}..."
+
+class ArchiveSegment(models.Model):
+    # A run of archived messages of one conversation, oldest first, in one
+    # gzipped JSON Lines file under CHAT_RETENTION["ROOT"]. See chat.archive.
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=True, blank=True, related_name="archive_segments")
+    dm_group = models.ForeignKey(DirectMessageGroup, on_delete=models.CASCADE, null=True, blank=True, related_name="archive_segments")
+    path = models.CharField(max_length=255, unique=True)
+    # (timestamp, id) of the oldest and newest message: the keyset range.
+    first_timestamp = models.DateTimeField()
+    first_message_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+    # Id range, for looking up one archived message by id.
+    min_message_id = models.BigIntegerField()
+    max_message_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    size = models.BigIntegerField()
+    # Blobs the archived messages still refer to; prune_attachments keeps them.
+    attachments = models.ManyToManyField(Attachment, blank=True, related_name="archive_segments")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["channel", "last_timestamp", "last_message_id"],
+                name="chat_archive_channel_idx",
+                condition=models.Q(channel__isnull=False),
+            ),
+            models.Index(
+                fields=["dm_group", "last_timestamp", "last_message_id"],
+                name="chat_archive_dm_group_idx",
+                condition=models.Q(dm_group__isnull=False),
+            ),
+            models.Index(fields=["min_message_id", "max_message_id"], name="chat_archive_id_range_idx"),
+        ]
+
+class Reaction(models.Model):
+    # One user's emoji on one message.
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="reactions", db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="reactions")
+    emoji = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["message", "emoji", "user"], name="chat_reaction_uniq"),
+        ]
+
+class ReactionCount(models.Model):
+    # Reactions per message and emoji, kept in step with Reaction by chat.reactions.
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="reaction_counts", db_index=False)
+    emoji = models.CharField(max_length=64)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["message", "emoji"], name="chat_reactioncount_uniq"),
+        ]
+
+class ReadCursor(models.Model):
+    # Per-user, per-conversation "read up to here" marker. Unread counts are
+    # messages after (last_read_at, last_read_message_id) in the conversation.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="read_cursors")
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=True, blank=True, related_name="read_cursors")
+    dm_group = models.ForeignKey(DirectMessageGroup, on_delete=models.CASCADE, null=True, blank=True, related_name="read_cursors")
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "channel"],
+                condition=models.Q(channel__isnull=False),
+                name="chat_readcursor_user_channel_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["user", "dm_group"],
+                condition=models.Q(dm_group__isnull=False),
+                name="chat_readcursor_user_dm_uniq",
+            ),
+        ]
+
+class NotificationJob(models.Model):
+    # Durable queue entry for chat.notifications: notify the members of one
+    # new message. The message is referenced by id only, so archiving and
+    # purging messages never has to wait for the queue.
+    message_id = models.BigIntegerField()
+    # Claimable from then on. A claim leases the job by moving this forward;
+    # NULL once the job has given up after MAX_ATTEMPTS.
+    available_at = models.DateTimeField(default=timezone.now, null=True)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["available_at", "id"], name="chat_notifjob_available_idx"),
+            models.Index(fields=["claimed_by"], name="chat_notifjob_claimed_idx"),
+        ]
+
+class NotificationDigest(models.Model):
+    # A burst of one user's notifications, coalesced. `summary` has one entry
+    # per conversation and kind: {"stream", "kind", "count", "last_message_id"}.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notification_digests", db_index=False)
+    count = models.PositiveIntegerField()
+    summary = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "-id"], name="chat_notifdigest_user_idx")]
+
+class Notification(models.Model):
+    # One recipient of one message, written by the chat.notifications worker
+    # and folded into a NotificationDigest shortly after.
+    MENTION = "mention"
+    DIRECT = "direct"
+    MESSAGE = "message"
+    KINDS = [(MENTION, "Mention"), (DIRECT, "Direct message"), (MESSAGE, "Message while offline")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications", db_index=False)
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    dm_group = models.ForeignKey(DirectMessageGroup, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    message_id = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KINDS)
+    digest = models.ForeignKey(NotificationDigest, on_delete=models.CASCADE, null=True, blank=True, related_name="notifications")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Digest building: a user's notifications not yet in a digest.
+            models.Index(
+                fields=["user", "created_at"],
+                name="chat_notif_pending_idx",
+                condition=models.Q(digest__isnull=True),
+            ),
+        ]
@@ -0,0 +1,244 @@
+import json
+import logging
+import re
+import threading
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Min, Subquery
+from django.utils import timezone
+
+from .archive import conversation_filter
+from .broadcast import conversation_group, group_send_text, user_group
+from .models import Channel, DirectMessageGroup, Message, Notification, NotificationDigest, NotificationJob
+from .presence import online_users
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+# Out-of-request notifications
+#
+# Posting a message only inserts one NotificationJob row next to it (in the
+# same transaction), whatever the size of the conversation. The
+# run_notification_worker command drains the queue with a pool of threads:
+#
+#   claim       one UPDATE leases up to BATCH jobs to a worker for LEASE
+#               seconds; a worker that dies simply lets the lease run out
+#   notify      members are read CHUNK at a time (keyset on user id), and
+#               each chunk becomes one bulk_create of Notification rows:
+#                 - "mention" for @username, @channel, @here, @everyone
+#                 - "direct" for DM participants who are offline
+#                 - "message" for channel members who are offline
+#               The job is deleted in the transaction that wrote its rows.
+#   retry       a failed job is retried after RETRY_DELAY * attempts
+#               seconds and parked (available_at NULL) after MAX_ATTEMPTS
+#   digest      once a user's oldest pending notification has waited
+#               DIGEST_DELAY seconds, all of their pending notifications
+#               become one NotificationDigest, pushed to their sockets
+#
+# Senders are never notified about their own messages.
+
+MENTION_PATTERN = re.compile(r"(?<![\w@])@([\w.+-]*[\w+-])")
+EVERYONE = frozenset({"channel", "here", "everyone"})
+
+
+def options():
+    return {
+        "WORKERS": 4,
+        "BATCH": 50,
+        "CHUNK": 1000,
+        "LEASE": 60,
+        "MAX_ATTEMPTS": 5,
+        "RETRY_DELAY": 10,
+        "POLL_INTERVAL": 1.0,
+        "DIGEST_DELAY": 60,
+        **getattr(settings, "CHAT_NOTIFICATIONS", {}),
+    }
+
+
+def enqueue(messages):
+    NotificationJob.objects.bulk_create([NotificationJob(message_id=message.pk) for message in messages])
+
+
+def parse_mentions(content):
+    # -> (usernames, whether the whole conversation is mentioned)
+    names = set(MENTION_PATTERN.findall(content or ""))
+    return names - EVERYONE, bool(names & EVERYONE)
+
+
+# ------------------------ JOBS ------------------------
+
+def claim(limit, now=None):
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    available = NotificationJob.objects.filter(available_at__lte=now).order_by("available_at", "id")
+    # available_at is checked again by the UPDATE itself, so two workers
+    # racing for the same rows can't both lease them.
+    NotificationJob.objects.filter(pk__in=Subquery(available.values("pk")[:limit]), available_at__lte=now).update(
+        available_at=now + timedelta(seconds=options()["LEASE"]),
+        claimed_by=token,
+        attempts=F("attempts") + 1,
+    )
+    return list(NotificationJob.objects.filter(claimed_by=token).order_by("id"))
+
+
+def process_batch(limit=None):
+    # Claims and runs one batch; returns how many jobs it claimed.
+    jobs = claim(limit or options()["BATCH"])
+    if not jobs:
+        return 0
+    messages = {
+        message["id"]: message
+        for message in Message.objects.filter(pk__in=[job.message_id for job in jobs]).values(
+            "id", "channel_id", "dm_group_id", "sender_id", "content"
+        )
+    }
+    for job in jobs:
+        try:
+            with transaction.atomic():
+                message = messages.get(job.message_id)
+                if message is not None:  # else deleted or archived since
+                    notify(message)
+                job.delete()
+        except Exception as e:
+            logger.exception("Notification job %s failed", job.pk)
+            fail(job, e)
+    return len(jobs)
+
+
+def fail(job, error):
+    opts = options()
+    available_at = None
+    if job.attempts < opts["MAX_ATTEMPTS"]:
+        available_at = timezone.now() + timedelta(seconds=opts["RETRY_DELAY"] * job.attempts)
+    NotificationJob.objects.filter(pk=job.pk).update(available_at=available_at, claimed_by="", last_error=repr(error))
+
+
+# ------------------------ FAN-OUT ------------------------
+
+def member_chunks(conversation, exclude, size):
+    # The conversation's member ids, `size` at a time, in id order.
+    if "channel_id" in conversation:
+        members = Channel.members.through.objects.filter(channel_id=conversation["channel_id"])
+    else:
+        members = DirectMessageGroup.participants.through.objects.filter(directmessagegroup_id=conversation["dm_group_id"])
+    members = members.exclude(user_id=exclude).order_by("user_id").values_list("user_id", flat=True)
+    last = 0
+    while True:
+        chunk = list(members.filter(user_id__gt=last)[:size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def notify(message):
+    conversation = conversation_filter(message["channel_id"], message["dm_group_id"])
+    offline_kind = Notification.MESSAGE if message["channel_id"] else Notification.DIRECT
+    usernames, everyone = parse_mentions(message["content"])
+    mentioned = set(User.objects.filter(username__in=usernames).values_list("id", flat=True)) if usernames else set()
+
+    for member_ids in member_chunks(conversation, message["sender_id"], options()["CHUNK"]):
+        online = online_users(member_ids)
+        notifications = []
+        for user_id in member_ids:
+            if everyone or user_id in mentioned:
+                kind = Notification.MENTION
+            elif user_id in online:
+                continue  # saw it live
+            else:
+                kind = offline_kind
+            notifications.append(Notification(user_id=user_id, message_id=message["id"], kind=kind, **conversation))
+        Notification.objects.bulk_create(notifications)
+
+
+# ------------------------ DIGESTS ------------------------
+
+def build_digests(now=None):
+    # Returns how many digests were created.
+    cutoff = (now or timezone.now()) - timedelta(seconds=options()["DIGEST_DELAY"])
+    due = (
+        Notification.objects.filter(digest__isnull=True)
+        .values("user_id")
+        .annotate(oldest=Min("created_at"))
+        .filter(oldest__lte=cutoff)
+        .values_list("user_id", flat=True)
+    )
+    return sum(build_digest(user_id) for user_id in list(due))
+
+
+def build_digest(user_id):
+    with transaction.atomic():
+        pending = list(
+            Notification.objects.select_for_update()
+            .filter(user_id=user_id, digest__isnull=True)
+            .values_list("id", "channel_id", "dm_group_id", "kind", "message_id")
+        )
+        if not pending:
+            return 0  # another worker got there first
+
+        groups = defaultdict(lambda: {"count": 0, "last_message_id": 0})
+        for _, channel_id, dm_group_id, kind, message_id in pending:
+            group = groups[conversation_group(channel_id, dm_group_id), kind]
+            group["count"] += 1
+            group["last_message_id"] = max(group["last_message_id"], message_id)
+        summary = [
+            {"stream": stream, "kind": kind, **group}
+            for (stream, kind), group in sorted(groups.items(), key=lambda item: -item[1]["last_message_id"])
+        ]
+        digest = NotificationDigest.objects.create(user_id=user_id, count=len(pending), summary=summary)
+        Notification.objects.filter(pk__in=[row[0] for row in pending]).update(digest=digest)
+
+        payload = {"type": "notification_digest", "id": digest.pk, "count": digest.count, "summary": summary}
+        transaction.on_commit(lambda: push(user_id, payload))
+    return 1
+
+
+def push(user_id, payload):
+    async_to_sync(group_send_text)(user_group(user_id), json.dumps(payload), "user.event")
+
+
+# ------------------------ WORKER ------------------------
+
+def drain():
+    # Runs every available job and every due digest; for cron and tests.
+    jobs = 0
+    while True:
+        claimed = process_batch()
+        if not claimed:
+            break
+        jobs += claimed
+    return jobs, build_digests()
+
+
+def work(stop):
+    # One pool thread: claim, run, sleep when the queue is empty.
+    poll_interval = options()["POLL_INTERVAL"]
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            if not process_batch():
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+
+
+def run_worker(workers, stop):
+    threads = [threading.Thread(target=work, args=(stop,), name=f"notifications-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    poll_interval = options()["POLL_INTERVAL"]
+    try:
+        while not stop.wait(poll_interval):
+            close_old_connections()
+            build_digests()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        connection.close()
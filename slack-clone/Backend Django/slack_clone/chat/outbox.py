@@ -0,0 +1,197 @@
+import asyncio
+import weakref
+from collections import Counter, deque
+
+from django.conf import settings
+
+# Bounded per-connection send queues
+#
+# Consumers never await the transport from their handlers: frames go into the
+# socket's Outbox and one writer task per socket sends them. A client that
+# reads slowly therefore only backs up its own queue, and its consumer keeps
+# draining the channel layer (whose per-channel capacity would otherwise
+# silently drop group messages for it).
+#
+# Every frame has a kind. DROPPABLE kinds (typing notices, ICE candidates) are
+# the first to go: they are dropped when the queue is full, shed to make room
+# for anything else, and skipped if they waited more than STALE_AFTER seconds.
+# Frames with a coalesce key replace the queued frame with the same key (only
+# the latest typing list per stream, or reaction totals per message, is worth
+# sending).
+#
+# A socket is evicted (closed with 1013, "try again later") when the queue is
+# full of frames that can't be dropped, or when it stays above HIGH_WATER
+# frames for SLOW_AFTER seconds. Clients reconnect and refetch history.
+
+DROPPABLE = frozenset({"typing", "ice"})
+COALESCED = frozenset({"typing", "reactions"})
+EVICTED_CLOSE_CODE = 1013
+
+
+def options():
+    return {
+        "MAX_FRAMES": 1000,
+        "MAX_BYTES": 4 * 1024 ** 2,
+        "HIGH_WATER": 200,
+        "SLOW_AFTER": 10.0,
+        "STALE_AFTER": 5.0,
+        **getattr(settings, "CHAT_OUTBOX", {}),
+    }
+
+
+class OutboxMetrics:
+    def __init__(self):
+        self.outboxes = weakref.WeakSet()
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = Counter()  # kind -> frames
+        self.evicted = Counter()  # reason -> sockets
+
+    def snapshot(self):
+        depths = [len(outbox.frames) for outbox in self.outboxes]
+        return {
+            "connections": len(depths),
+            "queued_frames": sum(depths),
+            "queued_bytes": sum(outbox.size for outbox in self.outboxes),
+            "max_depth": max(depths, default=0),
+            "congested": sum(1 for outbox in self.outboxes if outbox.congested_since is not None),
+            "frames_queued": self.queued,
+            "frames_sent": self.sent,
+            "frames_coalesced": self.coalesced,
+            "frames_dropped": dict(self.dropped),
+            "evicted": dict(self.evicted),
+        }
+
+    def reset(self):
+        self.queued = self.sent = self.coalesced = 0
+        self.dropped.clear()
+        self.evicted.clear()
+
+
+outbox_metrics = OutboxMetrics()
+
+
+class Outbox:
+    def __init__(self, send, evict, max_frames=1000, max_bytes=4 * 1024 ** 2, high_water=200,
+                 slow_after=10.0, stale_after=5.0, metrics=outbox_metrics):
+        self.send = send  # async (frame) -> None
+        self.evict = evict  # async (reason) -> None
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.high_water = high_water
+        self.slow_after = slow_after
+        self.stale_after = stale_after
+        self.metrics = metrics
+        self.frames = deque()  # [kind, key, frame, queued at]
+        self.keyed = {}  # coalesce key -> its entry in self.frames
+        self.size = 0
+        self.congested_since = None
+        self.closed = False
+        self.eviction = None
+        self.ready = asyncio.Event()
+        self.writer = asyncio.ensure_future(self.run())
+        metrics.outboxes.add(self)
+
+    def put(self, frame, kind="message", key=None):
+        if self.closed:
+            return
+        loop = asyncio.get_running_loop()
+        entry = self.keyed.get(key) if key is not None else None
+        if entry is not None:
+            self.size += len(frame) - len(entry[2])
+            entry[2] = frame
+            self.metrics.coalesced += 1
+            return
+
+        while self.full(frame):
+            if kind in DROPPABLE:
+                self.metrics.dropped[kind] += 1
+                return
+            if not self.shed():
+                self.close("overflow")
+                return
+
+        entry = [kind, key, frame, loop.time()]
+        self.frames.append(entry)
+        if key is not None:
+            self.keyed[key] = entry
+        self.size += len(frame)
+        self.metrics.queued += 1
+        self.ready.set()
+
+        if len(self.frames) > self.high_water:
+            if self.congested_since is None:
+                self.congested_since = entry[3]
+            elif entry[3] - self.congested_since > self.slow_after:
+                self.close("slow")
+
+    def full(self, frame):
+        return len(self.frames) >= self.max_frames or (self.frames and self.size + len(frame) > self.max_bytes)
+
+    def shed(self):
+        # Drops the oldest droppable frame; False when there is none.
+        for entry in self.frames:
+            if entry[0] in DROPPABLE:
+                self.frames.remove(entry)
+                self.forget(entry)
+                self.metrics.dropped[entry[0]] += 1
+                return True
+        return False
+
+    def forget(self, entry):
+        if entry[1] is not None:
+            self.keyed.pop(entry[1], None)
+        self.size -= len(entry[2])
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.ready.wait()
+            while self.frames:
+                entry = self.frames.popleft()
+                self.forget(entry)
+                if entry[0] in DROPPABLE and loop.time() - entry[3] > self.stale_after:
+                    self.metrics.dropped[entry[0]] += 1
+                    continue
+                try:
+                    await self.send(entry[2])
+                except Exception:
+                    # The socket is gone; disconnect() cleans up.
+                    self.stop()
+                    return
+                self.metrics.sent += 1
+                if len(self.frames) <= self.high_water:
+                    self.congested_since = None
+            self.ready.clear()
+
+    def close(self, reason):
+        # Stop sending and hand the socket back to the consumer to close.
+        if self.closed:
+            return
+        self.stop()
+        self.metrics.evicted[reason] += 1
+        self.eviction = asyncio.ensure_future(self.evict(reason))
+
+    def stop(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+        self.frames.clear()
+        self.keyed.clear()
+        self.size = 0
+        self.congested_since = None
+        self.metrics.outboxes.discard(self)
+
+
+def create_outbox(send, evict):
+    opts = options()
+    return Outbox(
+        send, evict,
+        max_frames=opts["MAX_FRAMES"],
+        max_bytes=opts["MAX_BYTES"],
+        high_water=opts["HIGH_WATER"],
+        slow_after=opts["SLOW_AFTER"],
+        stale_after=opts["STALE_AFTER"],
+    )
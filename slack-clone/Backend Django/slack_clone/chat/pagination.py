@@ -0,0 +1,174 @@
+import base64
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from . import archive
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# Keyset (seek) pagination over (timestamp, id)
+#
+# Every page is a bounded index range scan, so fetching page 1 and page
+# 10,000 of a channel's history costs the same. Cursors are opaque to clients.
+#
+# For a view with a `conversation` (see chat.archive.conversation_filter),
+# pages continue into the conversation's archive once the hot rows run out.
+# Whether there is an archive is a column of the page query itself, so pages
+# of conversations without one cost no extra query.
+class MessageCursorPagination(BasePagination):
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = "page_size"
+    anchor_query_params = ("before", "after", "around")
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.conversation = getattr(view, "conversation", None)
+        anchor, cursor = self.get_anchor(request)
+
+        if anchor is None:
+            rows, has_older = self.fetch_older(queryset, None)
+            has_newer = False
+        elif anchor == "before":
+            rows, has_older = self.fetch_older(queryset, cursor)
+            has_newer = True
+        elif anchor == "after":
+            rows, has_newer = self.fetch_newer(queryset, cursor, inclusive=False)
+            has_older = True
+        else:
+            # `around` centres the page on the anchor message, inclusive.
+            newer, has_newer = self.fetch_newer(
+                queryset, cursor, inclusive=True, limit=self.page_size - self.page_size // 2
+            )
+            older, has_older = self.fetch_older(queryset, cursor, limit=self.page_size // 2)
+            rows = older + newer
+
+        self.before = self.encode_cursor(rows[0]) if rows and has_older else None
+        self.after = self.encode_cursor(rows[-1]) if rows and has_newer else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            "before": self.before,
+            "after": self.after,
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        cursor = {"type": "string", "nullable": True}
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {"before": cursor, "after": cursor, "results": schema},
+        }
+
+    def cache_key(self, request):
+        # The page `request` asks for, from the parsed parameters: requests
+        # for the same page share a key, and no raw value reaches it.
+        anchor, cursor = self.get_anchor(request)
+        key = f"size={self.get_page_size(request)}"
+        if anchor is not None:
+            timestamp, pk = cursor
+            key += f"&{anchor}={(timestamp - EPOCH) // timedelta(microseconds=1)}:{pk}"
+        return key
+
+    # ------------------------ HELPERS ------------------------
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_anchor(self, request):
+        anchors = [p for p in self.anchor_query_params if p in request.query_params]
+        if not anchors:
+            return None, None
+        if len(anchors) > 1:
+            raise NotFound("Use only one of before, after or around.")
+        return anchors[0], self.decode_cursor(request.query_params[anchors[0]])
+
+    def fetch_older(self, queryset, cursor, limit=None):
+        limit = self.page_size if limit is None else limit
+        if cursor is not None:
+            timestamp, pk = cursor
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+        rows = list(self.with_archived_flag(queryset).order_by("-timestamp", "-id")[:limit + 1])
+        if len(rows) <= limit and self.is_archived(rows):
+            rows += archive.older(self.conversation, cursor, limit + 1 - len(rows))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        return rows, has_more
+
+    def fetch_newer(self, queryset, cursor, inclusive, limit=None):
+        limit = self.page_size if limit is None else limit
+        timestamp, pk = cursor
+        id_lookup = "id__gte" if inclusive else "id__gt"
+        queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, **{id_lookup: pk}))
+        rows = list(self.with_archived_flag(queryset).order_by("timestamp", "id")[:limit + 1])
+        if self.is_archived(rows):
+            rows = (archive.newer(self.conversation, cursor, inclusive, limit + 1) + rows)[:limit + 1]
+        return rows[:limit], len(rows) > limit
+
+    def with_archived_flag(self, queryset):
+        if self.conversation is None:
+            return queryset
+        return queryset.annotate(archived=archive.archived_flag(self.conversation))
+
+    def is_archived(self, rows):
+        if self.conversation is None:
+            return False
+        return rows[0].archived if rows else archive.has_archive(self.conversation)
+
+    def encode_cursor(self, message):
+        micros = (message.timestamp - EPOCH) // timedelta(microseconds=1)
+        raw = f"{micros}:{message.id}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def decode_cursor(self, value):
+        try:
+            raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+            micros, pk = (int(part) for part in raw.split(":"))
+            timestamp = EPOCH + timedelta(microseconds=micros)
+        except (TypeError, ValueError, UnicodeDecodeError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, pk
+
+
+# Page-number pagination for ranked search results
+#
+# Relevance order has no stable keyset, so this pages by offset but never
+# runs COUNT(*) over the matches: it fetches one extra row to know whether
+# there is a next page, and caps how deep a client can page.
+class SearchPagination(BasePagination):
+    page_size = 20
+    max_page_size = 100
+    max_page = 50
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            self.page = max(1, min(int(request.query_params.get("page", 1)), self.max_page))
+            size = int(request.query_params.get("page_size", self.page_size))
+        except ValueError:
+            raise NotFound("Invalid page.")
+        size = max(1, min(size, self.max_page_size))
+
+        offset = (self.page - 1) * size
+        rows = list(queryset[offset:offset + size + 1])
+        self.has_next = len(rows) > size and self.page < self.max_page
+        return rows[:size]
+
+    def get_paginated_response(self, data):
+        return Response({
+            "page": self.page,
+            "next_page": self.page + 1 if self.has_next else None,
+            "results": data,
+        })
@@ -0,0 +1,55 @@
+import hmac
+
+from django.contrib.auth.models import AnonymousUser
+from rest_framework import authentication, permissions
+
+from .broadcast import conversation_group, message_group
+from .membership import membership_index
+from .metrics import options as metrics_options
+from .models import DirectMessageGroup, Message
+
+
+# Conversation membership, answered from the in-process membership index
+#
+# View level: routes with a channel_id / dm_group_id kwarg.
+# Object level: messages and DM groups.
+class IsConversationMember(permissions.BasePermission):
+    message = "You are not a member of this conversation."
+
+    def has_permission(self, request, view):
+        channel_id = view.kwargs.get("channel_id")
+        dm_group_id = view.kwargs.get("dm_group_id")
+        if not (channel_id or dm_group_id):
+            return True
+        return membership_index.is_member(request.user.id, conversation_group(channel_id, dm_group_id))
+
+    def has_object_permission(self, request, view, obj):
+        if isinstance(obj, Message):
+            return membership_index.is_member(request.user.id, message_group(obj))
+        if isinstance(obj, DirectMessageGroup):
+            return membership_index.is_member(request.user.id, conversation_group(dm_group_id=obj.pk))
+        return True
+
+
+# Metrics scraping
+#
+# Prometheus can't log in. With CHAT_METRICS["SCRAPE_TOKEN"] set, a request
+# with "Authorization: Bearer <token>" is let in as a scraper (request.auth
+# is SCRAPER); otherwise the metrics endpoints are staff only.
+SCRAPER = "metrics-scraper"
+
+
+class ScrapeTokenAuthentication(authentication.BaseAuthentication):
+    def authenticate(self, request):
+        token = metrics_options()["SCRAPE_TOKEN"]
+        if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return AnonymousUser(), SCRAPER
+        return None  # not the scrape token: the usual authentication applies
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
+
+
+class IsStaffOrScraper(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == SCRAPER or bool(request.user and request.user.is_staff)
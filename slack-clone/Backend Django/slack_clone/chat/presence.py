@@ -0,0 +1,168 @@
+import asyncio
+import re
+import time
+import weakref
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .broadcast import group_send
+
+# Presence and typing indicators
+#
+# Online state is a heartbeat key per user in the default cache (shared
+# between workers when it is Redis), refreshed by every socket's heartbeat
+# and expiring TTL seconds after the last one. Snapshots (the REST endpoint)
+# read those keys; live changes are pushed to "presence_<workspace id>"
+# streams, which sockets subscribe to like any other stream.
+#
+# Nothing is broadcast per frame. Online/offline transitions and typing
+# notices are collected per event loop and flushed every FLUSH_INTERVAL
+# seconds as one batch per presence stream / conversation, and a user
+# typing in a conversation is only re-announced every TYPING_THROTTLE
+# seconds. Presence traffic per stream is therefore bounded by the flush
+# rate, not by the number of users or keystrokes.
+#
+# A worker that dies without disconnecting its sockets broadcasts no
+# "offline"; its users drop out of snapshots once their keys expire.
+
+PRESENCE_PATTERN = re.compile(r"^presence_(\d+)$")
+
+
+def presence_group(workspace_id):
+    return f"presence_{workspace_id}"
+
+
+def presence_workspace(stream):
+    # "presence_3" -> 3, else None
+    match = PRESENCE_PATTERN.match(stream or "")
+    return int(match.group(1)) if match else None
+
+
+def presence_key(user_id):
+    return f"chat:presence:{user_id}"
+
+
+def options():
+    return {
+        "HEARTBEAT_INTERVAL": 25,
+        "TTL": 60,
+        "FLUSH_INTERVAL": 1.0,
+        "TYPING_THROTTLE": 3.0,
+        **getattr(settings, "CHAT_PRESENCE", {}),
+    }
+
+
+def online_users(user_ids, chunk_size=1000):
+    # {user_id: last_seen} for the users with a live heartbeat key.
+    user_ids = list(user_ids)
+    online = {}
+    for start in range(0, len(user_ids), chunk_size):
+        keys = {presence_key(user_id): user_id for user_id in user_ids[start:start + chunk_size]}
+        for key, last_seen in cache.get_many(keys).items():
+            online[keys[key]] = last_seen
+    return online
+
+
+class PresenceBuffer:
+    def __init__(self, flush_interval=1.0, typing_throttle=3.0, ttl=60):
+        self.flush_interval = flush_interval
+        self.typing_throttle = typing_throttle
+        self.ttl = ttl
+        self.local_sockets = Counter()  # user_id -> sockets in this process
+        self.changes = {}  # workspace_id -> {user_id: online}
+        self.typing = {}  # stream -> {user_id}
+        self.typing_sent = {}  # (stream, user_id) -> loop time last queued
+        self.timer = None
+        self.flushes = set()
+
+    async def connected(self, user_id, workspace_ids):
+        self.local_sockets[user_id] += 1
+        await self.heartbeat(user_id, workspace_ids)
+
+    async def disconnected(self, user_id, workspace_ids):
+        self.local_sockets[user_id] -= 1
+        if self.local_sockets[user_id] > 0:
+            return
+        del self.local_sockets[user_id]
+        # Sockets of this user in other workers put the key back (and
+        # announce "online" again) on their next heartbeat.
+        await cache.adelete(presence_key(user_id))
+        self.queue_presence(user_id, workspace_ids, False)
+
+    async def heartbeat(self, user_id, workspace_ids):
+        key = presence_key(user_id)
+        if await cache.aadd(key, time.time(), self.ttl):
+            self.queue_presence(user_id, workspace_ids, True)
+        else:
+            await cache.aset(key, time.time(), self.ttl)
+
+    def queue_presence(self, user_id, workspace_ids, online):
+        # Only the latest state per user survives until the flush.
+        for workspace_id in workspace_ids:
+            self.changes.setdefault(workspace_id, {})[user_id] = online
+        self.schedule()
+
+    def typing_started(self, stream, user_id):
+        now = asyncio.get_running_loop().time()
+        if now - self.typing_sent.get((stream, user_id), float("-inf")) < self.typing_throttle:
+            return
+        self.typing_sent[(stream, user_id)] = now
+        self.typing.setdefault(stream, set()).add(user_id)
+        self.schedule()
+
+    def schedule(self):
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.flush_interval, self.schedule_flush)
+
+    def schedule_flush(self):
+        self.timer = None
+        changes, self.changes = self.changes, {}
+        typing, self.typing = self.typing, {}
+        cutoff = asyncio.get_running_loop().time() - self.typing_throttle
+        self.typing_sent = {key: sent for key, sent in self.typing_sent.items() if sent > cutoff}
+        if changes or typing:
+            task = asyncio.ensure_future(self.flush(changes, typing))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+
+    async def flush(self, changes, typing):
+        sends = [
+            group_send(presence_group(workspace_id), {
+                "type": "presence",
+                "online": sorted(user_id for user_id, online in states.items() if online),
+                "offline": sorted(user_id for user_id, online in states.items() if not online),
+            }, kind="presence")
+            for workspace_id, states in changes.items()
+        ]
+        sends += [
+            group_send(stream, {"type": "typing", "user_ids": sorted(user_ids)}, kind="typing")
+            for stream, user_ids in typing.items()
+        ]
+        await asyncio.gather(*sends)
+
+    async def drain(self):
+        # Flush whatever is pending and wait for in-flight batches (shutdown, tests).
+        if self.timer is not None:
+            self.timer.cancel()
+        self.schedule_flush()
+        if self.flushes:
+            await asyncio.gather(*self.flushes)
+
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_presence_buffer():
+    # One buffer per event loop, like the message write buffer.
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        opts = options()
+        buffer = _buffers[loop] = PresenceBuffer(
+            flush_interval=opts["FLUSH_INTERVAL"],
+            typing_throttle=opts["TYPING_THROTTLE"],
+            ttl=opts["TTL"],
+        )
+    return buffer
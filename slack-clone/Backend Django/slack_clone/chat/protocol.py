@@ -0,0 +1,153 @@
+import base64
+import json
+import zlib
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from .metrics import metrics
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack ships with channels-redis
+    msgpack = None
+
+# WebSocket wire formats
+#
+# Events travel through the channel layer as compact JSON text (event["text"],
+# encoded once by chat.broadcast). Each socket picks how that text goes on the
+# wire, through Sec-WebSocket-Protocol ("chat.<format>") or ?format=<format>:
+#
+#   json              text frames, the JSON as-is (default and fallback)
+#   msgpack           binary MessagePack frames
+#   json+deflate      binary frames: one flag byte (0 raw, 1 deflated) and the
+#   msgpack+deflate   body; bodies of COMPRESS_MIN_SIZE bytes or more are raw
+#                     deflate (wbits -15) with the preset dictionary ZDICT,
+#                     which the first frame ("hello") carries
+#
+# Every socket in a process receives its own copy of a broadcast event, so
+# frames are memoized by (event id, format, stream wrapping): a fan-out to 10k
+# local sockets encodes and compresses once and sends the same str/bytes
+# object 10k times. That is also why compression happens here rather than in
+# permessage-deflate, which compresses once per socket.
+#
+# Deflated client frames are inflated to at most MAX_FRAME_SIZE bytes; a
+# bigger one is rejected rather than expanded in the worker.
+
+COMPRESS_MIN_SIZE = 512
+MAX_FRAME_SIZE = 1024 ** 2
+FRAME_CACHE_SIZE = 1024
+
+# Keys and values every message event repeats, in both encodings; zlib
+# matches against the end of the dictionary most cheaply, so JSON goes last.
+_DICTIONARY_KEYS = (
+    "stream", "data", "type", "id", "channel", "dm_group", "sender", "username", "email",
+    "sender_username", "content", "timestamp", "is_read", "attachment", "attachment_name",
+    "attachment_url", "size", "content_type", "client_id", "message_id", "error",
+)
+ZDICT = b"".join(bytes([0xA0 + len(key)]) + key.encode() for key in _DICTIONARY_KEYS) + (
+    b'{"stream":"channel_","data":{"id":,"channel":null,"dm_group":null,"sender":{"id":,'
+    b'"username":"","email":""},"sender_username":"","content":"","timestamp":"2026-01-01T00:00:00.000000Z",'
+    b'"is_read":false,"attachment":null,"attachment_name":"","attachment_url":null}}'
+)
+
+
+def dumps(payload):
+    # The canonical encoding of everything sent through the channel layer.
+    return json.dumps(payload, separators=(",", ":"))
+
+
+class Codec:
+    def __init__(self, serializer, compress=False):
+        self.serializer = serializer
+        self.compress = compress
+        self.name = serializer + ("+deflate" if compress else "")
+        self.binary = serializer == "msgpack" or compress
+
+    def encode(self, payload):
+        if self.serializer == "msgpack":
+            return self.pack(msgpack.packb(payload))
+        return self.encode_json(dumps(payload))
+
+    def encode_json(self, text):
+        # From canonical JSON text, as carried by channel layer events.
+        if not self.binary:
+            return text
+        if self.serializer == "msgpack":
+            return self.pack(msgpack.packb(json.loads(text)))
+        return self.pack(text.encode())
+
+    def pack(self, body):
+        if not self.compress:
+            return body
+        if len(body) < COMPRESS_MIN_SIZE:
+            return b"\x00" + body
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=ZDICT)
+        return b"\x01" + compressor.compress(body) + compressor.flush()
+
+    def decode(self, text_data=None, bytes_data=None):
+        # Clients may always send JSON text frames, whatever they negotiated.
+        if text_data is not None:
+            return json.loads(text_data)
+        body = bytes_data
+        if self.compress:
+            flag, body = body[0], body[1:]
+            if flag:
+                decompressor = zlib.decompressobj(-15, zdict=ZDICT)
+                body = decompressor.decompress(body, MAX_FRAME_SIZE)
+                if decompressor.unconsumed_tail:
+                    raise ValueError("Frame too large.")
+        if self.serializer == "msgpack":
+            return msgpack.unpackb(body)
+        return json.loads(body)
+
+    def hello(self):
+        # Tells compressing clients the dictionary instead of hard-coding it.
+        return {"type": "hello", "format": self.name, "zdict": base64.b64encode(ZDICT).decode()}
+
+
+JSON = Codec("json")
+FORMATS = {codec.name: codec for codec in (JSON, Codec("json", compress=True))}
+if msgpack is not None:
+    FORMATS.update({codec.name: codec for codec in (Codec("msgpack"), Codec("msgpack", compress=True))})
+
+SUBPROTOCOL_PREFIX = "chat."
+
+
+def negotiate(scope):
+    # -> (codec, subprotocol to accept with, or None)
+    for subprotocol in scope.get("subprotocols") or ():
+        name = subprotocol[len(SUBPROTOCOL_PREFIX):] if subprotocol.startswith(SUBPROTOCOL_PREFIX) else None
+        if name in FORMATS:
+            return FORMATS[name], subprotocol
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return FORMATS.get(query.get("format", ["json"])[0], JSON), None
+
+
+class FrameCache:
+    def __init__(self, max_size=FRAME_CACHE_SIZE):
+        self.max_size = max_size
+        self.frames = OrderedDict()
+
+    def encode_event(self, codec, event, wrap):
+        # wrap=True: the multiplexed {"stream": ..., "data": ...} envelope.
+        key = (event.get("event_id"), codec.name, wrap)
+        frame = self.frames.get(key)
+        if frame is not None:
+            return frame
+
+        started = metrics.start()
+        text = event["text"]
+        if wrap:
+            text = '{"stream":%s,"data":%s}' % (json.dumps(event["group"]), text)
+        frame = codec.encode_json(text)
+        if started is not None:
+            metrics.observe(metrics.serialize, started, "frame_" + codec.name)
+            metrics.fanned_out(event)
+        if key[0] is not None:
+            self.frames[key] = frame
+            if len(self.frames) > self.max_size:
+                self.frames.popitem(last=False)
+        return frame
+
+
+frame_cache = FrameCache()
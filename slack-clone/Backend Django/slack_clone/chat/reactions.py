@@ -0,0 +1,112 @@
+from asgiref.sync import async_to_sync
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .broadcast import conversation_group, group_send
+from .event_log import bump_streams
+from .history_cache import history_cache
+from .models import Message, Reaction, ReactionCount
+
+# Threads and reactions with denormalized counters
+#
+# Message.reply_count / last_reply_at and Message.reaction_count, plus one
+# ReactionCount row per message and emoji, are moved with F() updates in the
+# transaction that adds or removes the reply or reaction, so concurrent
+# writers never lose an increment. A history page then renders its thread
+# summaries from the message rows themselves and its reaction summaries
+# with at most one extra query, only if a message on it has any reactions.
+#
+# Reaction changes go out as "reactions" events carrying the message's
+# current totals, not deltas. They aren't numbered in the event log, and
+# sockets coalesce queued ones per message (chat.outbox), so a burst of
+# reactions costs a slow client one frame. Both kinds of change also bump
+# the stream's bootstrap version, since the summaries and reply counts are
+# part of what a bootstrap ETag covers.
+
+MAX_EMOJI_LENGTH = 64
+
+
+def summaries(message_ids):
+    # {message_id: {emoji: count}}, emoji in the order they were first used.
+    result = {pk: {} for pk in message_ids}
+    counts = ReactionCount.objects.filter(message_id__in=message_ids, count__gt=0).order_by("id")
+    for message_id, emoji, count in counts.values_list("message_id", "emoji", "count"):
+        result[message_id][emoji] = count
+    return result
+
+
+def attach_reactions(messages):
+    # Sets `reaction_summary` on the Message objects of a page for MessageSerializer.
+    rows = [message for message in messages if isinstance(message, Message)]
+    reacted = summaries([message.id for message in rows if message.reaction_count])
+    for message in rows:
+        message.reaction_summary = reacted.get(message.id, {})
+    return messages
+
+
+def valid_emoji(emoji):
+    return bool(emoji) and len(emoji) <= MAX_EMOJI_LENGTH and not any(char.isspace() for char in emoji)
+
+
+# ------------------------ REACTIONS ------------------------
+
+def add_reaction(message, user, emoji):
+    # False if the user had already reacted with this emoji.
+    with transaction.atomic():
+        _, created = Reaction.objects.get_or_create(message_id=message.pk, user=user, emoji=emoji)
+        if not created:
+            return False
+        if not ReactionCount.objects.filter(message_id=message.pk, emoji=emoji).update(count=F("count") + 1):
+            try:
+                with transaction.atomic():
+                    ReactionCount.objects.create(message_id=message.pk, emoji=emoji, count=1)
+            except IntegrityError:
+                # Another transaction created the row first.
+                ReactionCount.objects.filter(message_id=message.pk, emoji=emoji).update(count=F("count") + 1)
+        Message.objects.filter(pk=message.pk).update(reaction_count=F("reaction_count") + 1)
+        reactions_changed(message)
+    return True
+
+
+def remove_reaction(message, user, emoji):
+    # False if there was no such reaction.
+    with transaction.atomic():
+        deleted, _ = Reaction.objects.filter(message_id=message.pk, user=user, emoji=emoji).delete()
+        if not deleted:
+            return False
+        counts = ReactionCount.objects.filter(message_id=message.pk, emoji=emoji)
+        counts.update(count=F("count") - 1)
+        counts.filter(count=0).delete()
+        Message.objects.filter(pk=message.pk).update(reaction_count=F("reaction_count") - 1)
+        reactions_changed(message)
+    return True
+
+
+def reactions_changed(message):
+    stream = conversation_group(message.channel_id, message.dm_group_id)
+    transaction.on_commit(lambda: history_cache.invalidate({stream}))
+    transaction.on_commit(lambda: bump_streams({stream}))
+    transaction.on_commit(lambda: broadcast_reactions(stream, message.pk))
+
+
+def broadcast_reactions(stream, message_id):
+    # Read after the commit, so the totals include every change committed so far.
+    payload = {"type": "reactions", "message_id": message_id, "reactions": summaries([message_id])[message_id]}
+    async_to_sync(group_send)(stream, payload, kind="reactions", coalesce=message_id)
+
+
+# ------------------------ THREADS ------------------------
+
+def reply_added(reply):
+    # Called in the transaction that inserted `reply`.
+    Message.objects.filter(pk=reply.parent_id).update(
+        reply_count=F("reply_count") + 1,
+        last_reply_at=Greatest(Coalesce("last_reply_at", Value(reply.timestamp)), Value(reply.timestamp)),
+    )
+    stream = conversation_group(reply.channel_id, reply.dm_group_id)
+    transaction.on_commit(lambda: bump_streams({stream}))
+
+
+def reply_removed(reply):
+    Message.objects.filter(pk=reply.parent_id, reply_count__gt=0).update(reply_count=F("reply_count") - 1)
@@ -0,0 +1,76 @@
+import json
+from datetime import datetime, timezone
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone as django_timezone
+
+from .broadcast import conversation_group, group_send_text, user_group
+from .event_log import bump_users
+from .models import Channel, DirectMessageGroup, Message, ReadCursor
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# Unread counts for every conversation of a user, in one query
+#
+# Each conversation row carries the user's cursor through correlated
+# subqueries; counting starts at the cursor's timestamp so it is a range scan
+# on the (conversation, timestamp, id) history index. Thread replies don't
+# count, as they aren't listed in the conversation itself.
+def _with_unread(queryset, field, user, kind):
+    cursors = ReadCursor.objects.filter(user=user, **{field: OuterRef("pk")})
+    queryset = queryset.annotate(
+        read_at=Coalesce(Subquery(cursors.values("last_read_at")[:1]), Value(EPOCH)),
+        read_id=Coalesce(Subquery(cursors.values("last_read_message_id")[:1]), Value(0)),
+    )
+    unread = (
+        Message.objects.filter(**{field: OuterRef("pk")}, parent__isnull=True, timestamp__gte=OuterRef("read_at"))
+        .exclude(timestamp=OuterRef("read_at"), id__lte=OuterRef("read_id"))
+        .order_by()
+        .values(field)
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return queryset.annotate(
+        kind=Value(kind),
+        unread=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)),
+    ).values_list("kind", "id", "unread")
+
+
+def unread_counts(user):
+    channels = _with_unread(Channel.objects.filter(members=user), "channel", user, "channels")
+    dm_groups = _with_unread(DirectMessageGroup.objects.filter(participants=user), "dm_group", user, "dm_groups")
+    counts = {"channels": {}, "dm_groups": {}}
+    for kind, pk, unread in channels.union(dm_groups, all=True):
+        counts[kind][pk] = unread
+    return counts
+
+
+def mark_read(user, conversation, message_id):
+    # Moves the user's cursor forward to `message_id` (never backwards) and
+    # tells the user's other sockets. Returns False if the message isn't in
+    # the conversation.
+    message = Message.objects.filter(id=message_id, **conversation).values("id", "timestamp").first()
+    if message is None:
+        return False
+
+    values = {"last_read_message_id": message["id"], "last_read_at": message["timestamp"]}
+    lookup = {"user": user, **conversation}
+    moved = ReadCursor.objects.filter(
+        Q(last_read_at__lt=message["timestamp"])
+        | Q(last_read_at=message["timestamp"], last_read_message_id__lt=message["id"])
+        | Q(last_read_at__isnull=True),
+        **lookup,
+    ).update(updated_at=django_timezone.now(), **values)
+    if not moved:
+        _, created = ReadCursor.objects.get_or_create(defaults=values, **lookup)
+        if not created:
+            return True  # already read past this message
+
+    payload = {"type": "read", "stream": conversation_group(**conversation), "message_id": message["id"]}
+    transaction.on_commit(lambda: bump_users([user.id]))
+    transaction.on_commit(lambda: async_to_sync(group_send_text)(user_group(user.id), json.dumps(payload), "user.event"))
+    return True
@@ -0,0 +1,127 @@
+from datetime import timedelta
+from itertools import takewhile
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import archive
+from .broadcast import conversation_group
+from .models import ArchiveSegment, Channel, DirectMessageGroup, Message
+from .reactions import attach_reactions
+from .serializers import MessageSerializer
+
+# Message retention
+#
+# archive_expired() (the archive_messages command, run periodically) moves
+# every message past its conversation's retention age into chat.archive
+# segments. Workspace channels follow Workspace.retention_days; channels
+# outside a workspace and DMs follow CHAT_RETENTION["DEFAULT_DAYS"]. Each
+# segment is written, recorded and its messages deleted in one transaction
+# of at most SEGMENT_SIZE threads, so the job never holds locks on much of
+# the messages table at once. A thread is archived whole, replies included,
+# once its last reply has expired too; until then it holds back the rest of
+# its conversation, which keeps the archive older than every hot message.
+#
+# purge_conversation() deletes a conversation's messages DELETE_BATCH rows
+# per transaction ahead of deleting the conversation itself, which would
+# otherwise cascade to all of them in a single statement.
+
+def segment_name(conversation, first_id, last_id):
+    return f"{conversation_group(**conversation)}/{first_id:012d}-{last_id:012d}.jsonl.gz"
+
+
+def delete_messages(conversation, ids):
+    # A plain delete() of one bounded batch: reactions cascade, and the
+    # post_delete signals invalidate the conversation's cached pages, bump
+    # its bootstrap version and fix reply counts, as for any other delete.
+    # A thread's first message cascades to its replies, so to keep the batch
+    # bounded they go in the same batch, or before it.
+    Message.objects.filter(pk__in=ids).delete()
+
+
+def expiring_conversations(now):
+    # -> (conversation, cutoff) for every conversation with a retention age.
+    channels = Channel.objects.filter(workspace__retention_days__isnull=False)
+    for channel_id, days in channels.values_list("id", "workspace__retention_days").iterator():
+        yield {"channel_id": channel_id}, now - timedelta(days=days)
+
+    default_days = archive.options()["DEFAULT_DAYS"]
+    if default_days is None:
+        return
+    cutoff = now - timedelta(days=default_days)
+    for channel_id in Channel.objects.filter(workspace__isnull=True).values_list("id", flat=True).iterator():
+        yield {"channel_id": channel_id}, cutoff
+    for dm_group_id in DirectMessageGroup.objects.values_list("id", flat=True).iterator():
+        yield {"dm_group_id": dm_group_id}, cutoff
+
+
+def archive_expired(now=None):
+    # -> (messages archived, segments written)
+    now = now or timezone.now()
+    messages = segments = 0
+    for conversation, cutoff in expiring_conversations(now):
+        while True:
+            archived = archive_segment(conversation, cutoff)
+            if not archived:
+                break
+            messages += archived
+            segments += 1
+    return messages, segments
+
+
+def archive_segment(conversation, cutoff):
+    # Moves the oldest SEGMENT_SIZE threads before `cutoff` into one segment;
+    # returns how many messages that was.
+    with transaction.atomic():
+        candidates = (
+            Message.objects.with_sender()
+            .select_for_update(of=("self",))
+            .filter(**conversation, parent__isnull=True, timestamp__lt=cutoff)
+            .order_by("timestamp", "id")[:archive.options()["SEGMENT_SIZE"]]
+        )
+        batch = list(takewhile(lambda message: message.last_reply_at is None or message.last_reply_at < cutoff, candidates))
+        if not batch:
+            return 0
+
+        rows = batch
+        if any(message.reply_count for message in batch):
+            replies = Message.objects.with_sender().select_for_update(of=("self",)).filter(parent__in=batch)
+            rows = sorted(batch + list(replies), key=lambda message: (message.timestamp, message.id))
+        ids = [message.id for message in rows]
+        name = segment_name(conversation, batch[0].id, batch[-1].id)
+        size = archive.write_segment(name, MessageSerializer(attach_reactions(rows), many=True).data)
+        try:
+            segment = ArchiveSegment.objects.create(
+                **conversation,
+                path=name,
+                first_timestamp=batch[0].timestamp,
+                first_message_id=batch[0].id,
+                last_timestamp=batch[-1].timestamp,
+                last_message_id=batch[-1].id,
+                min_message_id=min(ids),
+                max_message_id=max(ids),
+                message_count=len(rows),
+                size=size,
+            )
+            segment.attachments.add(*{message.attachment_id for message in rows if message.attachment_id})
+            delete_messages(conversation, ids)
+        except BaseException:
+            archive.delete_segment_file(name)
+            raise
+    return len(rows)
+
+
+def purge_conversation(conversation):
+    # -> number of messages deleted. Thread replies go first.
+    batch_size = archive.options()["DELETE_BATCH"]
+    deleted = 0
+    for replies in (True, False):
+        messages = Message.objects.filter(**conversation, parent__isnull=not replies)
+        while True:
+            with transaction.atomic():
+                ids = list(messages.values_list("id", flat=True)[:batch_size])
+                if not ids:
+                    break
+                delete_messages(conversation, ids)
+            deleted += len(ids)
+    return deleted
@@ -0,0 +1,78 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField
+from django.db.models.expressions import RawSQL
+
+# Full-text message search
+#
+# Postgres: GIN index on to_tsvector('english', content), ranked by ts_rank.
+# SQLite:   FTS5 table chat_message_fts kept in sync by triggers, ranked by
+#           bm25. Both indexes are maintained incrementally on every insert,
+#           update and delete, including bulk_create from the write buffer.
+# Anything else falls back to an unranked icontains scan.
+#
+# The index DDL lives in migration 0009_message_search_index. Every backend
+# annotates `rank` so that higher is better, and the last search term is
+# matched as a prefix (search-as-you-type).
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+MAX_TERMS = 16
+
+
+def tokenize(query):
+    return TOKEN_PATTERN.findall(query or "")[:MAX_TERMS]
+
+
+class PostgresSearchBackend:
+    # Must be the indexed expression, verbatim, for the GIN index to apply.
+    vector = "to_tsvector('english', chat_message.content)"
+
+    def tsquery(self, query):
+        # \w+ tokens can't carry tsquery operators, so this is safe to build.
+        return " & ".join(tokenize(query)) + ":*"
+
+    def search(self, queryset, query):
+        tsquery = self.tsquery(query)
+        matches = RawSQL(f"{self.vector} @@ to_tsquery('english', %s)", [tsquery], output_field=BooleanField())
+        rank = RawSQL(f"ts_rank({self.vector}, to_tsquery('english', %s))", [tsquery], output_field=FloatField())
+        return queryset.filter(matches).annotate(rank=rank).order_by("-rank", "-id")
+
+
+class SQLiteSearchBackend:
+    def match_expression(self, query):
+        # Quote every token so user input can't use FTS5 query syntax.
+        tokens = ['"%s"' % token for token in tokenize(query)]
+        tokens[-1] += "*"
+        return " ".join(tokens)
+
+    def search(self, queryset, query):
+        # extra() is the only way to JOIN the FTS5 virtual table: its `rank`
+        # (bm25, lower is better) is only defined inside the MATCH query.
+        return queryset.extra(
+            select={"rank": "-chat_message_fts.rank"},
+            tables=["chat_message_fts"],
+            where=["chat_message_fts.rowid = chat_message.id", "chat_message_fts MATCH %s"],
+            params=[self.match_expression(query)],
+        ).order_by("-rank", "-id")
+
+
+class ScanSearchBackend:
+    def search(self, queryset, query):
+        for token in tokenize(query):
+            queryset = queryset.filter(content__icontains=token)
+        return queryset.annotate(rank=F("id")).order_by("-id")
+
+
+def get_search_backend():
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    if connection.vendor == "sqlite":
+        return SQLiteSearchBackend()
+    return ScanSearchBackend()
+
+
+def search_messages(queryset, query):
+    if not tokenize(query):
+        return queryset.none()
+    return get_search_backend().search(queryset, query)
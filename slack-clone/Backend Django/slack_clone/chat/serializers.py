@@ -1,5 +1,8 @@
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Workspace, Channel, DirectMessageGroup, Message
+from .archive import ArchivedMessage
+from .models import Attachment, Workspace, Channel, DirectMessageGroup, Message, NotificationDigest, UploadSession
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -29,7 +32,7 @@ class UserSerializer(serializers.ModelSerializer):
 class WorkspaceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Workspace
-        fields = ["id", "name", "description", "created_at"]
+        fields = ["id", "name", "description", "retention_days", "created_at"]
 
 # ✅ Channel Serializer
 class ChannelSerializer(serializers.ModelSerializer):
@@ -50,10 +53,35 @@ class DirectMessageGroupSerializer(serializers.ModelSerializer):
         model = DirectMessageGroup
         fields = ["id", "name", "participants", "created_at"]
 
+# ✅ Attachment Serializers
+class AttachmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Attachment
+        fields = ["id", "size", "content_type"]
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ["id", "filename", "content_type", "size", "received", "attachment", "created_at"]
+        read_only_fields = ["received", "attachment"]
+
+    def validate_size(self, size):
+        max_size = settings.CHAT_ATTACHMENTS["MAX_SIZE"]
+        if not 0 < size <= max_size:
+            raise serializers.ValidationError(f"Size must be between 1 and {max_size} bytes.")
+        return size
+
 # ✅ Message Serializer
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     sender_username = serializers.CharField(source="sender.username", read_only=True)
+    content = serializers.CharField(allow_blank=True, required=False, default="")
+    attachment = AttachmentSerializer(read_only=True)
+    attachment_id = serializers.PrimaryKeyRelatedField(
+        source="attachment", queryset=Attachment.objects.all(), write_only=True, required=False, allow_null=True,
+    )
+    attachment_url = serializers.SerializerMethodField()
+    reactions = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
@@ -65,5 +93,50 @@ class MessageSerializer(serializers.ModelSerializer):
             "sender_username",
             "content",
             "timestamp",
-            "is_read"
+            "is_read",
+            "attachment",
+            "attachment_id",
+            "attachment_name",
+            "attachment_url",
+            "parent",
+            "reply_count",
+            "last_reply_at",
+            "reactions",
         ]
+        # Replies are posted to /api/messages/<id>/replies/ (chat.reactions).
+        read_only_fields = ["parent", "reply_count", "last_reply_at"]
+
+    def to_representation(self, instance):
+        # Archived messages were rendered by this serializer when they were archived.
+        if isinstance(instance, ArchivedMessage):
+            return instance.data
+        return super().to_representation(instance)
+
+    def get_reactions(self, obj):
+        # Pages attach their summaries in one query (chat.reactions.attach_reactions).
+        summary = getattr(obj, "reaction_summary", None)
+        if summary is None:
+            from .reactions import summaries  # chat.reactions broadcasts, which imports this module
+            summary = summaries([obj.pk])[obj.pk] if obj.reaction_count else {}
+        return summary
+
+    def get_attachment_url(self, obj):
+        return reverse("message-attachment", args=[obj.pk]) if obj.attachment_id else None
+
+    def validate_attachment_id(self, attachment):
+        # Knowing a blob's id isn't enough: only its uploaders may attach it.
+        request = self.context.get("request")
+        if attachment is not None and request is not None and not attachment.uploaders.filter(pk=request.user.pk).exists():
+            raise serializers.ValidationError("Unknown attachment.")
+        return attachment
+
+    def validate(self, data):
+        if not self.partial and not data.get("content", "").strip() and not data.get("attachment"):
+            raise serializers.ValidationError("A message needs content or an attachment.")
+        return data
+
+# ✅ Notification Digest Serializer
+class NotificationDigestSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NotificationDigest
+        fields = ["id", "count", "summary", "created_at", "read_at"]
@@ -0,0 +1,119 @@
+import asyncio
+import uuid
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .broadcast import build_event
+from .protocol import dumps
+
+# WebRTC call signaling
+#
+# Calls happen on a conversation stream, but signaling doesn't go to the
+# stream's group. A socket joins a call with {"type": "call_join", "stream":
+# ...} and gets a peer id; joins and leaves are announced on a per-call group
+# ("call_<stream>") that only participants are in, and every participant
+# introduces itself to the newcomer point-to-point. So each socket holds a
+# registry of the call's peers (peer id -> user id, channel name) built only
+# from server-side events, and offers, answers and ICE candidates, which must
+# name their target ({"to": <peer id>}), are sent to that one channel.
+#
+# ICE candidates for the same peer are sent as one "webrtc_ice_candidates"
+# frame per ICE_BATCH_DELAY seconds; clients may also batch them themselves.
+# A 500-member channel with a 3-person call costs 2 deliveries per candidate
+# batch instead of 500 per candidate.
+#
+#   -> {"type": "call_join", "stream": "channel_5"}
+#   <- {"type": "call_joined", "peer_id": "a1"}
+#   <- {"type": "call_peer", "peer_id": "b2", "user_id": 7}          already in the call
+#   <- {"type": "call_peer_joined", "peer_id": "c3", "user_id": 9}   joined after us
+#   -> {"type": "webrtc_offer", "to": "b2", "offer": {...}}
+#   <- {"type": "webrtc_answer", "from": "b2", "answer": {...}}
+#   -> {"type": "webrtc_ice_candidate", "to": "b2", "candidate": {...}}
+#   <- {"type": "webrtc_ice_candidates", "from": "b2", "candidates": [...]}
+#   <- {"type": "call_peer_left", "peer_id": "c3"}
+#   -> {"type": "call_leave", "stream": "channel_5"}
+
+SIGNAL_TYPES = ("webrtc_offer", "webrtc_answer", "webrtc_ice_candidate", "webrtc_ice_candidates")
+
+
+def call_group(stream):
+    return f"call_{stream}"
+
+
+def options():
+    return {"ICE_BATCH_DELAY": 0.02, **getattr(settings, "CHAT_SIGNALING", {})}
+
+
+class CallSession:
+    # One socket's side of one call.
+    def __init__(self, stream, user_id, channel_name, batch_delay=0.02):
+        self.stream = stream
+        self.user_id = user_id
+        self.channel_name = channel_name
+        self.peer_id = uuid.uuid4().hex[:12]
+        self.batch_delay = batch_delay
+        self.peers = {}  # peer id -> (user id, channel name)
+        self.candidates = {}  # peer id -> candidates waiting for the batch
+        self.timer = None
+        self.sends = set()
+
+    async def announce(self, action, text, **extra):
+        await get_channel_layer().group_send(call_group(self.stream), self.peer_event(action, text, **extra))
+
+    async def introduce(self, channel):
+        # Tells a newcomer that we are in the call.
+        text = dumps({"type": "call_peer", "peer_id": self.peer_id, "user_id": self.user_id})
+        await get_channel_layer().send(channel, self.peer_event("present", text))
+
+    def peer_event(self, action, text, **extra):
+        return build_event(
+            text, "call.peer", group=self.stream, action=action,
+            peer_id=self.peer_id, user_id=self.user_id, channel=self.channel_name, **extra,
+        )
+
+    async def join(self):
+        await get_channel_layer().group_add(call_group(self.stream), self.channel_name)
+        await self.announce("joined", dumps({"type": "call_peer_joined", "peer_id": self.peer_id, "user_id": self.user_id}))
+
+    async def leave(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.candidates.clear()
+        await get_channel_layer().group_discard(call_group(self.stream), self.channel_name)
+        await self.announce("left", dumps({"type": "call_peer_left", "peer_id": self.peer_id}))
+
+    async def signal(self, data):
+        # -> False when "to" isn't a peer of this call.
+        to = data.get("to")
+        if to not in self.peers:
+            return False
+        if data.get("type") == "webrtc_ice_candidate":
+            self.queue_candidates(to, [data.get("candidate")])
+        elif data.get("type") == "webrtc_ice_candidates":
+            self.queue_candidates(to, list(data.get("candidates") or ()))
+        else:
+            payload = {key: value for key, value in data.items() if key not in ("to", "stream")}
+            await self.send_to(to, {**payload, "from": self.peer_id}, "signal")
+        return True
+
+    def queue_candidates(self, to, candidates):
+        self.candidates.setdefault(to, []).extend(candidates)
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.batch_delay, self.flush_candidates)
+
+    def flush_candidates(self):
+        self.timer = None
+        batches, self.candidates = self.candidates, {}
+        for to, candidates in batches.items():
+            payload = {"type": "webrtc_ice_candidates", "from": self.peer_id, "candidates": candidates}
+            task = asyncio.ensure_future(self.send_to(to, payload, "ice"))
+            self.sends.add(task)
+            task.add_done_callback(self.sends.discard)
+
+    async def send_to(self, to, payload, kind):
+        if to not in self.peers:
+            return  # left meanwhile
+        _, channel = self.peers[to]
+        event = build_event(dumps(payload), "webrtc.signal", group=self.stream, kind=kind, peer_id=self.peer_id)
+        await get_channel_layer().send(channel, event)
@@ -0,0 +1,164 @@
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .archive import delete_segment_file
+from .broadcast import conversation_group, message_group
+from .event_log import bump_directory, bump_streams, bump_users
+from .history_cache import history_cache
+from .membership import membership_index, revoke_streams
+from .reactions import reply_removed
+from .middleware import token_user_cache
+from .models import ArchiveSegment, Channel, DirectMessageGroup, Message, Workspace
+
+User = get_user_model()
+
+
+# WebSocket auth cache invalidation (deactivation, renames, deletes)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_token_user_cache(sender, instance, **kwargs):
+    token_user_cache.invalidate_user(instance.pk)
+
+
+# DM participant_key maintenance
+def refresh_participant_key(group_id):
+    participant_ids = DirectMessageGroup.participants.through.objects.filter(
+        directmessagegroup_id=group_id
+    ).values_list("user_id", flat=True)
+    key = DirectMessageGroup.key_for(participant_ids)
+    try:
+        with transaction.atomic():
+            DirectMessageGroup.objects.filter(id=group_id).exclude(participant_key=key).update(participant_key=key)
+    except IntegrityError:
+        # Another group already has exactly these participants; that one
+        # stays the canonical DM for the set.
+        DirectMessageGroup.objects.filter(id=group_id).update(participant_key=None)
+
+
+@receiver(m2m_changed, sender=DirectMessageGroup.participants.through)
+def update_participant_key(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # Reverse clears (user.dm_groups.clear()) don't report the groups.
+        instance._cleared_dm_group_ids = list(instance.dm_groups.values_list("id", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        group_ids = [instance.pk]
+    elif action == "post_clear":
+        group_ids = getattr(instance, "_cleared_dm_group_ids", [])
+    else:
+        group_ids = pk_set or []
+    for group_id in group_ids:
+        refresh_participant_key(group_id)
+
+
+# Membership index invalidation and live revocation
+def membership_pairs(sender, instance, reverse, pk_set=None):
+    # (user_id, stream) pairs touched by an m2m change on a membership table.
+    if sender is Channel.members.through:
+        field, stream = "channel_id", lambda pk: conversation_group(channel_id=pk)
+    else:
+        field, stream = "directmessagegroup_id", lambda pk: conversation_group(dm_group_id=pk)
+    if pk_set is None:
+        lookup = {"user_id": instance.pk} if reverse else {field: instance.pk}
+        rows = sender.objects.filter(**lookup).values_list("user_id", field)
+    else:
+        rows = [(instance.pk, pk) if reverse else (pk, instance.pk) for pk in pk_set]
+    return [(user_id, stream(pk)) for user_id, pk in rows]
+
+
+@receiver(m2m_changed, sender=Channel.members.through)
+@receiver(m2m_changed, sender=DirectMessageGroup.participants.through)
+def update_membership_index(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        # clear() doesn't report the rows it removes.
+        instance._cleared_memberships = membership_pairs(sender, instance, reverse)
+        return
+    if action == "post_clear":
+        pairs = instance.__dict__.pop("_cleared_memberships", [])
+    elif action in ("post_add", "post_remove"):
+        pairs = membership_pairs(sender, instance, reverse, pk_set or ())
+    else:
+        return
+
+    # Again on commit: a load between now and then still sees the old rows.
+    user_ids = {user_id for user_id, _ in pairs}
+    membership_index.invalidate_users(user_ids)
+    transaction.on_commit(lambda: membership_index.invalidate_users(user_ids))
+    transaction.on_commit(lambda: bump_users(user_ids))
+    if sender is DirectMessageGroup.participants.through:
+        # Every participant's copy of the group lists the participants.
+        streams = {stream for _, stream in pairs}
+        transaction.on_commit(lambda: bump_streams(streams))
+    if action != "post_add" and pairs:
+        transaction.on_commit(lambda: revoke_streams(pairs))
+
+
+# Bootstrap ETag versions (see chat.bootstrap)
+#
+# Bumped on commit: a bootstrap rendered between the bump and the commit
+# would otherwise be stored by clients under the new ETag with the old data.
+@receiver(post_save, sender=Workspace)
+@receiver(post_save, sender=Channel)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=Workspace)
+@receiver(post_delete, sender=Channel)
+@receiver(post_delete, sender=User)
+def bump_directory_version(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    transaction.on_commit(bump_directory)
+
+
+@receiver(post_save, sender=DirectMessageGroup)
+@receiver(post_delete, sender=DirectMessageGroup)
+def bump_version_for_dm_group_change(sender, instance, **kwargs):
+    # Only its participants see a DM group; a new one has none yet.
+    streams = {conversation_group(dm_group_id=instance.pk)}
+    transaction.on_commit(lambda: bump_streams(streams))
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def bump_version_for_message_change(sender, instance, created=False, **kwargs):
+    # New messages move their conversation's seq instead.
+    if not created:
+        streams = {message_group(instance)}
+        transaction.on_commit(lambda: bump_streams(streams))
+
+
+@receiver(m2m_changed, sender=Workspace.members.through)
+def bump_workspace_member_versions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if action == "post_clear" and not reverse:
+        transaction.on_commit(bump_directory)  # the cleared members aren't reported
+        return
+    user_ids = [instance.pk] if reverse else list(pk_set or ())
+    transaction.on_commit(lambda: bump_users(user_ids))
+
+
+# History page cache invalidation (see chat.history_cache)
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_history_pages(sender, instance, **kwargs):
+    streams = {message_group(instance)}
+    transaction.on_commit(lambda: history_cache.invalidate(streams))
+
+
+# Archive segment files go with their rows (e.g. when a channel is deleted)
+@receiver(post_delete, sender=ArchiveSegment)
+def delete_archive_segment_file(sender, instance, **kwargs):
+    name = instance.path
+    transaction.on_commit(lambda: delete_segment_file(name))
+
+
+# Thread reply counts (replies are added through chat.reactions.reply_added)
+@receiver(post_delete, sender=Message)
+def decrement_reply_count(sender, instance, **kwargs):
+    if instance.parent_id:
+        reply_removed(instance)
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import attachments
+from .membership import membership_index
+from .models import Attachment, Channel, Message
+
+User = get_user_model()
+
+
+class AttachmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.other = User.objects.create_user("bob", "bob@example.com", "pw")
+        cls.channel = Channel.objects.create(name="general")
+        cls.channel.members.add(cls.user)
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix="chat-attachments-")
+        self.addCleanup(shutil.rmtree, root)
+        config = {**settings.CHAT_ATTACHMENTS, "ROOT": root, "MAX_CHUNK": 1024}
+        self.enterContext(override_settings(CHAT_ATTACHMENTS=config))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        membership_index.clear()
+
+    # ------------------------ HELPERS ------------------------
+
+    def start_upload(self, data, client=None):
+        response = (client or self.client).post(
+            "/api/uploads/", {"filename": "notes.bin", "content_type": "application/pdf", "size": len(data)}, format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()["id"]
+
+    def put_chunk(self, upload_id, data, start, end, client=None):
+        return (client or self.client).generic(
+            "PUT", f"/api/uploads/{upload_id}/", data[start:end + 1],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(data)}",
+        )
+
+    def upload(self, data, client=None):
+        upload_id = self.start_upload(data, client)
+        for start in range(0, len(data), 1024):
+            response = self.put_chunk(upload_id, data, start, min(start + 1024, len(data)) - 1, client)
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def post_message(self, attachment_id):
+        response = self.client.post(
+            f"/api/channels/{self.channel.id}/messages/",
+            {"attachment_id": attachment_id, "attachment_name": "notes.pdf"}, format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    # ------------------------ TESTS ------------------------
+
+    def test_chunked_upload_resumes_from_received_offset(self):
+        data = os.urandom(2500)
+        upload_id = self.start_upload(data)
+        self.assertEqual(self.put_chunk(upload_id, data, 0, 1023).status_code, 200)
+
+        # Skipping ahead is refused with the offset to resume from.
+        response = self.put_chunk(upload_id, data, 2048, 2499)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["received"], 1024)
+        self.assertEqual(self.client.get(f"/api/uploads/{upload_id}/").json()["received"], 1024)
+
+        self.assertEqual(self.put_chunk(upload_id, data, 1024, 2047).status_code, 200)
+        response = self.put_chunk(upload_id, data, 2048, 2499)
+        self.assertEqual(response.status_code, 201, response.content)
+
+        attachment = Attachment.objects.get(pk=response.json()["id"])
+        self.assertEqual(attachment.sha256, hashlib.sha256(data).hexdigest())
+        with open(attachments.blob_path(attachment.sha256), "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_identical_uploads_share_one_blob(self):
+        data = os.urandom(1500)
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+
+        first = self.upload(data)
+        second = self.upload(data, other_client)
+        self.assertEqual(first["id"], second["id"])
+        self.assertEqual(set(Attachment.objects.get().uploaders.all()), {self.user, self.other})
+        blobs = [name for _, _, names in os.walk(attachments.root() / "blobs") for name in names]
+        self.assertEqual(len(blobs), 1)
+        self.assertFalse(os.listdir(attachments.root() / "uploads"))
+
+    def test_only_uploaders_can_attach(self):
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+        attachment = self.upload(os.urandom(100), other_client)
+
+        response = self.client.post(
+            f"/api/channels/{self.channel.id}/messages/", {"attachment_id": attachment["id"]}, format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_download_supports_ranges(self):
+        data = os.urandom(3000)
+        message = self.post_message(self.upload(data)["id"])
+        url = message["attachment_url"]
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), data)
+        self.assertIn('filename="notes.pdf"', response["Content-Disposition"])
+
+        response = self.client.get(url, HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 100-199/3000")
+        self.assertEqual(b"".join(response.streaming_content), data[100:200])
+
+        response = self.client.get(url, HTTP_RANGE="bytes=-10")
+        self.assertEqual(b"".join(response.streaming_content), data[-10:])
+
+        response = self.client.get(url, HTTP_RANGE="bytes=5000-")
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_download_requires_membership(self):
+        message = self.post_message(self.upload(b"secret")["id"])
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+        self.assertEqual(other_client.get(message["attachment_url"]).status_code, 403)
+
+    def test_sendfile_header_offloads_download(self):
+        message = self.post_message(self.upload(b"offloaded")["id"])
+        config = {**settings.CHAT_ATTACHMENTS, "SENDFILE_HEADER": "X-Accel-Redirect"}
+        with override_settings(CHAT_ATTACHMENTS=config):
+            response = self.client.get(message["attachment_url"])
+        sha256 = Message.objects.get(pk=message["id"]).attachment.sha256
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/attachments/" + attachments.blob_name(sha256))
+        self.assertEqual(response.content, b"")
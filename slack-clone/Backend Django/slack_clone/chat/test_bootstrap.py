@@ -0,0 +1,158 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .bootstrap import latest_messages
+from .broadcast import broadcast_message
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message, Workspace
+from .reactions import add_reaction, reply_added
+from .test_query_counts import QueryCountMixin
+
+User = get_user_model()
+
+
+class BootstrapTests(QueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        User.objects.create_user("stranger", "stranger@example.com", "pw")
+        cls.workspace = Workspace.objects.create(name="acme")
+        cls.workspace.members.add(cls.user, cls.bob)
+        cls.general = Channel.objects.create(workspace=cls.workspace, name="general")
+        cls.general.members.add(cls.user, cls.bob)
+        cls.random = Channel.objects.create(workspace=cls.workspace, name="random")
+        cls.random.members.add(cls.bob)
+        Channel.objects.create(name="elsewhere")
+        cls.dm_group = DirectMessageGroup.objects.create()
+        cls.dm_group.participants.add(cls.user, cls.bob)
+
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_initial_state(self):
+        Message.objects.bulk_create([Message(channel=self.general, sender=self.bob, content=f"m{i}") for i in range(30)])
+        parent = Message.objects.filter(channel=self.general).latest("id")
+        Message.objects.create(channel=self.general, sender=self.bob, content="in a thread", parent=parent)
+        Message.objects.create(channel=self.random, sender=self.bob, content="not for alice")
+        Message.objects.create(dm_group=self.dm_group, sender=self.user, content="hi bob")
+
+        data = self.client.get("/api/bootstrap/?messages=5").json()
+        self.assertEqual([workspace["id"] for workspace in data["workspaces"]], [self.workspace.id])
+        self.assertEqual(
+            [(channel["name"], channel["is_member"]) for channel in data["channels"]],
+            [("general", True), ("random", False)],
+        )
+        self.assertEqual([group["id"] for group in data["dm_groups"]], [self.dm_group.id])
+        self.assertEqual([user["username"] for user in data["users"]], ["alice", "bob"])
+        self.assertEqual(
+            [message["content"] for message in data["messages"][f"channel_{self.general.id}"]],
+            ["m25", "m26", "m27", "m28", "m29"],  # not the thread reply
+        )
+        self.assertEqual(set(data["messages"]), {f"channel_{self.general.id}", f"dm_{self.dm_group.id}"})
+        self.assertEqual(data["unread"]["channels"][str(self.general.id)], 30)
+        self.assertEqual(data["seq"][f"dm_{self.dm_group.id}"], 0)
+
+    def test_constant_queries(self):
+        def populate(size):
+            for i in range(size - Channel.objects.filter(members=self.user).count()):
+                channel = Channel.objects.create(workspace=self.workspace, name=f"c{size}-{i}")
+                channel.members.add(self.user)
+                group = DirectMessageGroup.objects.create()
+                group.participants.add(self.user, User.objects.create_user(f"u{size}-{i}"))
+                Message.objects.bulk_create(
+                    [Message(channel=channel, sender=self.bob, content="x") for _ in range(3)]
+                    + [Message(dm_group=group, sender=self.user, content="y") for _ in range(3)]
+                )
+            for message in Message.objects.filter(reaction_count=0):
+                add_reaction(message, self.bob, "👍")
+            membership_index.load(self.user.id)
+
+        def request():
+            self.assertEqual(self.client.get("/api/bootstrap/").status_code, 200)
+
+        # Seven, plus one for the reaction summaries of the recent messages;
+        # every size has conversations beyond #general, so it always runs.
+        self.assertLessEqual(self.assertConstantQueries(populate, request, sizes=(2, 5, 25)), 8)
+
+    def test_unchanged_state_is_a_304_without_queries(self):
+        response = self.client.get("/api/bootstrap/")
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        for header in (f'"other", {etag}', etag.removeprefix("W/"), "*"):
+            with self.subTest(header=header):
+                self.assertEqual(self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=header).status_code, 304)
+        # Tags are compared whole, not as substrings.
+        self.assertEqual(self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=f'"x{etag[3:-1]}x"').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(channel=self.general, sender=self.bob, content="new")
+        broadcast_message(message)
+        response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.random.name = "renamed"
+            self.random.save()
+        self.assertEqual(self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_versions_are_scoped_to_the_affected_conversations(self):
+        elsewhere = Message.objects.create(channel=self.random, sender=self.bob, content="not for alice")
+        mine = Message.objects.create(channel=self.general, sender=self.bob, content="hi")
+        etag = self.client.get("/api/bootstrap/")["ETag"]
+
+        def unchanged():
+            return self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        with self.captureOnCommitCallbacks(execute=True):
+            elsewhere.content = "edited"
+            elsewhere.save()
+            elsewhere.delete()
+            group = DirectMessageGroup.objects.create(name="not alice's")
+            group.participants.add(self.bob, User.objects.get(username="stranger"))
+        self.assertTrue(unchanged())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mine.content = "edited"
+            mine.save()
+        self.assertFalse(unchanged())
+        etag = self.client.get("/api/bootstrap/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dm_group.participants.add(User.objects.get(username="stranger"))
+        self.assertFalse(unchanged())
+
+    def test_reactions_and_replies_change_the_etag(self):
+        message = Message.objects.create(channel=self.general, sender=self.bob, content="hi")
+        etag = self.client.get("/api/bootstrap/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            add_reaction(message, self.bob, "👍")
+        response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["messages"][f"channel_{self.general.id}"][0]["reactions"], {"👍": 1})
+
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            reply_added(Message.objects.create(channel=self.general, sender=self.bob, content="re", parent=message))
+        response = self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["messages"][f"channel_{self.general.id}"][0]["reply_count"], 1)
+
+    def test_latest_messages_of_many_conversations(self):
+        # Several UNION batches where the backend uses them (SQLite ranks with a window instead).
+        channels = Channel.objects.bulk_create([Channel(name=f"c{i}") for i in range(600)])
+        Message.objects.bulk_create(
+            [Message(channel=channel, sender=self.bob, content=f"{channel.name}-{i}") for channel in channels for i in range(2)]
+        )
+        messages = latest_messages([{"channel_id": channel.id} for channel in channels], 1)
+        self.assertEqual([message.content for message in messages], [f"{channel.name}-1" for channel in channels])
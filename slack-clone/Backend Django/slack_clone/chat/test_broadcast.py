@@ -0,0 +1,68 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .membership import membership_index
+from .models import Channel, Message
+
+User = get_user_model()
+
+
+class RestBroadcastTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(self.user)
+        self.stream = f"channel_{self.channel.id}"
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, content):
+        return self.client.post(f"/api/channels/{self.channel.id}/messages/", {"content": content}, format="json")
+
+    async def connect(self, path="/ws/chat/"):
+        socket = WebsocketCommunicator(application, f"{path}?token={AccessToken.for_user(self.user)}")
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    @async_to_sync
+    async def test_rest_messages_reach_connected_sockets_after_commit(self):
+        multiplexed = await self.connect()
+        await multiplexed.send_json_to({"type": "subscribe", "stream": self.stream})
+        await multiplexed.receive_json_from()
+        single = await self.connect(f"/ws/chat/{self.stream}/")
+
+        response = await database_sync_to_async(self.post)("hello")
+        self.assertEqual(response.status_code, 201)
+
+        frame = await multiplexed.receive_json_from()
+        self.assertEqual(frame["stream"], self.stream)
+        self.assertEqual(frame["data"], {**response.json(), "seq": 1})
+        self.assertEqual(await single.receive_json_from(), frame["data"])
+        # Sent once the row is committed, so clients can fetch it right away.
+        self.assertTrue(await Message.objects.filter(pk=frame["data"]["id"]).aexists())
+        for socket in (multiplexed, single):
+            await socket.disconnect()
+
+    @async_to_sync
+    async def test_rolled_back_messages_are_not_broadcast(self):
+        socket = await self.connect(f"/ws/chat/{self.stream}/")
+        failing = mock.patch("chat.views.enqueue_notifications", side_effect=RuntimeError("queue down"))
+        with failing, self.assertRaisesMessage(RuntimeError, "queue down"):
+            await database_sync_to_async(self.post)("lost")
+
+        self.assertTrue(await socket.receive_nothing())
+        self.assertFalse(await Message.objects.aexists())
+        await socket.disconnect()
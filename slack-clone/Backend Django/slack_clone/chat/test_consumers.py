@@ -0,0 +1,107 @@
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .broadcast import broadcast_message
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message
+
+User = get_user_model()
+
+
+class MultiplexConsumerTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.general = Channel.objects.create(name="general")
+        self.general.members.add(self.alice, self.bob)
+        self.private = Channel.objects.create(name="private")
+        self.private.members.add(self.bob)
+        self.dm_group = DirectMessageGroup.objects.create()
+        self.dm_group.participants.add(self.alice, self.bob)
+        self.channel_stream = f"channel_{self.general.id}"
+        self.dm_stream = f"dm_{self.dm_group.id}"
+
+    async def connect(self, user, path="/ws/chat/"):
+        socket = WebsocketCommunicator(application, f"{path}?token={AccessToken.for_user(user)}")
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    async def subscribe(self, socket, stream):
+        await socket.send_json_to({"type": "subscribe", "stream": stream})
+        return await socket.receive_json_from()
+
+    async def broadcast(self, content, **conversation):
+        message = await Message.objects.acreate(sender=self.bob, content=content, **conversation)
+        await database_sync_to_async(broadcast_message)(message)
+
+    @async_to_sync
+    async def test_subscribe_and_unsubscribe(self):
+        socket = await self.connect(self.alice)
+        self.assertEqual(
+            await self.subscribe(socket, self.channel_stream), {"type": "subscribed", "stream": self.channel_stream, "seq": 0},
+        )
+        await self.broadcast("one", channel=self.general)
+        self.assertEqual((await socket.receive_json_from())["data"]["content"], "one")
+
+        await socket.send_json_to({"type": "unsubscribe", "stream": self.channel_stream})
+        self.assertEqual(await socket.receive_json_from(), {"type": "unsubscribed", "stream": self.channel_stream})
+        await self.broadcast("two", channel=self.general)
+        self.assertTrue(await socket.receive_nothing())
+        await socket.disconnect()
+
+    @async_to_sync
+    async def test_events_are_routed_per_stream(self):
+        socket = await self.connect(self.alice)
+        await self.subscribe(socket, self.channel_stream)
+        await self.subscribe(socket, self.dm_stream)
+        bob = await self.connect(self.bob)
+        await self.subscribe(bob, self.dm_stream)
+
+        await self.broadcast("in the channel", channel=self.general)
+        await self.broadcast("in the dm", dm_group=self.dm_group)
+        frames = [await socket.receive_json_from() for _ in range(2)]
+        self.assertEqual(
+            [(frame["stream"], frame["data"]["content"]) for frame in frames],
+            [(self.channel_stream, "in the channel"), (self.dm_stream, "in the dm")],
+        )
+        self.assertEqual((await bob.receive_json_from())["stream"], self.dm_stream)
+        self.assertTrue(await bob.receive_nothing())
+
+        # Client frames are never relayed as they are: a forged event is refused.
+        forged = {"type": "reactions", "stream": self.dm_stream, "message_id": 1, "reactions": {"👍": 99}}
+        await socket.send_json_to(forged)
+        self.assertEqual(await socket.receive_json_from(), {"error": "Unsupported frame type.", "stream": self.dm_stream})
+        self.assertTrue(await bob.receive_nothing())
+        await bob.send_json_to({"type": "typing", "stream": self.channel_stream})
+        self.assertEqual(await bob.receive_json_from(), {"error": "Not subscribed to this stream."})
+        for communicator in (socket, bob):
+            await communicator.disconnect()
+
+    @async_to_sync
+    async def test_streams_the_user_does_not_belong_to_are_rejected(self):
+        socket = await self.connect(self.alice)
+        private = f"channel_{self.private.id}"
+        self.assertEqual(
+            await self.subscribe(socket, private), {"error": "Not a member of this conversation.", "stream": private},
+        )
+        self.assertEqual(await self.subscribe(socket, "bogus"), {"error": "Unknown stream.", "stream": "bogus"})
+        await self.broadcast("secret", channel=self.private)
+        self.assertTrue(await socket.receive_nothing())
+        await socket.disconnect()
+
+        single = WebsocketCommunicator(application, f"/ws/chat/{private}/?token={AccessToken.for_user(self.alice)}")
+        connected, _ = await single.connect()
+        self.assertFalse(connected)
+        anonymous = WebsocketCommunicator(application, "/ws/chat/")
+        connected, _ = await anonymous.connect()
+        self.assertFalse(connected)
@@ -0,0 +1,104 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from .membership import membership_index
+from .models import DirectMessageGroup
+
+User = get_user_model()
+
+
+class ParticipantKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = [
+            User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("alice", "bob", "carol")
+        ]
+
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+
+    def key(self, group):
+        group.refresh_from_db()
+        return group.participant_key
+
+    def test_key_is_canonical(self):
+        self.assertEqual(DirectMessageGroup.key_for([3, 1, 2, 1]), DirectMessageGroup.key_for(["2", 3, 1]))
+        self.assertNotEqual(DirectMessageGroup.key_for([1, 2]), DirectMessageGroup.key_for([1, 2, 3]))
+
+    def test_key_is_unique(self):
+        key = DirectMessageGroup.key_for([self.alice.id, self.bob.id])
+        DirectMessageGroup.objects.create(participant_key=key)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DirectMessageGroup.objects.create(participant_key=key)
+        # Any number of groups may be without one.
+        DirectMessageGroup.objects.bulk_create([DirectMessageGroup(), DirectMessageGroup()])
+
+    def test_membership_changes_keep_the_key_current(self):
+        group = DirectMessageGroup.objects.create()
+        group.participants.add(self.alice, self.bob)
+        self.assertEqual(self.key(group), DirectMessageGroup.key_for([self.alice.id, self.bob.id]))
+
+        self.carol.dm_groups.add(group)  # from the other side
+        self.assertEqual(self.key(group), DirectMessageGroup.key_for([self.alice.id, self.bob.id, self.carol.id]))
+        group.participants.remove(self.bob)
+        self.assertEqual(self.key(group), DirectMessageGroup.key_for([self.alice.id, self.carol.id]))
+        self.carol.dm_groups.clear()
+        self.assertEqual(self.key(group), DirectMessageGroup.key_for([self.alice.id]))
+        group.participants.clear()
+        self.assertEqual(self.key(group), DirectMessageGroup.key_for([]))
+
+    def test_a_duplicate_participant_set_leaves_the_first_group_canonical(self):
+        first = DirectMessageGroup.objects.create()
+        first.participants.add(self.alice, self.bob)
+        second = DirectMessageGroup.objects.create()
+        second.participants.add(self.alice)
+        second.participants.add(self.bob)
+        self.assertIsNone(self.key(second))
+        self.assertEqual(self.key(first), DirectMessageGroup.key_for([self.alice.id, self.bob.id]))
+
+    def test_create_endpoint_finds_the_existing_group(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        created = client.post("/api/dm-groups/", {"participants": [self.carol.id, self.bob.id]}, format="json")
+        self.assertEqual(created.status_code, 201)
+        client.force_authenticate(self.carol)
+        found = client.post("/api/dm-groups/", {"participants": [self.alice.id, self.bob.id]}, format="json")
+        self.assertEqual((found.status_code, found.json()["id"]), (200, created.json()["id"]))
+        self.assertEqual(DirectMessageGroup.objects.count(), 1)
+
+
+class ParticipantKeyMigrationTests(TransactionTestCase):
+    before = [("chat", "0006_message_history_indexes")]
+    after = [("chat", "0007_directmessagegroup_participant_key")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_groups_are_backfilled(self):
+        apps = self.migrate(self.before)
+        users = [apps.get_model("auth", "User").objects.create(username=name) for name in ("alice", "bob", "carol")]
+        Group = apps.get_model("chat", "DirectMessageGroup")
+        groups = [Group.objects.create() for _ in range(4)]
+        for group, members in zip(groups, (users[:2], users[1:], users[1::-1], [])):
+            group.participants.set(members)
+
+        apps = self.migrate(self.after)
+        keys = dict(apps.get_model("chat", "DirectMessageGroup").objects.values_list("id", "participant_key"))
+        self.assertEqual(keys, {
+            groups[0].id: DirectMessageGroup.key_for([users[0].id, users[1].id]),
+            groups[1].id: DirectMessageGroup.key_for([users[1].id, users[2].id]),
+            groups[2].id: None,  # the same pair as groups[0], which is older
+            groups[3].id: DirectMessageGroup.key_for([]),
+        })
@@ -0,0 +1,95 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .broadcast import broadcast_message
+from .event_log import options, record, replay, slot_key
+from .membership import membership_index
+from .models import Channel, Message
+
+User = get_user_model()
+
+
+class EventLogTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_events_are_numbered_per_stream(self):
+        texts = record([("channel_1", {"id": 1}), ("dm_2", {"id": 2}), ("channel_1", {"id": 3})])
+        self.assertEqual([json.loads(text)["seq"] for text in texts], [1, 1, 2])
+        self.assertEqual(json.loads(record([("channel_1", {"id": 4})])[0])["seq"], 3)
+
+    def test_replay_returns_only_the_delta(self):
+        texts = record([("channel_1", {"id": i}) for i in range(5)])
+        self.assertEqual(replay("channel_1", 3), (5, texts[3:]))
+        self.assertEqual(replay("channel_1", 5), (5, []))
+
+    @override_settings(CHAT_EVENT_LOG={"SIZE": 3, "TTL": 60})
+    def test_gaps_past_the_log_need_a_resync(self):
+        record([("channel_1", {"id": i}) for i in range(5)])
+        self.assertEqual(replay("channel_1", 1), (5, None))  # overwritten
+        self.assertEqual(replay("channel_1", 9), (5, None))  # counter was reset
+        cache.delete(slot_key("channel_1", 4, options()["SIZE"]))
+        self.assertEqual(replay("channel_1", 3), (5, None))  # hole before seq 5
+
+    def test_events_still_being_published_arrive_live(self):
+        texts = record([("channel_1", {"id": i}) for i in range(3)])
+        cache.delete(slot_key("channel_1", 3, options()["SIZE"]))
+        self.assertEqual(replay("channel_1", 0), (2, texts[:2]))
+
+
+class CatchUpWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(self.user)
+        self.stream = f"channel_{self.channel.id}"
+
+    async def post(self, *contents):
+        for content in contents:
+            message = await database_sync_to_async(Message.objects.create)(
+                channel=self.channel, sender=self.user, content=content,
+            )
+            await database_sync_to_async(broadcast_message)(message)
+
+    @async_to_sync
+    async def test_reconnect_replays_missed_messages(self):
+        socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(self.user)}")
+        await socket.connect()
+        await socket.send_json_to({"type": "subscribe", "stream": self.stream})
+        self.assertEqual(await socket.receive_json_from(), {"type": "subscribed", "stream": self.stream, "seq": 0})
+        await self.post("one")
+        self.assertEqual((await socket.receive_json_from())["data"]["seq"], 1)
+        await socket.disconnect()
+
+        await self.post("two", "three")
+        socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(self.user)}")
+        await socket.connect()
+        await socket.send_json_to({"type": "subscribe", "stream": self.stream, "last_seq": 1})
+        frame = await socket.receive_json_from()
+        self.assertEqual((frame["type"], frame["stream"], frame["seq"]), ("replay", self.stream, 3))
+        self.assertEqual([event["content"] for event in frame["events"]], ["two", "three"])
+        self.assertEqual(await socket.receive_json_from(), {"type": "subscribed", "stream": self.stream, "seq": 3})
+        await socket.disconnect()
+
+    @override_settings(CHAT_EVENT_LOG={"SIZE": 2, "TTL": 60})
+    @async_to_sync
+    async def test_single_stream_socket_is_told_to_resync(self):
+        await self.post("one", "two", "three")
+        socket = WebsocketCommunicator(
+            application, f"/ws/chat/{self.stream}/?token={AccessToken.for_user(self.user)}&last_seq=0",
+        )
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await socket.receive_json_from(), {"type": "resync", "stream": self.stream, "seq": 3})
+        await socket.disconnect()
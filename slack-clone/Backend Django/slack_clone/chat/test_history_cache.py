@@ -0,0 +1,111 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from .history_cache import HistoryCache, LocalLRUBackend, history_cache
+from .membership import membership_index
+from .models import Channel, Message
+
+User = get_user_model()
+
+
+class HistoryCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_local_backend_evicts_least_recently_used_by_size(self):
+        backend = LocalLRUBackend(max_bytes=10)
+        backend.set("a", b"aaaa")
+        backend.set("b", b"bbbb")
+        backend.get("a")
+        backend.set("c", b"cccc")
+        self.assertEqual((backend.get("a"), backend.get("b")), (b"aaaa", None))
+        self.assertEqual(backend.stats(), {"entries": 2, "bytes": 8, "evictions": 1})
+
+    def test_concurrent_misses_render_once(self):
+        history = HistoryCache(LocalLRUBackend())
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.1)
+            return b"[]"
+
+        threads = [threading.Thread(target=history.get_or_render, args=("channel_1", "", render)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual((history.misses, history.coalesced), (1, 4))
+
+    def test_invalidation_moves_to_a_new_version(self):
+        history = HistoryCache(LocalLRUBackend())
+        self.assertEqual(history.get_or_render("channel_1", "", lambda: b"old"), b"old")
+        history.invalidate({"channel_1"})
+        self.assertEqual(history.get_or_render("channel_1", "", lambda: b"new"), b"new")
+        self.assertEqual(history.stats()["hit_ratio"], 0)
+
+
+class HistoryPageCacheViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw", is_staff=True)
+        cls.channel = Channel.objects.create(name="general")
+        cls.channel.members.add(cls.user)
+        Message.objects.bulk_create([Message(channel=cls.channel, sender=cls.user, content=f"m{i}") for i in range(3)])
+
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        membership_index.load(self.user.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/channels/{self.channel.id}/messages/"
+
+    def contents(self):
+        return [message["content"] for message in self.client.get(self.url).json()["results"]]
+
+    def test_pages_are_served_from_cache_until_a_message_changes(self):
+        first = self.client.get(self.url).content
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).content, first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"content": "new"}, format="json")
+        self.assertEqual(self.contents(), ["m0", "m1", "m2", "new"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"/api/messages/{response.json()['id']}/", {"content": "edited"}, format="json")
+        self.assertEqual(self.contents()[-1], "edited")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/messages/{response.json()['id']}/")
+        self.assertEqual(self.contents(), ["m0", "m1", "m2"])
+
+    def test_page_parameters_are_part_of_the_key(self):
+        self.assertEqual(len(self.client.get(self.url + "?page_size=1").json()["results"]), 1)
+        self.assertEqual(len(self.client.get(self.url).json()["results"]), 3)
+
+    def test_key_is_built_from_the_parsed_page(self):
+        before = self.client.get(self.url + "?page_size=1").json()["before"]
+        # A page_size value smuggling a cursor renders (and caches) the newest page...
+        smuggled = self.client.get(self.url + f"?page_size=1%26before%3D{before}").json()["results"]
+        self.assertEqual([message["content"] for message in smuggled], ["m0", "m1", "m2"])
+        # ...which the real cursor request must not be served.
+        older = self.client.get(self.url + f"?page_size=1&before={before}").json()["results"]
+        self.assertEqual([message["content"] for message in older], ["m1"])
+
+        # Junk and default page sizes are the same page, so the same entry.
+        misses = history_cache.misses
+        self.client.get(self.url + "?page_size=junk")
+        self.client.get(self.url + "?page_size=50")
+        self.assertEqual(history_cache.misses, misses)
+
+    def test_metrics(self):
+        self.client.get(self.url)
+        self.assertIn("hit_ratio", self.client.get("/api/metrics/history-cache/").json())
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from channels.exceptions import ChannelFull
+from django.test import SimpleTestCase
+
+from .layers import BrokerChannelLayer, BrokerConnection, ChannelBroker
+
+
+# Two broker shards and two "worker" layers, all in-process over Unix sockets
+class BrokerChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sockets = [os.path.join(self.tmpdir, f"shard{i}.sock") for i in range(2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    async def start(self, broker=ChannelBroker, **config):
+        self.brokers = [broker() for _ in self.sockets]
+        servers = [await broker.serve(path) for broker, path in zip(self.brokers, self.sockets)]
+        layers = [BrokerChannelLayer(hosts=self.sockets, **config) for _ in range(2)]
+        return servers, layers
+
+    async def stop(self, servers, layers):
+        for layer in layers:
+            await layer.close()
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+
+    async def test_group_send_reaches_channels_on_other_workers(self):
+        servers, (worker_a, worker_b) = await self.start()
+        try:
+            channels = [await worker_a.new_channel() for _ in range(20)]
+            for channel in channels:
+                await worker_a.group_add("channel_1", channel)
+
+            await worker_b.group_send("channel_1", {"type": "chat.message", "text": "hi", "raw": b"\x00\x01"})
+            received = await asyncio.wait_for(
+                asyncio.gather(*(worker_a.receive(channel) for channel in channels)), timeout=2
+            )
+            self.assertEqual({m["text"] for m in received}, {"hi"})
+            self.assertEqual(received[0]["raw"], b"\x00\x01")
+            self.assertEqual(worker_b.metrics["fanout"], 20)
+
+            # Channels hash onto both shards.
+            stats = await worker_b.stats()
+            self.assertTrue(all(shard["delivered"] for shard in stats["shards"].values()))
+        finally:
+            await self.stop(servers, layers=[worker_a, worker_b])
+
+    async def test_group_discard_and_blocking_receive(self):
+        servers, (worker_a, worker_b) = await self.start()
+        try:
+            channel = await worker_a.new_channel()
+            await worker_a.group_add("dm_1", channel)
+            waiting = asyncio.ensure_future(worker_a.receive(channel))
+            await asyncio.sleep(0.05)
+            await worker_b.group_send("dm_1", {"type": "chat.message", "text": "first"})
+            self.assertEqual((await asyncio.wait_for(waiting, timeout=2))["text"], "first")
+
+            await worker_a.group_discard("dm_1", channel)
+            await worker_b.group_send("dm_1", {"type": "chat.message", "text": "second"})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(worker_a.receive(channel), timeout=0.2)
+        finally:
+            await self.stop(servers, layers=[worker_a, worker_b])
+
+    async def test_capacity_applies_backpressure(self):
+        servers, (worker_a, worker_b) = await self.start(capacity=2)
+        try:
+            channel = await worker_a.new_channel()
+            await worker_b.send(channel, {"type": "x"})
+            await worker_b.send(channel, {"type": "x"})
+            with self.assertRaises(ChannelFull):
+                await worker_b.send(channel, {"type": "x"})
+
+            await worker_a.group_add("channel_2", channel)
+            await worker_b.group_send("channel_2", {"type": "x"})
+            self.assertEqual(worker_b.metrics["channel_full"], 2)
+        finally:
+            await self.stop(servers, layers=[worker_a, worker_b])
+
+    async def test_queues_of_gone_channels_are_dropped(self):
+        servers, (worker_a, worker_b) = await self.start(broker=lambda: ChannelBroker(sweep_interval=0), expiry=0.1)
+        try:
+            received, abandoned = await worker_a.new_channel(), await worker_b.new_channel()
+            await worker_b.send(received, {"type": "x"})
+            await worker_b.send(received, {"type": "x"})
+            await worker_a.receive(received)
+            await worker_a.send(abandoned, {"type": "x"})
+            self.assertEqual(sum(len(broker.queues) for broker in self.brokers), 2)
+
+            # The worker that read `received` goes away with a message left.
+            await worker_a.close()
+            await asyncio.sleep(0.05)
+            self.assertEqual([list(broker.queues) for broker in self.brokers if broker.queues], [[abandoned]])
+
+            # Nobody ever read `abandoned`: swept once its message expired.
+            await asyncio.sleep(0.1)
+            await worker_b.send(await worker_b.new_channel(), {"type": "x"})
+            self.assertNotIn(abandoned, [channel for broker in self.brokers for channel in broker.queues])
+        finally:
+            await self.stop(servers, layers=[worker_a, worker_b])
+
+    async def test_closing_an_unused_connection(self):
+        await BrokerConnection(self.sockets[0]).close()
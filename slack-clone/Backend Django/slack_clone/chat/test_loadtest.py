@@ -0,0 +1,35 @@
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from .benchmarks import loadtest
+from .membership import membership_index
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class LoadTestSmokeTests(TransactionTestCase):
+    # The load test at toy scale: every phase must run without errors.
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+
+    def test_every_phase_succeeds(self):
+        # One REST request at a time: the SQLite test database is in-memory
+        # shared-cache, where a write that meets another thread's table lock
+        # fails at once instead of waiting. Concurrency is for real runs.
+        args = loadtest.parse_args([
+            "--clients", "8", "--channels", "3", "--channels-per-user", "2", "--history", "60",
+            "--pages", "1", "--posts", "4", "--concurrency", "1", "--drain-timeout", "10",
+        ])
+        report = async_to_sync(loadtest.run)(args)
+
+        phases = report["phases"]
+        for name, phase in phases.items():
+            self.assertEqual(phase["errors"], {}, name)
+            self.assertGreater(phase["ok"], 0, name)
+        self.assertEqual(phases["login"]["ok"], 8)
+        self.assertEqual(phases["connect"]["ok"], 8)
+        self.assertEqual(phases["history"]["ok"], 8 * 2 * 2)
+        self.assertEqual(phases["fanout"]["missing"], 0)
+        self.assertEqual(report["memory"]["connections"], 8)
+        self.assertGreater(report["memory"]["heap_bytes_per_connection"], 0)
@@ -0,0 +1,97 @@
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message
+
+User = get_user_model()
+
+
+class MembershipIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.channel = Channel.objects.create(name="general")
+        cls.channel.members.add(cls.user)
+        cls.dm_group = DirectMessageGroup.objects.create()
+        cls.dm_group.participants.add(cls.user)
+        cls.message = Message.objects.create(channel=cls.channel, sender=cls.user, content="hi")
+
+    def setUp(self):
+        membership_index.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_index_loads_channels_and_dm_groups_in_one_query(self):
+        with self.assertNumQueries(1):
+            streams = membership_index.load(self.user.id)
+        self.assertEqual(streams, {f"channel_{self.channel.id}", f"dm_{self.dm_group.id}"})
+        with self.assertNumQueries(0):
+            self.assertTrue(membership_index.is_member(self.user.id, f"channel_{self.channel.id}"))
+
+    def test_non_members_are_refused(self):
+        other = Channel.objects.create(name="random")
+        Message.objects.create(channel=other, sender=self.user, content="hi")
+        self.assertEqual(self.client.get(f"/api/channels/{other.id}/messages/").status_code, 403)
+        self.assertEqual(self.client.get(f"/api/messages/{other.messages.get().id}/").status_code, 403)
+
+        self.assertEqual(self.client.post(f"/api/channels/{other.id}/membership/").status_code, 204)
+        self.assertEqual(self.client.get(f"/api/channels/{other.id}/messages/").status_code, 200)
+
+    def test_membership_changes_invalidate_the_index(self):
+        stream = f"channel_{self.channel.id}"
+        membership_index.load(self.user.id)
+        self.channel.members.remove(self.user)
+        self.assertFalse(membership_index.is_member(self.user.id, stream))
+        self.user.channels.add(self.channel)
+        self.assertTrue(membership_index.is_member(self.user.id, stream))
+        self.channel.members.clear()
+        self.assertFalse(membership_index.is_member(self.user.id, stream))
+
+    def test_membership_added_elsewhere_is_found_on_a_miss(self):
+        other = Channel.objects.create(name="random")
+        membership_index.load(self.user.id)
+        # A raw insert fires no signal, like a change made in another process.
+        Channel.members.through.objects.create(channel=other, user=self.user)
+        self.assertTrue(membership_index.is_member(self.user.id, f"channel_{other.id}"))
+
+
+class MembershipWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        membership_index.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.other = Channel.objects.create(name="random")
+        self.channel.members.add(self.user)
+
+    def connect(self, path):
+        return WebsocketCommunicator(application, f"{path}?token={AccessToken.for_user(self.user)}")
+
+    @async_to_sync
+    async def test_subscribe_requires_membership_and_removal_revokes_it(self):
+        socket = self.connect("/ws/chat/")
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+
+        await socket.send_json_to({"type": "subscribe", "stream": f"channel_{self.other.id}"})
+        self.assertEqual((await socket.receive_json_from())["error"], "Not a member of this conversation.")
+        await socket.send_json_to({"type": "subscribe", "stream": f"channel_{self.channel.id}"})
+        self.assertEqual((await socket.receive_json_from())["type"], "subscribed")
+
+        await database_sync_to_async(self.channel.members.remove)(self.user)
+        frame = await socket.receive_json_from()
+        self.assertEqual(frame, {"type": "unsubscribed", "stream": f"channel_{self.channel.id}", "reason": "membership_revoked"})
+        await socket.disconnect()
+
+    @async_to_sync
+    async def test_single_stream_socket_is_rejected_for_non_members(self):
+        socket = self.connect(f"/ws/chat/channel_{self.other.id}/")
+        connected, _ = await socket.connect()
+        self.assertFalse(connected)
@@ -0,0 +1,144 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .broadcast import group_send
+from .membership import membership_index
+from .metrics import HistogramMetric, Metrics, metrics
+from .models import Channel
+
+User = get_user_model()
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_exposition_is_cumulative(self):
+        histogram = HistogramMetric("chat_test_seconds", "Test.", (0.1, 1), ("view",))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, "a")
+        self.assertEqual(list(histogram.samples()), [
+            'chat_test_seconds_bucket{view="a",le="0.1"} 1',
+            'chat_test_seconds_bucket{view="a",le="1"} 2',
+            'chat_test_seconds_bucket{view="a",le="+Inf"} 3',
+            'chat_test_seconds_sum{view="a"} 5.55',
+            'chat_test_seconds_count{view="a"} 3',
+        ])
+
+    def test_disabled_hooks_record_nothing(self):
+        disabled = Metrics(enabled=False)
+        started = disabled.start()
+        self.assertIsNone(started)
+        disabled.observe(disabled.send, started)
+        disabled.stream_joined("channel_1")
+        disabled.delivered({"group": "channel_1", "sent_at": 0})
+        self.assertEqual(disabled.send.series, {})
+        self.assertEqual(disabled.stream_sockets, {})
+        self.assertEqual(disabled.stream_deliveries, {})
+
+    def test_only_the_busiest_streams_are_exported(self):
+        registry = Metrics(top_streams=1)
+        registry.stream_joined("channel_1")
+        registry.stream_joined("channel_2")
+        registry.stream_joined("channel_2")
+        text = registry.render()
+        self.assertIn('chat_stream_sockets{stream="channel_2"} 2', text)
+        self.assertNotIn('stream="channel_1"', text)
+        self.assertIn("chat_stream_subscriptions 3", text)
+
+    def test_streams_without_sockets_are_pruned(self):
+        registry = Metrics()
+        for stream in ("channel_1", "channel_2"):
+            registry.stream_joined(stream)
+            registry.delivered({"group": stream})
+            registry.frame_handled(stream, "custom", registry.start())
+        registry.stream_left("channel_1")
+        # A frame still in flight for a stream that was just left.
+        registry.delivered({"group": "channel_1"})
+        registry.frame_handled("channel_1", "custom", registry.start())
+
+        for counter in (registry.stream_sockets, registry.stream_seconds, registry.stream_deliveries):
+            self.assertEqual(list(counter), ["channel_2"])
+        self.assertNotIn('stream="channel_1"', registry.render())
+
+
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.staff = User.objects.create_user("root", "root@example.com", "pw", is_staff=True)
+
+    def setUp(self):
+        metrics.reset()
+        self.client = APIClient()
+
+    def test_queries_and_time_per_view(self):
+        self.client.force_authenticate(self.user)
+        self.client.get("/api/unread/")
+        self.client.force_authenticate(self.staff)
+        text = self.client.get("/api/metrics/").content.decode()
+        self.assertIn('chat_http_request_seconds_count{view="unread-counts",method="GET"} 1', text)
+        self.assertIn('chat_http_queries_count{view="unread-counts",method="GET"} 1', text)
+        self.assertIn('chat_http_responses_total{view="unread-counts",method="GET",status="2xx"} 1', text)
+        self.assertIn('chat_http_cpu_seconds_total{view="unread-counts",method="GET"}', text)
+
+    def test_staff_or_scrape_token_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+        client = APIClient()
+        with override_settings(CHAT_METRICS={"SCRAPE_TOKEN": "s3cret"}):
+            response = client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer s3cret")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response["Content-Type"].startswith("text/plain"))
+            self.assertEqual(client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer guess").status_code, 401)
+
+    def test_sampled_profiles_per_view(self):
+        self.client.force_authenticate(self.staff)
+        with mock.patch.object(metrics, "profile_sample_rate", 1.0):
+            self.client.get("/api/unread/")
+        report = self.client.get("/api/metrics/profile/").json()
+        self.assertEqual(report["unread-counts"]["samples"], 1)
+        self.assertTrue(report["unread-counts"]["functions"])
+
+        self.client.delete("/api/metrics/profile/")
+        self.assertNotIn("unread-counts", self.client.get("/api/metrics/profile/").json())
+
+
+class SocketMetricsTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        metrics.reset()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(self.user)
+
+    @async_to_sync
+    async def test_handshake_frames_and_fanout(self):
+        stream = f"channel_{self.channel.id}"
+        socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(self.user)}")
+        await socket.connect()
+        await socket.send_json_to({"type": "subscribe", "stream": stream})
+        await socket.receive_json_from()
+        await group_send(stream, {"content": "hi"})
+        await socket.receive_json_from()
+
+        text = metrics.render()
+        self.assertIn('chat_ws_handshake_seconds_count{consumer="MultiplexConsumer"} 1', text)
+        self.assertIn('chat_ws_auth_seconds_count{result="loaded"} 1', text)
+        self.assertIn('chat_ws_receive_seconds_count{frame="subscribe"} 1', text)
+        self.assertIn(f'chat_stream_sockets{{stream="{stream}"}} 1', text)
+        self.assertIn(f'chat_stream_deliveries_total{{stream="{stream}"}} 1', text)
+        self.assertIn('chat_fanout_sockets_bucket{le="1"} 1', text)
+        self.assertIn('chat_fanout_lag_seconds_count{kind="message"} 1', text)
+        self.assertIn('chat_group_send_seconds_count{event="chat.message"} 1', text)
+
+        await socket.disconnect()
+        self.assertNotIn(stream, metrics.stream_sockets)
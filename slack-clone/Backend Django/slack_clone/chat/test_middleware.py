@@ -0,0 +1,81 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.test import SimpleTestCase, TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .middleware import TokenUserCache, resolve_token, token_user_cache
+
+User = get_user_model()
+
+
+class TokenUserCacheTests(SimpleTestCase):
+    def user(self, pk):
+        return SimpleNamespace(pk=pk)
+
+    def test_entries_expire_with_the_token_or_at_max_ttl(self):
+        cache = TokenUserCache(max_ttl=300)
+        now = time.time()
+        cache.set("short", self.user(1), expires_at=now + 60)
+        cache.set("long", self.user(1), expires_at=now + 3600)
+
+        with mock.patch("chat.middleware.time.time", return_value=now + 61):
+            self.assertIsNone(cache.get("short"))
+            self.assertIsNotNone(cache.get("long"))
+        with mock.patch("chat.middleware.time.time", return_value=now + 301):
+            self.assertIsNone(cache.get("long"))
+        self.assertEqual((cache.entries, cache.keys_by_user), ({}, {}))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = TokenUserCache(max_size=2)
+        expires_at = time.time() + 60
+        cache.set("a", self.user(1), expires_at)
+        cache.set("b", self.user(2), expires_at)
+        cache.get("a")
+        cache.set("c", self.user(3), expires_at)
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertNotIn(2, cache.keys_by_user)
+
+    def test_invalidate_user_drops_all_their_tokens(self):
+        cache = TokenUserCache()
+        expires_at = time.time() + 60
+        for key in ("phone", "laptop"):
+            cache.set(key, self.user(1), expires_at)
+        cache.set("other", self.user(2), expires_at)
+        cache.invalidate_user(1)
+        self.assertEqual(list(cache.entries), ["other"])
+
+
+class TokenResolutionTests(TransactionTestCase):
+    def setUp(self):
+        token_user_cache.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.token = str(AccessToken.for_user(self.user))
+
+    def resolve(self):
+        return async_to_sync(resolve_token)(self.token)
+
+    def test_users_are_cached_per_token(self):
+        self.assertEqual(self.resolve(), (self.user, "loaded"))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve(), (self.user, "cached"))
+        self.assertEqual(async_to_sync(resolve_token)("junk")[1], "invalid")
+
+    def test_deactivation_evicts_cached_tokens(self):
+        self.resolve()
+        self.user.is_active = False
+        self.user.save()
+        user, result = self.resolve()
+        self.assertIsInstance(user, AnonymousUser)
+        self.assertEqual(result, "inactive")
+
+    def test_password_change_evicts_cached_tokens(self):
+        self.resolve()
+        self.user.set_password("new password")
+        self.user.save()
+        self.assertEqual(token_user_cache.entries, {})
+        self.assertEqual(self.resolve()[1], "loaded")
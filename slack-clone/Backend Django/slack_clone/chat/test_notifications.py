@@ -0,0 +1,144 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import notifications
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message, Notification, NotificationDigest, NotificationJob
+from .notifications import build_digests, claim, drain, parse_mentions
+from .presence import presence_key
+
+User = get_user_model()
+
+
+class MentionParsingTests(SimpleTestCase):
+    def test_usernames_and_conversation_wide_mentions(self):
+        self.assertEqual(parse_mentions("hi @bob and @carol.smith."), ({"bob", "carol.smith"}, False))
+        self.assertEqual(parse_mentions("@here lunch?"), (set(), True))
+        self.assertEqual(parse_mentions("mail bob@example.com"), (set(), False))
+
+
+@override_settings(CHAT_NOTIFICATIONS={"CHUNK": 2, "DIGEST_DELAY": 60, "MAX_ATTEMPTS": 2})
+class NotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol, cls.dave = [
+            User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("alice", "bob", "carol", "dave")
+        ]
+        cls.channel = Channel.objects.create(name="general")
+        cls.channel.members.add(cls.alice, cls.bob, cls.carol, cls.dave)
+
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    # ------------------------ HELPERS ------------------------
+
+    def post(self, content, url=None):
+        response = self.client.post(url or f"/api/channels/{self.channel.id}/messages/", {"content": content}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()["id"]
+
+    def notified(self, message_id):
+        rows = Notification.objects.filter(message_id=message_id).values_list("user__username", "kind")
+        return dict(rows)
+
+    # ------------------------ TESTS ------------------------
+
+    def test_posting_only_enqueues_a_job(self):
+        def count_post_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.post("hi")
+            return len(ctx.captured_queries)
+
+        # Each measurement follows a post that loads alice's membership index.
+        self.post("warm up")
+        small = count_post_queries()
+        self.channel.members.add(*User.objects.bulk_create(
+            [User(username=f"user{i}", email=f"user{i}@example.com") for i in range(50)]
+        ))
+        self.post("warm up")
+        self.assertEqual(count_post_queries(), small)
+        self.assertEqual(NotificationJob.objects.count(), 4)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_offline_members_and_mentions_are_notified(self):
+        cache.set(presence_key(self.carol.id), time.time(), 60)
+        cache.set(presence_key(self.dave.id), time.time(), 60)
+        message_id = self.post("ping @dave")
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(drain(), (1, 0))
+
+        # bob is offline, carol saw it live, dave is mentioned; alice sent it.
+        self.assertEqual(self.notified(message_id), {"bob": "message", "dave": "mention"})
+        inserts = [q for q in ctx.captured_queries if q["sql"].startswith('INSERT INTO "chat_notification"')]
+        self.assertEqual(len(inserts), 2)  # three other members, CHUNK = 2
+        self.assertFalse(NotificationJob.objects.exists())
+
+    def test_conversation_wide_mentions_and_direct_messages(self):
+        message_id = self.post("@channel standup")
+        dm_group = DirectMessageGroup.objects.create()
+        dm_group.participants.add(self.alice, self.bob)
+        dm_id = self.post("psst", url=f"/api/dm-groups/{dm_group.id}/messages/")
+        drain()
+
+        self.assertEqual(self.notified(message_id), {"bob": "mention", "carol": "mention", "dave": "mention"})
+        self.assertEqual(self.notified(dm_id), {"bob": "direct"})
+
+    def test_bursts_are_coalesced_into_one_digest(self):
+        for content in ("one", "two", "@bob three"):
+            self.post(content)
+        self.assertEqual(drain(), (3, 0))  # the burst isn't over yet
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(build_digests(timezone.now() + timedelta(seconds=61)), 3)
+        self.assertFalse(Notification.objects.filter(digest__isnull=True).exists())
+
+        bob = APIClient()
+        bob.force_authenticate(self.bob)
+        [digest] = bob.get("/api/notifications/").json()
+        stream = f"channel_{self.channel.id}"
+        self.assertEqual(digest["count"], 3)
+        self.assertEqual(
+            [(entry["stream"], entry["kind"], entry["count"]) for entry in digest["summary"]],
+            [(stream, "mention", 1), (stream, "message", 2)],
+        )
+        self.assertEqual(bob.post("/api/notifications/read/").status_code, 204)
+        self.assertIsNotNone(NotificationDigest.objects.get(pk=digest["id"]).read_at)
+
+    def test_claimed_jobs_are_leased(self):
+        self.post("hi")
+        self.assertEqual(len(claim(10)), 1)
+        self.assertEqual(claim(10), [])
+        self.assertEqual(len(claim(10, now=timezone.now() + timedelta(seconds=61))), 1)  # lease ran out
+
+    def test_failed_jobs_are_retried_then_parked(self):
+        self.post("hi")
+        failing = mock.patch.object(notifications, "notify", side_effect=RuntimeError("boom"))
+        with failing, self.assertLogs("chat.notifications", "ERROR"):
+            notifications.process_batch()
+            job = NotificationJob.objects.get()
+            self.assertEqual(job.attempts, 1)
+            self.assertGreater(job.available_at, timezone.now())
+            self.assertIn("boom", job.last_error)
+
+            NotificationJob.objects.update(available_at=timezone.now())
+            notifications.process_batch()
+        self.assertIsNone(NotificationJob.objects.get().available_at)  # MAX_ATTEMPTS = 2
+
+    def test_jobs_for_deleted_messages_are_dropped(self):
+        message_id = self.post("oops")
+        Message.objects.filter(pk=message_id).delete()
+        self.assertEqual(drain(), (1, 0))
+        self.assertFalse(NotificationJob.objects.exists())
+        self.assertFalse(Notification.objects.exists())
@@ -0,0 +1,129 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .consumers import MultiplexConsumer
+from .membership import membership_index
+from .models import Channel
+from .outbox import EVICTED_CLOSE_CODE, Outbox, OutboxMetrics
+
+User = get_user_model()
+
+
+class StalledSocket:
+    # send() blocks until the test lets frames through.
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.evictions = []
+
+    async def send(self, frame):
+        await self.gate.wait()
+        self.sent.append(frame)
+
+    async def evict(self, reason):
+        self.evictions.append(reason)
+
+
+class OutboxTests(SimpleTestCase):
+    def make_outbox(self, **kwargs):
+        socket = StalledSocket()
+        metrics = OutboxMetrics()
+        return socket, Outbox(socket.send, socket.evict, metrics=metrics, **kwargs), metrics
+
+    @async_to_sync
+    async def test_droppable_frames_go_first_and_typing_coalesces(self):
+        socket, outbox, metrics = self.make_outbox(max_frames=4)
+        outbox.put("m1")
+        outbox.put("ice1", "ice")
+        outbox.put("t1", "typing", key=("typing", "channel_1"))
+        outbox.put("t2", "typing", key=("typing", "channel_1"))
+        outbox.put("m2")
+        outbox.put("m3")  # full: sheds ice1
+        outbox.put("ice2", "ice")  # full: dropped on arrival
+
+        socket.gate.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(socket.sent, ["m1", "t2", "m2", "m3"])
+        self.assertEqual(metrics.dropped, {"ice": 2})
+        self.assertEqual(metrics.coalesced, 1)
+        self.assertEqual(socket.evictions, [])
+        outbox.stop()
+
+    @async_to_sync
+    async def test_consumer_is_evicted_when_undroppable_frames_overflow(self):
+        socket, outbox, metrics = self.make_outbox(max_frames=3)
+        for i in range(4):
+            outbox.put(f"m{i}")
+        await asyncio.sleep(0)
+        self.assertEqual(socket.evictions, ["overflow"])
+        self.assertEqual(metrics.snapshot()["evicted"], {"overflow": 1})
+        self.assertEqual(metrics.snapshot()["connections"], 0)
+
+    @async_to_sync
+    async def test_consumer_that_stays_congested_is_evicted(self):
+        socket, outbox, metrics = self.make_outbox(high_water=2, slow_after=0.05)
+        for i in range(3):
+            outbox.put(f"m{i}")
+        self.assertEqual(metrics.snapshot()["congested"], 1)
+        await asyncio.sleep(0.1)
+        outbox.put("m3")
+        await asyncio.sleep(0)
+        self.assertEqual(socket.evictions, ["slow"])
+
+    @async_to_sync
+    async def test_stale_droppable_frames_are_skipped(self):
+        socket, outbox, metrics = self.make_outbox(stale_after=0.02)
+        outbox.put("m1")  # in flight, blocked on the socket
+        outbox.put("t1", "typing")
+        outbox.put("m2")
+        await asyncio.sleep(0.05)
+        socket.gate.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(socket.sent, ["m1", "m2"])
+        self.assertEqual(metrics.dropped, {"typing": 1})
+        outbox.stop()
+
+
+@override_settings(CHAT_OUTBOX={"MAX_FRAMES": 5})
+class OutboxWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        membership_index.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(self.user)
+
+    @async_to_sync
+    async def test_socket_that_cannot_keep_up_is_closed(self):
+        async def stalled(consumer, frame):
+            await asyncio.Event().wait()  # a client that never reads
+
+        with mock.patch.object(MultiplexConsumer, "send_now", stalled):
+            socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(self.user)}")
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            for _ in range(7):
+                await socket.send_json_to({"type": "unsubscribe", "stream": "channel_1"})
+            output = await socket.receive_output(timeout=1)
+        self.assertEqual(output, {"type": "websocket.close", "code": EVICTED_CLOSE_CODE})
+        await socket.disconnect()
+
+
+class OutboxMetricsViewTests(TestCase):
+    def test_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("bob", "bob@example.com", "pw"))
+        self.assertEqual(client.get("/api/metrics/outbox/").status_code, 403)
+
+        client.force_authenticate(User.objects.create_user("root", "root@example.com", "pw", is_staff=True))
+        response = client.get("/api/metrics/outbox/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("frames_dropped", response.json())
@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .membership import membership_index
+from .models import Channel, Message
+from .pagination import MessageCursorPagination
+
+User = get_user_model()
+
+
+class MessageCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.channel = Channel.objects.create(name="general")
+        cls.channel.members.add(cls.user)
+        messages = Message.objects.bulk_create(
+            [Message(channel=cls.channel, sender=cls.user, content=f"m{i}") for i in range(10)]
+        )
+        # Pairs of messages share a timestamp, so pages must break ties by id.
+        start = timezone.now() - timedelta(hours=1)
+        for i, message in enumerate(messages):
+            Message.objects.filter(pk=message.pk).update(timestamp=start + timedelta(seconds=i // 2))
+
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/channels/{self.channel.id}/messages/"
+
+    def page(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        return [message["content"] for message in data["results"]], data["before"], data["after"]
+
+    def test_walks_back_and_forth_through_history(self):
+        contents, before, after = self.page(page_size=4)
+        self.assertEqual((contents, after), (["m6", "m7", "m8", "m9"], None))
+
+        contents, before, after = self.page(page_size=4, before=before)
+        self.assertEqual(contents, ["m2", "m3", "m4", "m5"])
+        contents, oldest, older_after = self.page(page_size=4, before=before)
+        self.assertEqual((contents, oldest), (["m0", "m1"], None))
+
+        contents, _, after = self.page(page_size=4, after=older_after)
+        self.assertEqual(contents, ["m2", "m3", "m4", "m5"])
+        contents, _, newest = self.page(page_size=4, after=after)
+        self.assertEqual((contents, newest), (["m6", "m7", "m8", "m9"], None))
+
+    def test_exact_page_boundaries(self):
+        contents, before, _ = self.page(page_size=5)
+        self.assertEqual(contents, ["m5", "m6", "m7", "m8", "m9"])
+        contents, before, after = self.page(page_size=5, before=before)
+        self.assertEqual(contents, ["m0", "m1", "m2", "m3", "m4"])
+        self.assertIsNone(before)  # no empty page past the oldest message
+        self.assertIsNotNone(after)
+
+        contents, before, after = self.page(page_size=10)
+        self.assertEqual((len(contents), before, after), (10, None, None))
+
+    def test_around_centres_the_window_on_the_anchor(self):
+        anchor = MessageCursorPagination().encode_cursor(Message.objects.get(content="m5"))
+        contents, before, after = self.page(page_size=4, around=anchor)
+        self.assertEqual(contents, ["m3", "m4", "m5", "m6"])
+        self.assertEqual(self.page(page_size=4, before=before)[0], ["m0", "m1", "m2"])
+        self.assertEqual(self.page(page_size=4, after=after)[0], ["m7", "m8", "m9"])
+
+        # Near either end the window is short on that side.
+        oldest = MessageCursorPagination().encode_cursor(Message.objects.get(content="m0"))
+        contents, before, after = self.page(page_size=4, around=oldest)
+        self.assertEqual((contents, before), (["m0", "m1"], None))
+        newest = MessageCursorPagination().encode_cursor(Message.objects.get(content="m9"))
+        contents, before, after = self.page(page_size=5, around=newest)
+        self.assertEqual((contents, after), (["m7", "m8", "m9"], None))
+
+    def test_page_size_is_clamped(self):
+        self.assertEqual(len(self.page(page_size=0)[0]), 1)
+        self.assertEqual(len(self.page(page_size="junk")[0]), 10)
+
+    def test_invalid_cursors_and_anchors(self):
+        # Not base64, "not-a-cursor", empty, and "1:" (no id).
+        for cursor in ("junk!", "bm90LWEtY3Vyc29y", "", "MTo"):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(self.url, {"before": cursor}).status_code, 404)
+        _, before, _ = self.page(page_size=2)
+        response = self.client.get(self.url, {"before": before, "after": before})
+        self.assertEqual(response.status_code, 404)
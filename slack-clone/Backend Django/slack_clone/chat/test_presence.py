@@ -0,0 +1,111 @@
+import time
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .membership import membership_index
+from .models import Channel, Workspace
+from .presence import presence_key
+
+User = get_user_model()
+
+FAST_PRESENCE = {"HEARTBEAT_INTERVAL": 25, "TTL": 60, "FLUSH_INTERVAL": 0.2, "TYPING_THROTTLE": 3.0}
+
+
+class PresenceSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.other = User.objects.create_user("bob", "bob@example.com", "pw")
+        cls.workspace = Workspace.objects.create(name="acme")
+        cls.workspace.members.add(cls.user, cls.other)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_snapshot_lists_members_with_a_live_heartbeat(self):
+        cache.set(presence_key(self.other.id), time.time(), 60)
+        outsider = User.objects.create_user("eve", "eve@example.com", "pw")
+        cache.set(presence_key(outsider.id), time.time(), 60)
+
+        response = self.client.get(f"/api/workspaces/{self.workspace.id}/presence/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["stream"], f"presence_{self.workspace.id}")
+        self.assertEqual([entry["id"] for entry in response.json()["online"]], [self.other.id])
+
+    def test_snapshot_is_for_members_only(self):
+        other_workspace = Workspace.objects.create(name="other")
+        self.assertEqual(self.client.get(f"/api/workspaces/{other_workspace.id}/presence/").status_code, 403)
+
+
+@override_settings(CHAT_PRESENCE=FAST_PRESENCE)
+class PresenceWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.users = [User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("alice", "bob", "carol")]
+        self.workspace = Workspace.objects.create(name="acme")
+        self.workspace.members.add(*self.users)
+        self.channel = Channel.objects.create(workspace=self.workspace, name="general")
+        self.channel.members.add(*self.users)
+
+    async def connect(self, user, *streams):
+        socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(user)}")
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        for stream in streams:
+            await socket.send_json_to({"type": "subscribe", "stream": stream})
+            self.assertEqual((await socket.receive_json_from())["type"], "subscribed")
+        return socket
+
+    async def receive_data(self, socket, frame_type):
+        while True:
+            frame = await socket.receive_json_from(timeout=2)
+            if frame.get("data", {}).get("type") == frame_type:
+                return frame
+
+    @async_to_sync
+    async def test_presence_changes_are_batched_per_workspace(self):
+        presence = f"presence_{self.workspace.id}"
+        alice = await self.connect(self.users[0], presence)
+        await self.receive_data(alice, "presence")  # alice's own arrival
+
+        bob = await self.connect(self.users[1])
+        carol = await self.connect(self.users[2])
+        frame = await self.receive_data(alice, "presence")
+        self.assertEqual(frame, {"stream": presence, "data": {
+            "type": "presence", "online": [self.users[1].id, self.users[2].id], "offline": [],
+        }})
+
+        await bob.disconnect()
+        frame = await self.receive_data(alice, "presence")
+        self.assertEqual(frame["data"]["offline"], [self.users[1].id])
+        await alice.disconnect()
+        await carol.disconnect()
+
+    @async_to_sync
+    async def test_typing_is_coalesced_and_throttled(self):
+        stream = f"channel_{self.channel.id}"
+        alice, bob, carol = [await self.connect(user, stream) for user in self.users]
+
+        for _ in range(5):
+            await bob.send_json_to({"type": "typing", "stream": stream})
+        await carol.send_json_to({"type": "typing", "stream": stream})
+        frame = await self.receive_data(alice, "typing")
+        self.assertEqual(frame["data"]["user_ids"], [self.users[1].id, self.users[2].id])
+
+        # Still typing within TYPING_THROTTLE: nothing new is broadcast.
+        await bob.send_json_to({"type": "typing", "stream": stream})
+        self.assertTrue(await alice.receive_nothing(timeout=0.2))
+
+        for socket in (alice, bob, carol):
+            await socket.disconnect()
@@ -0,0 +1,105 @@
+import base64
+import zlib
+
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .broadcast import broadcast_message, build_event
+from .membership import membership_index
+from .models import Channel, Message
+from .protocol import FORMATS, MAX_FRAME_SIZE, ZDICT, FrameCache, dumps, negotiate
+
+User = get_user_model()
+
+
+class CodecTests(SimpleTestCase):
+    payload = {"id": 1, "content": "hello " * 200, "is_read": False, "sender": {"id": 2, "username": "bob"}}
+
+    def test_every_format_round_trips(self):
+        for name, codec in FORMATS.items():
+            with self.subTest(name):
+                frame = codec.encode(self.payload)
+                self.assertIsInstance(frame, bytes if codec.binary else str)
+                text, data = (None, frame) if codec.binary else (frame, None)
+                self.assertEqual(codec.decode(text, data), self.payload)
+
+    def test_large_payloads_are_deflated_with_the_dictionary(self):
+        frame = FORMATS["msgpack+deflate"].encode(self.payload)
+        self.assertEqual(frame[:1], b"\x01")
+        self.assertLess(len(frame), len(msgpack.packb(self.payload)) // 4)
+        body = zlib.decompressobj(-15, zdict=ZDICT).decompress(frame[1:])
+        self.assertEqual(msgpack.unpackb(body), self.payload)
+        self.assertEqual(FORMATS["json+deflate"].encode({"id": 1})[:1], b"\x00")
+
+    def test_deflated_frames_inflate_to_at_most_the_max_frame_size(self):
+        codec = FORMATS["json+deflate"]
+        for size, fits in ((MAX_FRAME_SIZE - 2, True), (MAX_FRAME_SIZE + 1, False)):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT)
+            frame = b"\x01" + compressor.compress(b'"' + b"a" * size + b'"') + compressor.flush()
+            self.assertLess(len(frame), 2048)
+            with self.subTest(size=size):
+                if fits:
+                    self.assertEqual(len(codec.decode(bytes_data=frame)), size)
+                else:
+                    with self.assertRaisesMessage(ValueError, "Frame too large."):
+                        codec.decode(bytes_data=frame)
+
+    def test_negotiation_prefers_subprotocol_then_query_string(self):
+        codec, subprotocol = negotiate({"subprotocols": ["other", "chat.msgpack"], "query_string": b"format=json"})
+        self.assertEqual((codec.name, subprotocol), ("msgpack", "chat.msgpack"))
+        codec, subprotocol = negotiate({"subprotocols": [], "query_string": b"format=json%2Bdeflate"})
+        self.assertEqual((codec.name, subprotocol), ("json+deflate", None))
+        self.assertEqual(negotiate({"query_string": b"format=bogus"})[0].name, "json")
+
+    def test_fan_out_encodes_once_per_event(self):
+        cache = FrameCache()
+        event = build_event(dumps(self.payload), group="channel_1")
+        frames = {id(cache.encode_event(FORMATS["msgpack"], dict(event), wrap=True)) for _ in range(100)}
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(
+            msgpack.unpackb(cache.encode_event(FORMATS["msgpack"], event, wrap=True)),
+            {"stream": "channel_1", "data": self.payload},
+        )
+
+
+class ProtocolWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(self.user)
+
+    @async_to_sync
+    async def test_msgpack_deflate_socket(self):
+        socket = WebsocketCommunicator(
+            application, f"/ws/chat/?token={AccessToken.for_user(self.user)}", subprotocols=["chat.msgpack+deflate"],
+        )
+        connected, subprotocol = await socket.connect()
+        self.assertEqual((connected, subprotocol), (True, "chat.msgpack+deflate"))
+        codec = FORMATS["msgpack+deflate"]
+
+        hello = codec.decode(bytes_data=await socket.receive_from())
+        self.assertEqual(base64.b64decode(hello["zdict"]), ZDICT)
+
+        # Clients may send binary frames in their format, or plain JSON text.
+        stream = f"channel_{self.channel.id}"
+        await socket.send_to(bytes_data=codec.encode({"type": "subscribe", "stream": stream}))
+        self.assertEqual(codec.decode(bytes_data=await socket.receive_from()), {"type": "subscribed", "stream": stream, "seq": 0})
+
+        message = await database_sync_to_async(Message.objects.create)(
+            channel=self.channel, sender=self.user, content="long " * 500,
+        )
+        await database_sync_to_async(broadcast_message)(message)
+        frame = await socket.receive_from()
+        self.assertEqual(frame[:1], b"\x01")
+        self.assertEqual(codec.decode(bytes_data=frame)["data"]["content"], message.content)
+        await socket.disconnect()
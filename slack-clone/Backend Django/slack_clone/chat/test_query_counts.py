@@ -0,0 +1,109 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message
+from .reactions import add_reaction
+
+User = get_user_model()
+
+
+# Query-count harness
+#
+# assertConstantQueries renders the same endpoint for several result sizes and
+# fails if the number of queries grows with N (the classic N+1 signature).
+class QueryCountMixin:
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, populate, request, sizes=(1, 5, 25)):
+        counts = {}
+        for size in sizes:
+            populate(size)
+            counts[size] = self.count_queries(request)
+        self.assertEqual(len(set(counts.values())), 1, f"query count grows with N: {counts}")
+        return counts[sizes[0]]
+
+
+class MessageQueryCountTests(QueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.channel = Channel.objects.create(name="general")
+        cls.channel.members.add(cls.user)
+        cls.dm_group = DirectMessageGroup.objects.create()
+        cls.dm_group.participants.add(cls.user)
+        cls.senders = User.objects.bulk_create(
+            [User(username=f"user{i}", email=f"user{i}@example.com") for i in range(25)]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Steady state: membership checks are answered from a warm index.
+        membership_index.clear()
+        membership_index.load(self.user.id)
+        # History pages are cached per conversation version; start cold.
+        cache.clear()
+
+    def populate(self, reacted=False, **conversation):
+        def fill(size):
+            # Committing the delete invalidates the cached history pages.
+            with self.captureOnCommitCallbacks(execute=True):
+                Message.objects.all().delete()
+            # A distinct sender per row so a per-row user lookup can't hide.
+            Message.objects.bulk_create(
+                [Message(sender=sender, content="hi", **conversation) for sender in self.senders[:size]]
+            )
+            if reacted:
+                # ...and a reaction on every row, so a per-row summary can't either.
+                for message in Message.objects.all():
+                    add_reaction(message, self.user, "👍")
+        return fill
+
+    def get_ok(self, url):
+        def request():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+        return request
+
+    def test_channel_history_is_constant_queries(self):
+        self.assertConstantQueries(
+            self.populate(channel=self.channel),
+            self.get_ok(f"/api/channels/{self.channel.id}/messages/"),
+        )
+
+    def test_dm_history_is_constant_queries(self):
+        self.assertConstantQueries(
+            self.populate(dm_group=self.dm_group),
+            self.get_ok(f"/api/dm-groups/{self.dm_group.id}/messages/"),
+        )
+
+    def test_reacted_history_is_constant_queries(self):
+        self.assertConstantQueries(
+            self.populate(reacted=True, channel=self.channel),
+            self.get_ok(f"/api/channels/{self.channel.id}/messages/"),
+        )
+
+    def test_search_is_constant_queries(self):
+        self.assertConstantQueries(
+            self.populate(reacted=True, channel=self.channel),
+            self.get_ok("/api/search/messages/?q=hi"),
+        )
+
+    def test_history_page_is_a_single_select(self):
+        self.populate(channel=self.channel)(25)
+        with self.assertNumQueries(1):
+            self.client.get(f"/api/channels/{self.channel.id}/messages/")
+
+    def test_message_detail_fetches_sender_in_the_same_query(self):
+        message = Message.objects.create(channel=self.channel, sender=self.senders[0], content="hi")
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/messages/{message.id}/")
+        self.assertEqual(response.json()["sender_username"], "user0")
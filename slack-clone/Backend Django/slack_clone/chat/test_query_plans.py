@@ -0,0 +1,112 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message, Workspace
+
+User = get_user_model()
+
+
+# Query-plan regression suite
+#
+# Runs the real views, captures the SQL they issue and EXPLAINs every statement
+# that touches a hot table. A query that stops matching its index shows up
+# here as a sequential scan instead of as a production latency regression.
+class QueryPlanTestCase(TestCase):
+    hot_tables = (
+        "chat_message",
+        "chat_channel_members",
+        "chat_workspace_members",
+        "chat_directmessagegroup_participants",
+        "chat_readcursor",
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.other = User.objects.create_user("bob", "bob@example.com", "pw")
+        cls.workspace = Workspace.objects.create(name="acme")
+        cls.workspace.members.add(cls.user, cls.other)
+        cls.channel = Channel.objects.create(workspace=cls.workspace, name="general")
+        cls.channel.members.add(cls.user, cls.other)
+        cls.dm_group = DirectMessageGroup.objects.create()
+        cls.dm_group.participants.add(cls.user, cls.other)
+        Message.objects.bulk_create(
+            [Message(channel=cls.channel, sender=cls.user, content=f"c{i}") for i in range(60)]
+            + [Message(dm_group=cls.dm_group, sender=cls.other, content=f"d{i}") for i in range(60)]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        membership_index.clear()
+        if connection.vendor == "postgresql":
+            # Tiny test tables are cheaper to seq-scan; make the planner show
+            # whether an index *can* serve the query.
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    # ------------------------ HELPERS ------------------------
+
+    def explain(self, sql):
+        prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+    def full_scans(self, plan):
+        if connection.vendor == "sqlite":
+            # "SCAN t" is a table scan; "SCAN t USING ... INDEX" walks an index.
+            pattern = r"SCAN (\w+)(?! USING)(?:\s|$)"
+        else:
+            pattern = r"Seq Scan on (\w+)"
+        return [table for table in re.findall(pattern, plan) if table in self.hot_tables]
+
+    def capture_plans(self, url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [
+            self.explain(query["sql"])
+            for query in ctx.captured_queries
+            if query["sql"].startswith("SELECT") and any(t in query["sql"] for t in self.hot_tables)
+        ]
+
+    def assertUsesIndex(self, plans, index_name):
+        self.assertTrue(plans, "no queries against the hot tables were captured")
+        for plan in plans:
+            self.assertEqual(self.full_scans(plan), [], plan)
+        self.assertTrue(any(index_name in plan for plan in plans), "\n\n".join(plans))
+
+    # ------------------------ TESTS ------------------------
+
+    def test_channel_history_uses_channel_timestamp_index(self):
+        url = f"/api/channels/{self.channel.id}/messages/"
+        self.assertUsesIndex(self.capture_plans(url), "chat_msg_channel_ts_idx")
+
+    def test_channel_history_cursor_page_uses_channel_timestamp_index(self):
+        url = f"/api/channels/{self.channel.id}/messages/"
+        cursor = self.client.get(url, {"page_size": 10}).json()["before"]
+        self.assertUsesIndex(self.capture_plans(url, {"before": cursor}), "chat_msg_channel_ts_idx")
+        self.assertUsesIndex(self.capture_plans(url, {"around": cursor}), "chat_msg_channel_ts_idx")
+
+    def test_dm_history_uses_dm_group_timestamp_index(self):
+        url = f"/api/dm-groups/{self.dm_group.id}/messages/"
+        self.assertUsesIndex(self.capture_plans(url), "chat_msg_dm_group_ts_idx")
+
+    def test_dm_group_membership_uses_participants_index(self):
+        self.assertUsesIndex(self.capture_plans("/api/dm-groups/"), "chat_dmgroup_participants_user_idx")
+
+    def test_unread_counts_use_history_indexes(self):
+        plans = self.capture_plans("/api/unread/")
+        self.assertUsesIndex(plans, "chat_msg_channel_ts_idx")
+        self.assertUsesIndex(plans, "chat_msg_dm_group_ts_idx")
+
+    def test_sender_history_uses_sender_timestamp_index(self):
+        queryset = Message.objects.filter(sender=self.user).order_by("-timestamp")[:50]
+        self.assertUsesIndex([self.explain(str(queryset.query))], "chat_msg_sender_ts_idx")
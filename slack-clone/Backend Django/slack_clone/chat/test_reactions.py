@@ -0,0 +1,196 @@
+import shutil
+import tempfile
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .membership import membership_index
+from .models import ArchiveSegment, Channel, Message, ReactionCount
+from .reactions import add_reaction, reply_added
+from .retention import archive_expired, purge_conversation
+
+User = get_user_model()
+
+
+class ThreadAndReactionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        cls.channel = Channel.objects.create(name="general")
+        cls.channel.members.add(cls.alice, cls.bob)
+
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.client = self.client_for(self.alice)
+        self.url = f"/api/channels/{self.channel.id}/messages/"
+
+    # ------------------------ HELPERS ------------------------
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def post(self, url, content, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = (client or self.client).post(url, {"content": content}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def react(self, message_id, emoji, client=None, method="put"):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(client or self.client, method)(f"/api/messages/{message_id}/reactions/{emoji}/")
+        self.assertEqual(response.status_code, 204, response.content)
+
+    def history(self):
+        return {message["id"]: message for message in self.client.get(self.url).json()["results"]}
+
+    # ------------------------ THREADS ------------------------
+
+    def test_replies_are_counted_and_listed_in_their_thread(self):
+        parent = self.post(self.url, "lunch?")
+        replies_url = f"/api/messages/{parent['id']}/replies/"
+        first = self.post(replies_url, "yes", self.client_for(self.bob))
+        second = self.post(replies_url, "me too")
+
+        history = self.history()
+        self.assertEqual(list(history), [parent["id"]])  # replies stay out of the channel
+        self.assertEqual(history[parent["id"]]["reply_count"], 2)
+        self.assertEqual(history[parent["id"]]["last_reply_at"], second["timestamp"])
+
+        thread = self.client.get(replies_url).json()["results"]
+        self.assertEqual([reply["id"] for reply in thread], [first["id"], second["id"]])
+        self.assertEqual(thread[0]["parent"], parent["id"])
+
+        response = self.client.post(f"/api/messages/{first['id']}/replies/", {"content": "nested"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/messages/{first['id']}/")
+        self.assertEqual(self.history()[parent["id"]]["reply_count"], 1)
+
+    def test_threads_are_members_only(self):
+        parent = self.post(self.url, "secret")
+        outsider = self.client_for(User.objects.create_user("eve", "eve@example.com", "pw"))
+        self.assertEqual(outsider.get(f"/api/messages/{parent['id']}/replies/").status_code, 403)
+        self.assertEqual(outsider.put(f"/api/messages/{parent['id']}/reactions/👍/").status_code, 403)
+
+    # ------------------------ REACTIONS ------------------------
+
+    def test_reaction_counters(self):
+        message = self.post(self.url, "ship it")
+        self.react(message["id"], "👍")
+        self.react(message["id"], "👍")  # idempotent
+        self.react(message["id"], "👍", self.client_for(self.bob))
+        self.react(message["id"], "🎉", self.client_for(self.bob))
+        self.assertEqual(self.history()[message["id"]]["reactions"], {"👍": 2, "🎉": 1})
+
+        response = self.client.get(f"/api/messages/{message['id']}/reactions/")
+        self.assertEqual(response.json()["reactions"], {"👍": [self.alice.id, self.bob.id], "🎉": [self.bob.id]})
+
+        self.react(message["id"], "🎉", self.client_for(self.bob), method="delete")
+        self.react(message["id"], "🎉", self.client_for(self.bob), method="delete")  # idempotent
+        self.assertEqual(self.history()[message["id"]]["reactions"], {"👍": 2})
+        self.assertFalse(ReactionCount.objects.filter(emoji="🎉").exists())
+        self.assertEqual(Message.objects.get(pk=message["id"]).reaction_count, 2)
+
+    def test_history_page_reads_summaries_in_one_query(self):
+        messages = [self.post(self.url, f"m{i}") for i in range(5)]
+        self.client.get(self.url)  # warm the membership index
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        for message in messages:
+            self.react(message["id"], "👀")
+        cache.clear()
+        with self.assertNumQueries(2):
+            results = self.client.get(self.url).json()["results"]
+        self.assertTrue(all(message["reactions"] == {"👀": 1} for message in results))
+
+    def test_invalid_emoji(self):
+        message = self.post(self.url, "hi")
+        self.assertEqual(self.client.put(f"/api/messages/{message['id']}/reactions/{'x' * 65}/").status_code, 400)
+
+
+class ThreadRetentionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.channel = Channel.objects.create(name="general")
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix="chat-archive-")
+        self.addCleanup(shutil.rmtree, root)
+        self.enterContext(override_settings(CHAT_RETENTION={**settings.CHAT_RETENTION, "ROOT": root, "DEFAULT_DAYS": 30}))
+
+    def create(self, days_ago, parent=None):
+        message = Message.objects.create(channel=self.channel, sender=self.user, content="hi", parent=parent)
+        message.timestamp = timezone.now() - timedelta(days=days_ago)
+        Message.objects.filter(pk=message.pk).update(timestamp=message.timestamp)
+        if parent is not None:
+            reply_added(message)
+        return message
+
+    def test_threads_are_archived_whole(self):
+        thread = self.create(40)
+        add_reaction(thread, self.user, "👍")
+        self.create(1, parent=thread)  # still active
+        self.create(39)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_expired(), (0, 0))  # the active thread holds back the rest
+
+        Message.objects.filter(parent=thread).update(timestamp=timezone.now() - timedelta(days=35))
+        Message.objects.filter(pk=thread.pk).update(last_reply_at=timezone.now() - timedelta(days=35))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_expired(), (3, 1))
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(ArchiveSegment.objects.get().message_count, 3)
+
+    def test_purge_deletes_replies_first(self):
+        thread = self.create(0)
+        for _ in range(3):
+            self.create(0, parent=thread)
+        add_reaction(thread, self.user, "👍")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(purge_conversation({"channel_id": self.channel.id}), 4)
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(ReactionCount.objects.exists())
+
+
+class ReactionEventTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(self.user)
+
+    @async_to_sync
+    async def test_reaction_totals_are_pushed(self):
+        from channels.db import database_sync_to_async
+
+        stream = f"channel_{self.channel.id}"
+        message = await Message.objects.acreate(channel=self.channel, sender=self.user, content="hi")
+        socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(self.user)}")
+        await socket.connect()
+        await socket.send_json_to({"type": "subscribe", "stream": stream})
+        await socket.receive_json_from()
+
+        await database_sync_to_async(add_reaction)(message, self.user, "👍")
+        frame = await socket.receive_json_from()
+        self.assertEqual(frame["stream"], stream)
+        self.assertEqual(frame["data"], {"type": "reactions", "message_id": message.id, "reactions": {"👍": 1}})
+        await socket.disconnect()
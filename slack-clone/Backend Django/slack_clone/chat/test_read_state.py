@@ -0,0 +1,150 @@
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .membership import membership_index
+from .models import Channel, DirectMessageGroup, Message, ReadCursor
+from .read_state import mark_read, unread_counts
+
+User = get_user_model()
+
+
+def create_messages(sender, count, **conversation):
+    # Oldest first, one second apart; the last two share a timestamp.
+    messages = Message.objects.bulk_create([Message(sender=sender, content=f"m{i}", **conversation) for i in range(count)])
+    start = timezone.now() - timedelta(hours=1)
+    for i, message in enumerate(messages):
+        message.timestamp = start + timedelta(seconds=min(i, count - 2))
+        Message.objects.filter(pk=message.pk).update(timestamp=message.timestamp)
+    return messages
+
+
+class ReadStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        cls.general = Channel.objects.create(name="general")
+        cls.general.members.add(cls.alice, cls.bob)
+        cls.private = Channel.objects.create(name="private")
+        cls.private.members.add(cls.bob)
+        cls.dm_group = DirectMessageGroup.objects.create()
+        cls.dm_group.participants.add(cls.alice, cls.bob)
+        cls.messages = create_messages(cls.bob, 5, channel=cls.general)
+        create_messages(cls.bob, 3, channel=cls.private)
+        cls.dm_messages = create_messages(cls.bob, 2, dm_group=cls.dm_group)
+
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.conversation = {"channel_id": self.general.id}
+
+    def cursor(self):
+        return ReadCursor.objects.get(user=self.alice, channel=self.general).last_read_message_id
+
+    def test_unread_counts(self):
+        self.assertEqual(unread_counts(self.alice), {
+            "channels": {self.general.id: 5}, "dm_groups": {self.dm_group.id: 2},
+        })
+        mark_read(self.alice, self.conversation, self.messages[2].id)
+        mark_read(self.alice, {"dm_group_id": self.dm_group.id}, self.dm_messages[-1].id)
+        self.assertEqual(self.client.get("/api/unread/").json(), {
+            "channels": {str(self.general.id): 2}, "dm_groups": {str(self.dm_group.id): 0},
+        })
+
+        # Messages sharing the cursor's timestamp are split by id.
+        mark_read(self.alice, self.conversation, self.messages[3].id)
+        self.assertEqual(unread_counts(self.alice)["channels"][self.general.id], 1)
+
+        # Thread replies aren't listed in the conversation, so they aren't unread there.
+        Message.objects.create(channel=self.general, sender=self.bob, content="re", parent=self.messages[0])
+        self.assertEqual(unread_counts(self.alice)["channels"][self.general.id], 1)
+
+    def test_cursor_never_moves_backwards(self):
+        self.assertTrue(mark_read(self.alice, self.conversation, self.messages[3].id))
+        self.assertTrue(mark_read(self.alice, self.conversation, self.messages[1].id))
+        self.assertEqual(self.cursor(), self.messages[3].id)
+
+        self.assertTrue(mark_read(self.alice, self.conversation, self.messages[4].id))  # same timestamp, later id
+        self.assertTrue(mark_read(self.alice, self.conversation, self.messages[3].id))
+        self.assertEqual(self.cursor(), self.messages[4].id)
+        self.assertEqual(ReadCursor.objects.filter(user=self.alice).count(), 1)
+
+    def test_mark_read_endpoint(self):
+        url = f"/api/channels/{self.general.id}/read/"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(url, {"message_id": self.messages[1].id}, format="json").status_code, 204)
+        self.assertEqual(self.cursor(), self.messages[1].id)
+
+        for message_id in ("1", True, None):
+            with self.subTest(message_id=message_id):
+                self.assertEqual(self.client.post(url, {"message_id": message_id}, format="json").status_code, 400)
+        # A message from another conversation can't move this cursor.
+        response = self.client.post(url, {"message_id": self.dm_messages[0].id}, format="json")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.cursor(), self.messages[1].id)
+
+        private = f"/api/channels/{self.private.id}/read/"
+        self.assertEqual(self.client.post(private, {"message_id": 1}, format="json").status_code, 403)
+
+
+class ReadStatePushTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        membership_index.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(self.alice, self.bob)
+        self.stream = f"channel_{self.channel.id}"
+        self.message_id = create_messages(self.bob, 2, channel=self.channel)[-1].id
+
+    async def connect(self, user):
+        socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(user)}")
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        await socket.send_json_to({"type": "subscribe", "stream": self.stream})
+        self.assertEqual((await socket.receive_json_from())["type"], "subscribed")
+        return socket
+
+    @async_to_sync
+    async def test_reads_reach_the_users_other_sockets(self):
+        phone, laptop, bob = [await self.connect(user) for user in (self.alice, self.alice, self.bob)]
+        await phone.send_json_to({"type": "read", "stream": self.stream, "message_id": self.message_id})
+
+        expected = {"type": "read", "stream": self.stream, "message_id": self.message_id}
+        self.assertEqual(await laptop.receive_json_from(), expected)
+        self.assertEqual(await phone.receive_json_from(), expected)
+        self.assertTrue(await bob.receive_nothing())
+        for socket in (phone, laptop, bob):
+            await socket.disconnect()
+
+    @async_to_sync
+    async def test_rolled_back_reads_are_not_pushed(self):
+        laptop = await self.connect(self.alice)
+
+        def read_and_roll_back():
+            with transaction.atomic():
+                mark_read(self.alice, {"channel_id": self.channel.id}, self.message_id)
+                transaction.set_rollback(True)
+
+        await database_sync_to_async(read_and_roll_back)()
+        self.assertTrue(await laptop.receive_nothing())
+        self.assertFalse(await ReadCursor.objects.aexists())
+
+        await laptop.send_json_to({"type": "read", "stream": self.stream, "message_id": True})
+        self.assertEqual(await laptop.receive_json_from(), {"error": "message_id must be an integer."})
+        await laptop.disconnect()
@@ -0,0 +1,183 @@
+import gzip
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import archive, attachments
+from .history_cache import history_cache
+from .membership import membership_index
+from .models import ArchiveSegment, Attachment, Channel, DirectMessageGroup, Message, Reaction, ReactionCount, Workspace
+from .reactions import add_reaction
+from .retention import archive_expired
+
+User = get_user_model()
+
+
+class RetentionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.workspace = Workspace.objects.create(name="acme", retention_days=30)
+        cls.channel = Channel.objects.create(workspace=cls.workspace, name="general")
+        cls.channel.members.add(cls.user)
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix="chat-archive-")
+        self.addCleanup(shutil.rmtree, root)
+        retention = {**settings.CHAT_RETENTION, "ROOT": f"{root}/archive", "SEGMENT_SIZE": 8, "DELETE_BATCH": 4}
+        self.enterContext(override_settings(
+            CHAT_RETENTION=retention,
+            CHAT_ATTACHMENTS={**settings.CHAT_ATTACHMENTS, "ROOT": f"{root}/attachments"},
+        ))
+        archive.read_segment_file.cache_clear()
+        cache.clear()
+        membership_index.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    # ------------------------ HELPERS ------------------------
+
+    def populate(self, old, new, **conversation):
+        # `old` messages from 40 days ago, then `new` ones from today, a minute apart.
+        conversation = conversation or {"channel": self.channel}
+        messages = [Message.objects.create(sender=self.user, content=f"m{i}", **conversation) for i in range(old + new)]
+        start = timezone.now() - timedelta(days=40)
+        for i, message in enumerate(messages[:old]):
+            Message.objects.filter(pk=message.pk).update(timestamp=start + timedelta(minutes=i))
+        return [message.id for message in messages]
+
+    def archive(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return archive_expired()
+
+    def history(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    # ------------------------ TESTS ------------------------
+
+    def test_expired_messages_move_to_gzipped_segments(self):
+        ids = self.populate(old=20, new=5)
+        self.assertEqual(self.archive(), (20, 3))
+
+        self.assertEqual(list(Message.objects.values_list("id", flat=True).order_by("id")), ids[20:])
+        segments = list(ArchiveSegment.objects.order_by("first_timestamp"))
+        self.assertEqual([segment.message_count for segment in segments], [8, 8, 4])
+        with gzip.open(archive.root() / segments[0].path, "rt") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line["id"] for line in lines], ids[:8])
+        self.assertEqual(lines[0]["sender_username"], "alice")
+
+        self.assertEqual(self.archive(), (0, 0))  # nothing left to archive
+
+    def test_archiving_goes_through_the_delete_signals(self):
+        ids = self.populate(old=3, new=0)
+        add_reaction(Message.objects.get(pk=ids[0]), self.user, "👍")
+        etag = self.client.get("/api/bootstrap/")["ETag"]
+        stream = f"channel_{self.channel.id}"
+        history_cache.get_or_render(stream, "", lambda: b"old page")
+
+        self.archive()
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(Reaction.objects.exists() or ReactionCount.objects.exists())
+        self.assertEqual(self.client.get("/api/bootstrap/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(history_cache.get_or_render(stream, "", lambda: b"new page"), b"new page")
+
+    def test_history_pages_continue_into_the_archive(self):
+        ids = self.populate(old=20, new=5)
+        self.archive()
+        url = f"/api/channels/{self.channel.id}/messages/"
+
+        seen, params = [], {"page_size": 7}
+        while True:
+            page = self.history(url, **params)
+            seen = [message["id"] for message in page["results"]] + seen
+            if page["before"] is None:
+                break
+            params = {"page_size": 7, "before": page["before"]}
+        self.assertEqual(seen, ids)
+
+        page = self.history(url, page_size=25)
+        self.assertEqual([message["id"] for message in page["results"]], ids)
+        self.assertIsNone(page["before"])
+
+    def test_forward_paging_crosses_from_archive_to_hot_rows(self):
+        ids = self.populate(old=6, new=4)
+        self.archive()
+        url = f"/api/channels/{self.channel.id}/messages/"
+        oldest_page = self.history(url, page_size=2)
+        while oldest_page["before"] is not None:
+            oldest_page = self.history(url, page_size=2, before=oldest_page["before"])
+        self.assertEqual([message["id"] for message in oldest_page["results"]], ids[:2])
+
+        page = self.history(url, page_size=6, after=oldest_page["after"])
+        self.assertEqual([message["id"] for message in page["results"]], ids[2:8])
+        self.assertIsNotNone(page["after"])
+        page = self.history(url, page_size=6, after=page["after"])
+        self.assertEqual([message["id"] for message in page["results"]], ids[8:])
+        self.assertIsNone(page["after"])
+
+    def test_history_of_an_unarchived_conversation_is_one_query(self):
+        self.populate(old=0, new=5)
+        membership_index.load(self.user.id)
+        with self.assertNumQueries(1):
+            self.client.get(f"/api/channels/{self.channel.id}/messages/")
+
+    def test_no_retention_keeps_everything(self):
+        Workspace.objects.filter(pk=self.workspace.pk).update(retention_days=None)
+        dm_group = DirectMessageGroup.objects.create()
+        self.populate(old=5, new=0)
+        self.populate(old=5, new=0, dm_group=dm_group)
+        self.assertEqual(self.archive(), (0, 0))
+
+        with override_settings(CHAT_RETENTION={**settings.CHAT_RETENTION, "DEFAULT_DAYS": 30}):
+            self.assertEqual(self.archive(), (5, 1))  # DMs follow DEFAULT_DAYS
+        self.assertEqual(Message.objects.filter(channel=self.channel).count(), 5)
+
+    def test_archived_attachments_stay_downloadable(self):
+        data = b"archived bytes"
+        attachment = Attachment.objects.create(sha256="ab" * 32, size=len(data), content_type="text/plain")
+        path = attachments.blob_path(attachment.sha256)
+        path.parent.mkdir(parents=True)
+        path.write_bytes(data)
+        message = Message.objects.create(
+            channel=self.channel, sender=self.user, content="", attachment=attachment, attachment_name="a.txt",
+        )
+        Message.objects.filter(pk=message.pk).update(timestamp=timezone.now() - timedelta(days=40))
+        self.archive()
+
+        self.assertFalse(Message.objects.filter(pk=message.pk).exists())
+        self.assertTrue(Attachment.objects.filter(archive_segments__isnull=False).exists())
+        response = self.client.get(f"/api/messages/{message.pk}/attachment/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), data)
+
+        stranger = APIClient()
+        stranger.force_authenticate(User.objects.create_user("eve", "eve@example.com", "pw"))
+        self.assertEqual(stranger.get(f"/api/messages/{message.pk}/attachment/").status_code, 403)
+
+    def test_deleting_a_channel_deletes_messages_in_batches(self):
+        self.populate(old=10, new=10)
+        self.archive()
+        segment_files = [archive.root() / segment.path for segment in ArchiveSegment.objects.all()]
+
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f"/api/channels/{self.channel.id}/")
+        self.assertEqual(response.status_code, 204)
+
+        deletes = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith('DELETE FROM "chat_message"')]
+        self.assertEqual(len(deletes), 3)  # 10 hot messages, DELETE_BATCH = 4
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(ArchiveSegment.objects.exists())
+        self.assertFalse(any(path.exists() for path in segment_files))
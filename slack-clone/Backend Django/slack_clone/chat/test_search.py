@@ -0,0 +1,116 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from .models import Channel, DirectMessageGroup, Message
+from .search import PostgresSearchBackend, SQLiteSearchBackend, tokenize
+
+User = get_user_model()
+
+
+class QueryEscapingTests(SimpleTestCase):
+    hostile = 'deploy" OR secret* NEAR(a b) -x ^y col:z & !w | v <-> u:*'
+
+    def test_only_word_tokens_survive(self):
+        self.assertEqual(
+            tokenize(self.hostile), ["deploy", "OR", "secret", "NEAR", "a", "b", "x", "y", "col", "z", "w", "v", "u"],
+        )
+        self.assertEqual(len(tokenize("a " * 100)), 16)
+
+    def test_sqlite_tokens_are_quoted_phrases(self):
+        self.assertEqual(
+            SQLiteSearchBackend().match_expression('deploy" OR secret*'), '"deploy" "OR" "secret"*',
+        )
+
+    def test_postgres_tokens_are_anded(self):
+        self.assertEqual(PostgresSearchBackend().tsquery("deploy & !secret | x:*"), "deploy & secret & x:*")
+
+
+class MessageSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        cls.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        cls.general = Channel.objects.create(name="general")
+        cls.general.members.add(cls.alice, cls.bob)
+        cls.private = Channel.objects.create(name="private")
+        cls.private.members.add(cls.bob)
+        cls.dm_group = DirectMessageGroup.objects.create()
+        cls.dm_group.participants.add(cls.alice, cls.bob)
+        cls.other_dm = DirectMessageGroup.objects.create()
+        cls.other_dm.participants.add(cls.bob)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def search(self, query, **params):
+        response = self.client.get("/api/search/messages/", {"q": query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def contents(self, query, **params):
+        return sorted(message["content"] for message in self.search(query, **params)["results"])
+
+    def test_results_are_limited_to_the_callers_conversations(self):
+        Message.objects.bulk_create([
+            Message(channel=self.general, sender=self.bob, content="deploy at noon"),
+            Message(dm_group=self.dm_group, sender=self.bob, content="deploy checklist"),
+            Message(channel=self.private, sender=self.bob, content="deploy secrets"),
+            Message(dm_group=self.other_dm, sender=self.bob, content="deploy notes"),
+        ])
+        self.assertEqual(self.contents("deploy"), ["deploy at noon", "deploy checklist"])
+        self.assertEqual(self.contents("deploy", channel=self.private.id), [])
+        self.assertEqual(self.contents("deploy", dm_group=self.dm_group.id), ["deploy checklist"])
+
+    def test_prefix_match_filters_and_paging(self):
+        Message.objects.bulk_create(
+            [Message(channel=self.general, sender=self.bob, content=f"release {i}") for i in range(3)]
+            + [Message(channel=self.general, sender=self.alice, content="released")]
+        )
+        self.assertEqual(len(self.contents("rel")), 4)
+        self.assertEqual(self.contents("released", sender=self.alice.id), ["released"])
+
+        page = self.search("release", page_size=2)
+        self.assertEqual((len(page["results"]), page["next_page"]), (2, 2))
+        self.assertEqual(self.search("release", page_size=2, page=2)["next_page"], None)
+
+        self.assertEqual(self.search("")["results"], [])
+
+    def test_malformed_filters_are_rejected(self):
+        for params in (
+            {"sender": "me"}, {"sender": "²"}, {"channel": ""}, {"dm_group": "1.5"},
+            {"since": "yesterday"}, {"since": "2026-13-45T00:00:00"}, {"until": "2026-02-30T00:00:00"},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get("/api/search/messages/", {"q": "x", **params})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(list(response.json()), list(params))
+
+    def test_query_syntax_in_user_input_is_literal(self):
+        Message.objects.create(channel=self.general, sender=self.bob, content="deploy OR rollback")
+        Message.objects.create(channel=self.general, sender=self.bob, content="rollback only")
+        for query in ('deploy" OR "rollback', "deploy OR", "NEAR(deploy", "deploy & !x", "content:deploy", '"'):
+            with self.subTest(query=query):
+                self.search(query)  # never a syntax error
+        self.assertEqual(self.contents('deploy" OR "rollback'), ["deploy OR rollback"])
+
+    @skipUnless(connection.vendor == "sqlite", "FTS5 triggers are SQLite only")
+    def test_fts_index_follows_writes(self):
+        messages = Message.objects.bulk_create(
+            [Message(channel=self.general, sender=self.bob, content=f"standup {i}") for i in range(3)]
+        )
+        self.assertEqual(len(self.contents("standup")), 3)
+
+        Message.objects.filter(pk=messages[0].pk).update(content="retro")
+        self.assertEqual(self.contents("retro"), ["retro"])
+        self.assertEqual(len(self.contents("standup")), 2)
+
+        Message.objects.filter(pk=messages[1].pk).delete()
+        Message.objects.filter(pk=messages[2].pk)._raw_delete(connection.alias)
+        self.assertEqual(self.contents("standup"), [])
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO chat_message_fts(chat_message_fts) VALUES ('integrity-check')")
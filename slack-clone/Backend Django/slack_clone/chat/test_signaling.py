@@ -0,0 +1,78 @@
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from slack_clone.asgi import application
+
+from .membership import membership_index
+from .models import Channel
+
+User = get_user_model()
+
+
+class CallSignalingTests(TransactionTestCase):
+    def setUp(self):
+        membership_index.clear()
+        self.users = [User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("alice", "bob", "carol")]
+        self.channel = Channel.objects.create(name="general")
+        self.channel.members.add(*self.users)
+        self.stream = f"channel_{self.channel.id}"
+
+    async def connect(self, user):
+        socket = WebsocketCommunicator(application, f"/ws/chat/?token={AccessToken.for_user(user)}")
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        await socket.send_json_to({"type": "subscribe", "stream": self.stream})
+        self.assertEqual((await socket.receive_json_from())["type"], "subscribed")
+        return socket
+
+    async def join(self, socket):
+        await socket.send_json_to({"type": "call_join", "stream": self.stream})
+        frame = await socket.receive_json_from()
+        self.assertEqual(frame["type"], "call_joined")
+        return frame["peer_id"]
+
+    @async_to_sync
+    async def test_signaling_goes_only_to_the_addressed_peer(self):
+        alice, bob, carol = [await self.connect(user) for user in self.users]
+        alice_peer = await self.join(alice)
+        bob_peer = await self.join(bob)
+
+        self.assertEqual(await alice.receive_json_from(), {"stream": self.stream, "data": {
+            "type": "call_peer_joined", "peer_id": bob_peer, "user_id": self.users[1].id,
+        }})
+        self.assertEqual(await bob.receive_json_from(), {"stream": self.stream, "data": {
+            "type": "call_peer", "peer_id": alice_peer, "user_id": self.users[0].id,
+        }})
+
+        await bob.send_json_to({"type": "webrtc_offer", "stream": self.stream, "to": alice_peer, "offer": {"sdp": "x"}})
+        self.assertEqual(await alice.receive_json_from(), {"stream": self.stream, "data": {
+            "type": "webrtc_offer", "offer": {"sdp": "x"}, "from": bob_peer,
+        }})
+
+        for i in range(3):
+            await bob.send_json_to({"type": "webrtc_ice_candidate", "stream": self.stream, "to": alice_peer, "candidate": i})
+        frame = await alice.receive_json_from()
+        self.assertEqual(frame["data"], {"type": "webrtc_ice_candidates", "from": bob_peer, "candidates": [0, 1, 2]})
+
+        # Carol is in the channel but not in the call: she hears nothing.
+        self.assertTrue(await carol.receive_nothing(timeout=0.1))
+
+        await bob.send_json_to({"type": "call_leave", "stream": self.stream})
+        self.assertEqual((await bob.receive_json_from())["type"], "call_left")
+        self.assertEqual((await alice.receive_json_from())["data"], {"type": "call_peer_left", "peer_id": bob_peer})
+        for socket in (alice, bob, carol):
+            await socket.disconnect()
+
+    @async_to_sync
+    async def test_signaling_needs_a_peer_of_the_call(self):
+        alice = await self.connect(self.users[0])
+        await alice.send_json_to({"type": "webrtc_offer", "stream": self.stream, "offer": {}})
+        self.assertIn("error", await alice.receive_json_from())
+
+        await self.join(alice)
+        await alice.send_json_to({"type": "webrtc_offer", "stream": self.stream, "to": "nobody", "offer": {}})
+        self.assertIn("error", await alice.receive_json_from())
+        await alice.disconnect()
@@ -0,0 +1,85 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from .history_cache import history_cache
+from .models import Channel, Message, NotificationJob
+from .write_buffer import MessageWriteBuffer
+
+User = get_user_model()
+
+
+class MessageWriteBufferTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.general = Channel.objects.create(name="general")
+        self.random = Channel.objects.create(name="random")
+
+    def messages(self, *channel_ids):
+        return [Message(channel_id=channel_id, sender=self.user, content=f"m{i}") for i, channel_id in enumerate(channel_ids)]
+
+    def cached_page(self, stream):
+        # b"old page" while the page rendered before the write is still cached.
+        return history_cache.get_or_render(stream, "", lambda: b"new page")
+
+    def test_a_batch_is_one_insert(self):
+        for stream in (f"channel_{self.general.id}", f"channel_{self.random.id}"):
+            history_cache.get_or_render(stream, "", lambda: b"old page")
+
+        messages = self.messages(self.general.id, self.general.id, self.random.id)
+        with CaptureQueriesContext(connection) as ctx:
+            results = MessageWriteBuffer().write(messages)
+
+        inserts = [q for q in ctx.captured_queries if q["sql"].startswith('INSERT INTO "chat_message"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual([result["content"] for result in results], ["m0", "m1", "m2"])
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(
+            sorted(NotificationJob.objects.values_list("message_id", flat=True)), sorted(m.pk for m in messages),
+        )
+        self.assertEqual(self.cached_page(f"channel_{self.general.id}"), b"new page")
+        self.assertEqual(self.cached_page(f"channel_{self.random.id}"), b"new page")
+
+    def test_a_failed_batch_falls_back_to_row_by_row(self):
+        history_cache.get_or_render(f"channel_{self.general.id}", "", lambda: b"old page")
+        missing = self.random.id + 1000
+
+        messages = self.messages(self.general.id, missing, self.general.id)
+        results = MessageWriteBuffer().write(messages)
+
+        self.assertEqual([result["content"] for result in (results[0], results[2])], ["m0", "m2"])
+        self.assertIsInstance(results[1], DatabaseError)
+        self.assertEqual(sorted(Message.objects.values_list("content", flat=True)), ["m0", "m2"])
+        # Only the saved rows are queued for notifications.
+        self.assertEqual(
+            sorted(NotificationJob.objects.values_list("message_id", flat=True)), [messages[0].pk, messages[2].pk],
+        )
+        self.assertEqual(self.cached_page(f"channel_{self.general.id}"), b"new page")
+
+    @async_to_sync
+    async def test_submitted_messages_are_flushed_and_broadcast(self):
+        layer = get_channel_layer()
+        listener = await layer.new_channel()
+        stream = f"channel_{self.general.id}"
+        await layer.group_add(stream, listener)
+
+        buffer = MessageWriteBuffer(max_batch=2, max_delay=60)
+        futures = [buffer.submit(message) for message in self.messages(self.general.id, self.general.id)]
+        # max_batch was reached, so the flush doesn't wait out max_delay.
+        saved = [await future for future in futures]
+        self.assertTrue(all(message.pk for message in saved))
+
+        events = [json.loads((await layer.receive(listener))["text"]) for _ in saved]
+        self.assertEqual([(event["content"], event["seq"]) for event in events], [("m0", 1), ("m1", 2)])
+
+        late = buffer.submit(self.messages(self.general.id)[0])
+        await buffer.drain()
+        self.assertTrue(late.done())
+        await layer.group_discard(stream, listener)
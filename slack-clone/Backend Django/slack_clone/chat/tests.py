@@ -1,11 +1,12 @@
 from django.test import TestCase
 
 # Create your tests here.
-import websockets
 import asyncio
 import json
 
 async def test_websocket():
+    import websockets  # only needed when run by hand
+
     uri = "ws://localhost:8000/ws/chat/general/"
     async with websockets.connect(uri) as websocket:
         # Send a message
@@ -18,4 +19,5 @@ async def test_websocket():
             response = await websocket.recv()
             print(f"Received: {response}")
 
-asyncio.get_event_loop().run_until_complete(test_websocket())
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(test_websocket())
@@ -7,13 +7,18 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='token_obtain_pair'),
     path('register/', RegisterView.as_view(), name='register'),
 
+    # Initial client state
+    path('bootstrap/', views.BootstrapView.as_view(), name='bootstrap'),
+
     # Workspace URLs
     path('workspaces/', views.WorkspaceListCreateView.as_view(), name='workspace-list-create'),
     path('workspaces/<int:pk>/', views.WorkspaceRetrieveUpdateDestroyView.as_view(), name='workspace-detail'),
+    path('workspaces/<int:pk>/presence/', views.WorkspacePresenceView.as_view(), name='workspace-presence'),
 
     # Channel URLs
     path('channels/', views.ChannelListCreateView.as_view(), name='channel-list-create'),
     path('channels/<int:pk>/', views.ChannelRetrieveUpdateDestroyView.as_view(), name='channel-detail'),
+    path('channels/<int:pk>/membership/', views.ChannelMembershipView.as_view(), name='channel-membership'),
 
     # Direct Message Group URLs
     path('users/', UserListView.as_view(), name='user-list'),
@@ -26,6 +31,32 @@ urlpatterns = [
     path('channels/<int:channel_id>/messages/', views.MessageListCreateView.as_view(), name='channel-messages'),
     path('dm-groups/<int:dm_group_id>/messages/', views.MessageListCreateView.as_view(), name='dm-group-messages'),
     path('messages/<int:pk>/', views.MessageRetrieveUpdateDestroyView.as_view(), name='message-detail'),
+    path('messages/<int:pk>/replies/', views.MessageRepliesView.as_view(), name='message-replies'),
+    path('messages/<int:pk>/reactions/', views.MessageReactionsView.as_view(), name='message-reactions'),
+    path('messages/<int:pk>/reactions/<str:emoji>/', views.MessageReactionView.as_view(), name='message-reaction'),
+
+    # Attachments
+    path('uploads/', views.UploadSessionCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:pk>/', views.UploadSessionView.as_view(), name='upload-detail'),
+    path('messages/<int:pk>/attachment/', views.MessageAttachmentView.as_view(), name='message-attachment'),
+
+    # Search
+    path('search/messages/', views.MessageSearchView.as_view(), name='message-search'),
+
+    # Read cursors / unread counts
+    path('unread/', views.UnreadCountsView.as_view(), name='unread-counts'),
+    path('channels/<int:channel_id>/read/', views.MarkReadView.as_view(), name='channel-mark-read'),
+    path('dm-groups/<int:dm_group_id>/read/', views.MarkReadView.as_view(), name='dm-group-mark-read'),
+
+    # Notifications
+    path('notifications/', views.NotificationDigestListView.as_view(), name='notification-digests'),
+    path('notifications/read/', views.MarkNotificationsReadView.as_view(), name='notifications-mark-read'),
+
+    # Worker metrics (staff only, or the Prometheus scrape token)
+    path('metrics/', views.PrometheusMetricsView.as_view(), name='metrics'),
+    path('metrics/profile/', views.ProfileView.as_view(), name='metrics-profile'),
+    path('metrics/outbox/', views.OutboxMetricsView.as_view(), name='outbox-metrics'),
+    path('metrics/history-cache/', views.HistoryCacheMetricsView.as_view(), name='history-cache-metrics'),
 
     # WebSocket test room (optional)
     path('<str:room_name>/', views.room, name='room'),
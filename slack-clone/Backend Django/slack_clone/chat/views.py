@@ -1,19 +1,45 @@
+import json
+from datetime import datetime, timezone
+
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 from rest_framework import generics, permissions
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.shortcuts import get_object_or_404
+from django.utils import timezone as django_timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.exceptions import ValidationError
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-
-from .models import Channel, Message, Workspace, DirectMessageGroup
+from rest_framework.renderers import JSONRenderer
+
+from . import archive, attachments
+from .bootstrap import bootstrap, not_modified, state as bootstrap_state
+from .broadcast import broadcast_message, conversation_group
+from .history_cache import history_cache
+from .membership import membership_index
+from .metrics import metrics
+from .models import Channel, Message, Workspace, DirectMessageGroup, NotificationDigest, UploadSession
+from .notifications import enqueue as enqueue_notifications
+from .outbox import outbox_metrics
+from .pagination import MessageCursorPagination, SearchPagination
+from .permissions import IsConversationMember, IsStaffOrScraper, ScrapeTokenAuthentication
+from .presence import online_users, options as presence_options, presence_group
+from .reactions import add_reaction, attach_reactions, remove_reaction, reply_added, valid_emoji
+from .read_state import mark_read, unread_counts
+from .retention import purge_conversation
+from .search import search_messages
 from .serializers import (
+    AttachmentSerializer,
     ChannelSerializer,
     MessageSerializer,
+    NotificationDigestSerializer,
     WorkspaceSerializer,
     DirectMessageGroupSerializer,
     RegisterSerializer,
+    UploadSessionSerializer,
     UserSerializer,
 )
 
@@ -38,6 +64,26 @@ class RegisterView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = RegisterSerializer
 
+# ------------------------ BOOTSTRAP VIEWS ------------------------
+
+class BootstrapView(APIView):
+    # A client's initial state in one round-trip; see chat.bootstrap.
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        options = settings.CHAT_BOOTSTRAP
+        try:
+            limit = int(request.query_params.get("messages", options["MESSAGES"]))
+        except ValueError:
+            raise ValidationError({"messages": "Must be an integer."})
+        limit = max(0, min(limit, options["MAX_MESSAGES"]))
+
+        etag, seqs = bootstrap_state(request.user, limit)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if not_modified(etag, request.headers.get("If-None-Match", "")):
+            return Response(status=304, headers=headers)
+        return Response(bootstrap(request.user, limit, seqs), headers=headers)
+
 # ------------------------ WORKSPACE VIEWS ------------------------
 
 class WorkspaceListCreateView(generics.ListCreateAPIView):
@@ -50,6 +96,32 @@ class WorkspaceRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = WorkspaceSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_destroy(self, instance):
+        # Messages go in bounded batches first (chat.retention), not in one cascade.
+        for channel_id in instance.channels.values_list("id", flat=True):
+            purge_conversation({"channel_id": channel_id})
+        instance.delete()
+
+class WorkspacePresenceView(APIView):
+    # Snapshot of who is online; live changes arrive on the "presence_<id>" stream.
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        workspace = get_object_or_404(Workspace, pk=pk)
+        member_ids = set(Workspace.members.through.objects.filter(workspace=workspace).values_list("user_id", flat=True))
+        if request.user.id not in member_ids:
+            return Response({"error": "You are not a member of this workspace"}, status=403)
+
+        online = online_users(member_ids)
+        return Response({
+            "stream": presence_group(workspace.pk),
+            "heartbeat_interval": presence_options()["HEARTBEAT_INTERVAL"],
+            "online": [
+                {"id": user_id, "last_seen": datetime.fromtimestamp(last_seen, tz=timezone.utc)}
+                for user_id, last_seen in sorted(online.items())
+            ],
+        })
+
 # ------------------------ CHANNEL VIEWS ------------------------
 
 class ChannelListCreateView(generics.ListCreateAPIView):
@@ -68,14 +140,35 @@ class ChannelListCreateView(generics.ListCreateAPIView):
 
         return super().create(request, *args, **kwargs)
 
+    def perform_create(self, serializer):
+        channel = serializer.save()
+        if self.request.user.is_authenticated:
+            channel.members.add(self.request.user)
+
 class ChannelRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Channel.objects.all()
     serializer_class = ChannelSerializer
     permission_classes = [permissions.AllowAny]
 
+    def perform_destroy(self, instance):
+        purge_conversation({"channel_id": instance.pk})
+        instance.delete()
+
+class ChannelMembershipView(APIView):
+    # Channels are public: any user may join or leave one.
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        get_object_or_404(Channel, pk=pk).members.add(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def delete(self, request, pk):
+        get_object_or_404(Channel, pk=pk).members.remove(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 # ------------------------ DM GROUP VIEWS ------------------------
 
-from django.db import models
+from django.db import IntegrityError, transaction
 
 class DirectMessageGroupListCreateView(generics.ListCreateAPIView):
     serializer_class = DirectMessageGroupSerializer
@@ -91,20 +184,31 @@ class DirectMessageGroupListCreateView(generics.ListCreateAPIView):
         if not participant_ids or not isinstance(participant_ids, list):
             return Response({"error": "Invalid participants"}, status=400)
 
-        all_participant_ids = set(participant_ids + [current_user.id])
+        try:
+            all_participant_ids = {int(pk) for pk in participant_ids} | {current_user.id}
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid participants"}, status=400)
+
+        # Find-or-create by canonical participant set: one indexed lookup
+        key = DirectMessageGroup.key_for(all_participant_ids)
+        group = DirectMessageGroup.objects.filter(participant_key=key).first()
+        if group is not None:
+            serializer = self.get_serializer(group)
+            return Response(serializer.data)
 
-        existing_groups = DirectMessageGroup.objects.annotate(
-            count=models.Count("participants")
-        ).filter(count=len(all_participant_ids))
+        if User.objects.filter(id__in=all_participant_ids).count() != len(all_participant_ids):
+            return Response({"error": "Invalid participants"}, status=400)
 
-        for group in existing_groups:
-            group_ids = set(group.participants.values_list("id", flat=True))
-            if group_ids == all_participant_ids:
-                serializer = self.get_serializer(group)
-                return Response(serializer.data)
+        try:
+            with transaction.atomic():
+                group = DirectMessageGroup.objects.create(participant_key=key)
+                group.participants.set(all_participant_ids)
+        except IntegrityError:
+            # A concurrent request created the same DM first.
+            group = DirectMessageGroup.objects.get(participant_key=key)
+            serializer = self.get_serializer(group)
+            return Response(serializer.data)
 
-        group = DirectMessageGroup.objects.create()
-        group.participants.set(all_participant_ids)
         serializer = self.get_serializer(group)
         return Response(serializer.data, status=201)
 
@@ -112,51 +216,328 @@ class DirectMessageGroupListCreateView(generics.ListCreateAPIView):
 class DirectMessageGroupRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     queryset = DirectMessageGroup.objects.all()
     serializer_class = DirectMessageGroupSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+
+    def perform_destroy(self, instance):
+        purge_conversation({"dm_group_id": instance.pk})
+        instance.delete()
 
 # ------------------------ MESSAGE VIEWS ------------------------
 
 class MessageListCreateView(generics.ListCreateAPIView):
     serializer_class = MessageSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+    pagination_class = MessageCursorPagination
+
+    @property
+    def conversation(self):
+        # Lets the pagination continue into the conversation's archive.
+        return archive.conversation_filter(self.kwargs.get('channel_id'), self.kwargs.get('dm_group_id'))
 
     def get_queryset(self):
         channel_id = self.kwargs.get('channel_id')
         dm_group_id = self.kwargs.get('dm_group_id')
 
+        # Thread replies are listed under their thread, not in the conversation.
         if channel_id:
-            return Message.objects.filter(channel_id=channel_id)
+            return Message.objects.with_sender().filter(channel_id=channel_id, parent__isnull=True)
         elif dm_group_id:
-            return Message.objects.filter(dm_group_id=dm_group_id)
+            return Message.objects.with_sender().filter(dm_group_id=dm_group_id, parent__isnull=True)
         return Message.objects.none()
 
+    def paginate_queryset(self, queryset):
+        return attach_reactions(super().paginate_queryset(queryset))
+
+    def list(self, request, *args, **kwargs):
+        # Rendered pages come from chat.history_cache; a miss renders as usual.
+        stream = conversation_group(self.kwargs.get('channel_id'), self.kwargs.get('dm_group_id'))
+        params = self.paginator.cache_key(request)
+        body = history_cache.get_or_render(stream, params, lambda: self.render_page(request))
+        if request.accepted_renderer.format == "json":
+            return HttpResponse(body, content_type="application/json")
+        return Response(json.loads(body))
+
+    def render_page(self, request):
+        # Query, serialization and rendering of one page (a cache miss).
+        started = metrics.start()
+        body = JSONRenderer().render(super().list(request).data)
+        metrics.observe(metrics.serialize, started, "history_page")
+        return body
+
     def perform_create(self, serializer):
         channel_id = self.kwargs.get('channel_id')
         dm_group_id = self.kwargs.get('dm_group_id')
-        message = None
 
-        if channel_id:
-            message = serializer.save(sender=self.request.user, channel_id=channel_id)
-        elif dm_group_id:
-            message = serializer.save(sender=self.request.user, dm_group_id=dm_group_id)
-        else:
+        if not (channel_id or dm_group_id):
             raise ValidationError("Missing channel_id or dm_group_id in URL.")
+        with transaction.atomic():
+            if channel_id:
+                message = serializer.save(sender=self.request.user, channel_id=channel_id)
+            else:
+                message = serializer.save(sender=self.request.user, dm_group_id=dm_group_id)
+            # Members are notified by the worker (chat.notifications), not here.
+            enqueue_notifications([message])
 
-        # ✅ WebSocket broadcast for channel messages
-        if message and channel_id:
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"chat_channel_{channel_id}",
-                {
-                    "type": "chat.message",
-                    "message": MessageSerializer(message).data
-                }
-            )
+        # ✅ WebSocket broadcast for channel and DM messages
+        broadcast_message(message, serializer.data)
 
 class MessageRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Message.objects.all()
+    queryset = Message.objects.with_sender()
+    serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+
+class MessageRepliesView(generics.ListCreateAPIView):
+    # A thread: the replies to one message, oldest first, keyset paginated.
+    serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+    pagination_class = MessageCursorPagination
+
+    def get_parent(self):
+        parent = get_object_or_404(Message.objects.only("id", "channel_id", "dm_group_id", "parent_id"), pk=self.kwargs["pk"])
+        self.check_object_permissions(self.request, parent)
+        return parent
+
+    def get_queryset(self):
+        return Message.objects.with_sender().filter(parent=self.get_parent())
+
+    def paginate_queryset(self, queryset):
+        return attach_reactions(super().paginate_queryset(queryset))
+
+    def perform_create(self, serializer):
+        parent = self.get_parent()
+        if parent.parent_id:
+            raise ValidationError("Reply to the thread's first message instead.")
+        with transaction.atomic():
+            message = serializer.save(
+                sender=self.request.user, parent=parent, channel_id=parent.channel_id, dm_group_id=parent.dm_group_id,
+            )
+            reply_added(message)
+            enqueue_notifications([message])
+        broadcast_message(message, serializer.data)
+
+class MessageReactionsView(APIView):
+    # Who reacted with what: {"reactions": {emoji: [user ids]}}
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+
+    def get(self, request, pk):
+        message = get_object_or_404(Message.objects.only("id", "channel_id", "dm_group_id"), pk=pk)
+        self.check_object_permissions(request, message)
+        reactions = {}
+        for emoji, user_id in message.reactions.order_by("id").values_list("emoji", "user_id"):
+            reactions.setdefault(emoji, []).append(user_id)
+        return Response({"reactions": reactions})
+
+class MessageReactionView(APIView):
+    # PUT adds the user's reaction, DELETE takes it back; both are idempotent.
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+
+    def get_message(self, request, pk, emoji):
+        if not valid_emoji(emoji):
+            raise ValidationError("Invalid emoji.")
+        message = get_object_or_404(Message.objects.only("id", "channel_id", "dm_group_id"), pk=pk)
+        self.check_object_permissions(request, message)
+        return message
+
+    def put(self, request, pk, emoji):
+        add_reaction(self.get_message(request, pk, emoji), request.user, emoji)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def delete(self, request, pk, emoji):
+        remove_reaction(self.get_message(request, pk, emoji), request.user, emoji)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+# ------------------------ ATTACHMENT VIEWS ------------------------
+
+# Resumable upload protocol:
+#   POST /uploads/ {"filename", "content_type", "size"}   -> session id
+#   PUT  /uploads/<id>/ + Content-Range: bytes a-b/size   -> raw chunk body
+#   GET  /uploads/<id>/                                   -> "received" offset to resume from
+# The last chunk answers 201 with the attachment, whose id goes into the
+# message as "attachment_id".
+class UploadSessionCreateView(generics.CreateAPIView):
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+class UploadSessionView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_session(self, request, pk):
+        return get_object_or_404(UploadSession, pk=pk, user=request.user)
+
+    def get(self, request, pk):
+        return Response(UploadSessionSerializer(self.get_session(request, pk)).data)
+
+    def put(self, request, pk):
+        session = self.get_session(request, pk)
+        if session.attachment_id:
+            return Response(AttachmentSerializer(session.attachment).data)
+
+        content_range = attachments.parse_content_range(request.headers.get("Content-Range"))
+        if content_range is None or content_range[2] != session.size:
+            return Response({"error": f"Content-Range must be 'bytes <start>-<end>/{session.size}'"}, status=400)
+        start, end, _ = content_range
+        length = end - start + 1
+        if length > settings.CHAT_ATTACHMENTS["MAX_CHUNK"]:
+            return Response({"error": "Chunk too large"}, status=413)
+        if start != session.received:
+            return Response({"error": "Chunk must start at the received offset", "received": session.received}, status=409)
+        if request.META.get("CONTENT_LENGTH") != str(length):
+            return Response({"error": "Content-Length must match the Content-Range"}, status=400)
+
+        # Raw body, streamed to disk; request.data is never parsed.
+        try:
+            attachments.write_chunk(session, request.stream, start, length)
+        except attachments.IncompleteChunk as e:
+            return Response({"error": str(e), "received": session.received}, status=400)
+
+        # Only one of two racing PUTs for the same offset moves the session on.
+        if not UploadSession.objects.filter(pk=session.pk, received=start).update(received=end + 1):
+            session.refresh_from_db()
+            return Response({"error": "Chunk must start at the received offset", "received": session.received}, status=409)
+        session.received = end + 1
+        if session.received < session.size:
+            return Response(UploadSessionSerializer(session).data)
+        return Response(AttachmentSerializer(attachments.complete_upload(session)).data, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, pk):
+        attachments.discard_upload(self.get_session(request, pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class MessageAttachmentView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+
+    def perform_content_negotiation(self, request, force=False):
+        # The response is the file itself; don't 406 on e.g. "Accept: image/*".
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, pk):
+        message = Message.objects.select_related("attachment").filter(attachment__isnull=False, pk=pk).first()
+        if message is None:
+            return self.get_archived(request, pk)
+        self.check_object_permissions(request, message)
+        return attachments.serve(request, message.attachment, message.attachment_name)
+
+    def get_archived(self, request, pk):
+        # The blob outlives the message: archive segments keep it referenced.
+        segment, message = archive.find(pk)
+        if message is None or not message.data.get("attachment"):
+            raise Http404
+        stream = conversation_group(segment.channel_id, segment.dm_group_id)
+        if not membership_index.is_member(request.user.id, stream):
+            self.permission_denied(request, message=IsConversationMember.message)
+        attachment = get_object_or_404(segment.attachments, pk=message.data["attachment"]["id"])
+        return attachments.serve(request, attachment, message.data["attachment_name"])
+
+# ------------------------ SEARCH VIEWS ------------------------
+
+class MessageSearchView(generics.ListAPIView):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        # Only conversations the caller belongs to.
+        queryset = Message.objects.with_sender().visible_to(self.request.user)
+
+        filters = {}
+        for param, lookup in (("sender", "sender_id"), ("channel", "channel_id"), ("dm_group", "dm_group_id")):
+            if param in params:
+                try:
+                    filters[lookup] = int(params[param])
+                except ValueError:
+                    raise ValidationError({param: "Must be an id."})
+        for param, lookup in (("since", "timestamp__gte"), ("until", "timestamp__lt")):
+            if param in params:
+                try:
+                    value = parse_datetime(params[param])
+                except ValueError:  # well formed but out of range, e.g. month 13
+                    value = None
+                if value is None:
+                    raise ValidationError({param: "Must be an ISO 8601 datetime."})
+                filters[lookup] = value
+
+        return search_messages(queryset.filter(**filters), params.get("q", ""))
+
+    def paginate_queryset(self, queryset):
+        return attach_reactions(super().paginate_queryset(queryset))
+
+# ------------------------ READ STATE VIEWS ------------------------
+
+class UnreadCountsView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(unread_counts(request.user))
+
+class MarkReadView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsConversationMember]
+
+    def post(self, request, channel_id=None, dm_group_id=None):
+        message_id = request.data.get("message_id")
+        if not isinstance(message_id, int) or isinstance(message_id, bool):
+            return Response({"error": "message_id must be an integer"}, status=400)
+
+        conversation = {"channel_id": channel_id} if channel_id else {"dm_group_id": dm_group_id}
+        if not mark_read(request.user, conversation, message_id):
+            return Response({"error": "Message not found in this conversation"}, status=404)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+# ------------------------ NOTIFICATION VIEWS ------------------------
+
+class NotificationDigestListView(generics.ListAPIView):
+    # The user's latest digests; new ones are also pushed to their sockets.
+    serializer_class = NotificationDigestSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    max_digests = 50
+
+    def get_queryset(self):
+        return NotificationDigest.objects.filter(user=self.request.user).order_by("-id")[:self.max_digests]
+
+class MarkNotificationsReadView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        NotificationDigest.objects.filter(user=request.user, read_at__isnull=True).update(read_at=django_timezone.now())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+# ------------------------ METRICS VIEWS ------------------------
+
+class PrometheusMetricsView(APIView):
+    # Hot-path metrics of this worker process (chat.metrics), for Prometheus.
+    authentication_classes = [ScrapeTokenAuthentication] + APIView.authentication_classes
+    permission_classes = [IsStaffOrScraper]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+class ProfileView(APIView):
+    # cProfile stats of sampled requests per view (CHAT_METRICS["PROFILE_SAMPLE_RATE"]).
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.profile_report())
+
+    def delete(self, request):
+        metrics.reset_profiles()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class OutboxMetricsView(APIView):
+    # WebSocket send queues of this worker process: depth, drops, evictions.
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(outbox_metrics.snapshot())
+
+class HistoryCacheMetricsView(APIView):
+    # History page cache of this worker process: hit ratio, evictions.
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(history_cache.stats())
 
 # ------------------------ USER VIEWS ------------------------
 
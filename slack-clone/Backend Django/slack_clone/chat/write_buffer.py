@@ -0,0 +1,122 @@
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .broadcast import group_send_text, message_group
+from .event_log import record
+from .history_cache import history_cache
+from .metrics import metrics
+from .models import Message
+from .notifications import enqueue as enqueue_notifications
+from .serializers import MessageSerializer
+
+
+# Write-behind buffer for messages sent over WebSocket
+#
+# Consumers submit unsaved Message instances and get a future back. Pending
+# messages are inserted with one bulk_create when MAX_BATCH is reached or
+# MAX_DELAY seconds after the first one arrived, whichever comes first, then
+# numbered, logged and broadcast to their conversation groups. Each insert
+# also queues the messages for chat.notifications.
+class MessageWriteBuffer:
+    def __init__(self, max_batch=100, max_delay=0.05):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = []
+        self.timer = None
+        self.flushes = set()
+
+    def submit(self, message):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((message, future))
+
+        if len(self.pending) >= self.max_batch:
+            self.schedule_flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_delay, self.schedule_flush)
+        return future
+
+    def schedule_flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.flush(batch))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+
+    async def flush(self, batch):
+        try:
+            results = await database_sync_to_async(self.write)([message for message, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        saved = []
+        for (message, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                if not future.done():
+                    future.set_exception(result)
+                continue
+            if not future.done():
+                future.set_result(message)
+            saved.append((message, result))
+        events = [(message_group(message), data) for message, data in saved]
+        texts = await sync_to_async(record)(events) if events else []
+        await asyncio.gather(*(group_send_text(group, text) for (group, _), text in zip(events, texts)))
+
+    async def drain(self):
+        # Flush whatever is pending and wait for in-flight batches (shutdown, tests).
+        self.schedule_flush()
+        if self.flushes:
+            await asyncio.gather(*self.flushes)
+
+    def write(self, messages):
+        # Returns one serialized payload (or the exception) per message.
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+                enqueue_notifications(messages)
+        except DatabaseError:
+            # One bad row (e.g. a deleted conversation) must not fail the rest
+            # of the batch: fall back to row-by-row inserts.
+            results = [self.write_one(message) for message in messages]
+        else:
+            started = metrics.start()
+            results = list(MessageSerializer(messages, many=True).data)
+            metrics.observe(metrics.serialize, started, "message_batch")
+        # bulk_create sends no post_save, so chat.signals can't do this.
+        history_cache.invalidate({
+            message_group(message) for message, result in zip(messages, results) if not isinstance(result, Exception)
+        })
+        return results
+
+    def write_one(self, message):
+        try:
+            with transaction.atomic():
+                message.save(force_insert=True)
+                enqueue_notifications([message])
+        except DatabaseError as e:
+            return e
+        return MessageSerializer(message).data
+
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_write_buffer():
+    # One buffer per event loop: every consumer in a worker shares it.
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        options = getattr(settings, "CHAT_WRITE_BUFFER", {})
+        buffer = _buffers[loop] = MessageWriteBuffer(
+            max_batch=options.get("MAX_BATCH", 100),
+            max_delay=options.get("MAX_DELAY", 0.05),
+        )
+    return buffer
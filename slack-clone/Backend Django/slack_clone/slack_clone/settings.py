@@ -42,6 +42,7 @@ SIMPLE_JWT = {
 
 # Middleware (Session + Auth + CORS)
 MIDDLEWARE = [
+    'chat.middleware.RequestMetricsMiddleware',  # outermost: times the whole stack
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -84,10 +85,178 @@ TEMPLATES = [
 ASGI_APPLICATION = 'slack_clone.routing.application'
 WSGI_APPLICATION = 'slack_clone.wsgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",  # Use Redis in production
-    },
+# InMemoryChannelLayer only fans out inside one process. To run several ASGI
+# workers, either start one `manage.py runchannelbroker <socket>` per shard and
+# list the sockets in CHANNEL_BROKER_SOCKETS, or point REDIS_URL(S) at Redis.
+CHANNEL_BROKER_SOCKETS = [p for p in os.environ.get("CHANNEL_BROKER_SOCKETS", "").split(",") if p]
+REDIS_URLS = [u for u in os.environ.get("REDIS_URLS", os.environ.get("REDIS_URL", "")).split(",") if u]
+
+if CHANNEL_BROKER_SOCKETS:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.BrokerChannelLayer",
+            "CONFIG": {"hosts": CHANNEL_BROKER_SOCKETS, "capacity": 1000, "expiry": 60},
+        },
+    }
+elif REDIS_URLS:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": REDIS_URLS, "capacity": 1000, "expiry": 60},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+
+# Cross-worker state (presence) lives in the default cache: Redis when
+# REDIS_URL(S) is set, otherwise a per-process cache that only suits one worker.
+if REDIS_URLS:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URLS[0],
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+# Presence: sockets heartbeat every HEARTBEAT_INTERVAL seconds and a user is
+# offline TTL seconds after the last one. Presence changes and typing notices
+# are broadcast in batches every FLUSH_INTERVAL seconds, and each user's
+# typing is re-announced at most every TYPING_THROTTLE seconds.
+CHAT_PRESENCE = {
+    "HEARTBEAT_INTERVAL": 25,
+    "TTL": 60,
+    "FLUSH_INTERVAL": 1.0,
+    "TYPING_THROTTLE": 3.0,
+}
+
+# Every socket sends through a queue of at most MAX_FRAMES frames / MAX_BYTES.
+# Typing notices and ICE candidates are dropped first (and when older than
+# STALE_AFTER seconds); a socket whose queue is full of other frames, or above
+# HIGH_WATER frames for SLOW_AFTER seconds, is closed as a slow consumer.
+CHAT_OUTBOX = {
+    "MAX_FRAMES": 1000,
+    "MAX_BYTES": 4 * 1024 ** 2,
+    "HIGH_WATER": 200,
+    "SLOW_AFTER": 10.0,
+    "STALE_AFTER": 5.0,
+}
+
+# WebRTC signaling: ICE candidates for the same peer are sent together,
+# once per ICE_BATCH_DELAY seconds.
+CHAT_SIGNALING = {
+    "ICE_BATCH_DELAY": 0.02,
+}
+
+# Reconnect catch-up: the last SIZE message events of every conversation are
+# kept for TTL seconds, so clients can resume from their last seq.
+CHAT_EVENT_LOG = {
+    "SIZE": 500,
+    "TTL": 24 * 60 * 60,
+}
+
+# GET /api/bootstrap/ returns the latest MESSAGES (?messages=, at most
+# MAX_MESSAGES) messages of every conversation of the user.
+CHAT_BOOTSTRAP = {
+    "MESSAGES": 20,
+    "MAX_MESSAGES": 100,
+}
+
+# Rendered history pages, invalidated per conversation on every message
+# create/edit/delete. BACKEND is chat.history_cache.LocalLRUBackend (per
+# process, at most MAX_BYTES) or chat.history_cache.DjangoCacheBackend
+# (CACHE_ALIAS, entries kept TIMEOUT seconds).
+CHAT_HISTORY_CACHE = {
+    "BACKEND": "chat.history_cache.LocalLRUBackend",
+    "MAX_BYTES": 64 * 1024 ** 2,
+    "CACHE_ALIAS": "default",
+    "TIMEOUT": 300,
+}
+
+# Hot-path metrics at /api/metrics/ (Prometheus text format). With ENABLED
+# off the hooks are no-ops. Only the TOP_STREAMS busiest streams get their own
+# series. PROFILE_SAMPLE_RATE of HTTP requests run under cProfile
+# (/api/metrics/profile/). SCRAPE_TOKEN lets Prometheus in without a user.
+CHAT_METRICS = {
+    "ENABLED": os.environ.get("CHAT_METRICS_ENABLED", "1") == "1",
+    "TOP_STREAMS": 20,
+    "PROFILE_SAMPLE_RATE": float(os.environ.get("CHAT_PROFILE_SAMPLE_RATE", "0")),
+    "PROFILE_TOP": 40,
+    "SCRAPE_TOKEN": os.environ.get("CHAT_METRICS_SCRAPE_TOKEN"),
+}
+
+# WebSocket message writes are batched into one bulk_create per
+# MAX_BATCH messages or MAX_DELAY seconds, whichever comes first.
+CHAT_WRITE_BUFFER = {
+    "MAX_BATCH": 100,
+    "MAX_DELAY": 0.05,
+}
+
+# WebSocket handshakes resolve JWTs to users through a bounded in-process
+# cache; MAX_TTL (seconds) caps staleness across worker processes.
+CHAT_AUTH_CACHE = {
+    "MAX_SIZE": 50000,
+    "MAX_TTL": 300,
+}
+
+# Per-user conversation membership sets behind REST and WebSocket access
+# checks; TTL (seconds) caps staleness across worker processes.
+CHAT_MEMBERSHIP_CACHE = {
+    "MAX_USERS": 50000,
+    "TTL": 60,
+}
+
+# Message attachments: resumable uploads land in ROOT/uploads and finished
+# files move to the content-addressed ROOT/blobs. With SENDFILE_HEADER set
+# ("X-Accel-Redirect" for nginx, "X-Sendfile" for Apache) downloads are
+# handed to the web server; SENDFILE_PREFIX is nginx's internal location
+# for ROOT. SESSION_TTL (seconds) is how long prune_attachments keeps
+# uploads and unreferenced files.
+CHAT_ATTACHMENTS = {
+    "ROOT": os.environ.get("CHAT_ATTACHMENTS_ROOT", str(BASE_DIR / "media" / "attachments")),
+    "MAX_SIZE": 2 * 1024 ** 3,
+    "MAX_CHUNK": 8 * 1024 ** 2,
+    "SESSION_TTL": 24 * 60 * 60,
+    "SENDFILE_HEADER": os.environ.get("CHAT_ATTACHMENTS_SENDFILE_HEADER"),
+    "SENDFILE_PREFIX": "/protected/attachments/",
+}
+
+# Message retention (chat.retention): the archive_messages command moves
+# messages older than their workspace's retention_days (DEFAULT_DAYS for
+# DMs and channels outside a workspace; None keeps them) into gzipped
+# segment files of SEGMENT_SIZE messages under ROOT. Deleting a
+# conversation removes its messages DELETE_BATCH rows per transaction.
+CHAT_RETENTION = {
+    "ROOT": os.environ.get("CHAT_ARCHIVE_ROOT", str(BASE_DIR / "media" / "archive")),
+    "DEFAULT_DAYS": None,
+    "SEGMENT_SIZE": 1000,
+    "DELETE_BATCH": 1000,
+    "CACHED_SEGMENTS": 32,
+}
+
+# Notifications for offline and @mentioned members, written by the
+# run_notification_worker command (chat.notifications): WORKERS threads
+# lease BATCH queued messages at a time for LEASE seconds and fan each out
+# CHUNK members per bulk insert. A user's notifications are coalesced into
+# one digest DIGEST_DELAY seconds after the first of a burst.
+CHAT_NOTIFICATIONS = {
+    "WORKERS": 4,
+    "BATCH": 50,
+    "CHUNK": 1000,
+    "LEASE": 60,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_DELAY": 10,
+    "POLL_INTERVAL": 1.0,
+    "DIGEST_DELAY": 60,
 }
 
 # Database (PostgreSQL)
@@ -9,33 +9,59 @@ const VideoCall = ({ ws, username = "You", audioOnly = false }) => {
   const [status, setStatus] = useState("Idle");
   const [videoEnabled, setVideoEnabled] = useState(!audioOnly);
   const remoteStream = useRef(null);
+  const remotePeer = useRef(null);
 
   const iceServers = { iceServers: [{ urls: "stun:stun.l.google.com:19302" }] };
 
   useEffect(() => {
     if (!ws) return;
+    // Signaling is addressed to one peer of the call ("to"), never broadcast:
+    // whoever joins last makes the offer to the peers already in the call.
     ws.onmessage = async (event) => {
       const data = JSON.parse(event.data);
-      if (data.type === "webrtc_offer") {
-        setIncoming(true);
-        window.offer = data.offer; // Save offer for later
+      if (data.type === "call_ring") {
+        if (!pc.current) setIncoming(true);
+      } else if (data.type === "call_peer") {
+        // Already in the call when we joined: we make the offer.
+        remotePeer.current = data.peer_id;
+        const offer = await pc.current.createOffer();
+        await pc.current.setLocalDescription(offer);
+        ws.send(
+          JSON.stringify({ type: "webrtc_offer", to: data.peer_id, offer })
+        );
+      } else if (data.type === "call_peer_joined") {
+        remotePeer.current = data.peer_id;
+        setStatus("Connecting...");
+      } else if (data.type === "webrtc_offer") {
+        remotePeer.current = data.from;
+        await pc.current.setRemoteDescription(
+          new RTCSessionDescription(data.offer)
+        );
+        const answer = await pc.current.createAnswer();
+        await pc.current.setLocalDescription(answer);
+        ws.send(
+          JSON.stringify({ type: "webrtc_answer", to: data.from, answer })
+        );
+        setStatus("In Call");
       } else if (data.type === "webrtc_answer") {
         await pc.current.setRemoteDescription(
           new RTCSessionDescription(data.answer)
         );
         setStatus("In Call");
-      } else if (data.type === "webrtc_ice_candidate") {
-        try {
-          if (pc.current) {
-            await pc.current.addIceCandidate(data.candidate);
+      } else if (data.type === "webrtc_ice_candidates") {
+        for (const candidate of data.candidates) {
+          try {
+            if (pc.current) {
+              await pc.current.addIceCandidate(candidate);
+            }
+            // else: ignore silently
+          } catch (e) {
+            console.error("ICE error", e);
           }
-          // else: ignore silently
-        } catch (e) {
-          console.error("ICE error", e);
         }
-      } else if (data.type === "call_end") {
+      } else if (data.type === "call_peer_left") {
         // Remote user ended the call
-        endCall(true);
+        if (data.peer_id === remotePeer.current) endCall();
       }
     };
     return () => {
@@ -45,14 +71,16 @@ const VideoCall = ({ ws, username = "You", audioOnly = false }) => {
 
   const startCall = async (caller = true) => {
     setCallActive(true);
-    setStatus("Connecting...");
+    setStatus(caller ? "Calling..." : "Connecting...");
+    setIncoming(false);
     pc.current = new window.RTCPeerConnection(iceServers);
 
     pc.current.onicecandidate = (event) => {
-      if (event.candidate) {
+      if (event.candidate && remotePeer.current) {
         ws.send(
           JSON.stringify({
             type: "webrtc_ice_candidate",
+            to: remotePeer.current,
             candidate: event.candidate,
           })
         );
@@ -81,31 +109,19 @@ const VideoCall = ({ ws, username = "You", audioOnly = false }) => {
     stream.getTracks().forEach((track) => pc.current.addTrack(track, stream));
     if (localVideo.current) localVideo.current.srcObject = stream;
 
+    ws.send(JSON.stringify({ type: "call_join" }));
     if (caller) {
-      const offer = await pc.current.createOffer();
-      await pc.current.setLocalDescription(offer);
+      // Rings the conversation once; the rest of the signaling is per peer.
       ws.send(
         JSON.stringify({
-          type: "webrtc_offer",
-          offer,
+          type: "call_ring",
           callType: videoEnabled ? "video" : "audio",
         })
       );
-      setStatus("Calling...");
-    } else {
-      await pc.current.setRemoteDescription(
-        new RTCSessionDescription(window.offer)
-      );
-      const answer = await pc.current.createAnswer();
-      await pc.current.setLocalDescription(answer);
-      ws.send(JSON.stringify({ type: "webrtc_answer", answer }));
-      setStatus("In Call");
-      setIncoming(false);
     }
   };
 
-  // Accepts a flag to indicate if this is a remote-triggered end
-  const endCall = (remote = false) => {
+  const endCall = () => {
     setCallActive(false);
     setStatus("Idle");
     if (pc.current) {
@@ -115,9 +131,10 @@ const VideoCall = ({ ws, username = "You", audioOnly = false }) => {
     if (localVideo.current) localVideo.current.srcObject = null;
     if (remoteVideo.current) remoteVideo.current.srcObject = null;
     remoteStream.current = null;
-    // If this user is ending, notify the other peer
-    if (!remote && ws && ws.readyState === 1) {
-      ws.send(JSON.stringify({ type: "call_end" }));
+    remotePeer.current = null;
+    // Leaving tells the other peer (call_peer_left)
+    if (ws && ws.readyState === 1) {
+      ws.send(JSON.stringify({ type: "call_leave" }));
     }
   };
 
@@ -232,7 +249,7 @@ const VideoCall = ({ ws, username = "You", audioOnly = false }) => {
         {callActive && (
           <>
             <button
-              onClick={() => endCall(false)}
+              onClick={() => endCall()}
               style={{
                 background: "#e01e5a",
                 color: "#fff",
@@ -1,5 +1,49 @@
 import { useEffect, useRef, useState } from "react";
 
+// Messages pushed by the server carry an id; skip relayed pings and duplicates.
+const appendMessage = (setList, msg, lastSeq) => {
+  if (!msg?.id) return;
+  if (msg.seq) lastSeq.current = Math.max(lastSeq.current ?? 0, msg.seq);
+  setList((prev) => (prev.some((m) => m.id === msg.id) ? prev : [...prev, msg]));
+};
+
+// Message events carry their conversation's seq. A socket that drops
+// reconnects with ?last_seq= and the server replays what was missed in one
+// "replay" frame, or answers "resync" when that is too far back.
+const RECONNECT_DELAY_MS = 1000;
+
+const handleSocketFrame = (setList, event, lastSeq, resync) => {
+  let msg;
+  try {
+    msg = JSON.parse(event.data);
+  } catch {
+    return;
+  }
+  if (msg?.type === "replay") {
+    msg.events.forEach((m) => appendMessage(setList, m, lastSeq));
+  } else if (msg?.type === "resync") {
+    resync();
+  } else {
+    appendMessage(setList, msg, lastSeq);
+  }
+};
+
+const socketUrl = (stream, token, lastSeq) =>
+  `wss://https://backend-7tz9.onrender.com/ws/chat/${stream}/?token=${token}` +
+  (lastSeq.current ? `&last_seq=${lastSeq.current}` : "");
+
+// Presence: the server marks a user offline about a minute after the last heartbeat.
+const HEARTBEAT_INTERVAL_MS = 25000;
+
+const keepAlive = (socket) => {
+  const timer = setInterval(() => {
+    if (socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: "heartbeat" }));
+    }
+  }, HEARTBEAT_INTERVAL_MS);
+  socket.addEventListener("close", () => clearInterval(timer));
+};
+
 const useMessagesManagement = () => {
   const [messages, setMessages] = useState([]);
   const [directMessages, setDirectMessages] = useState([]);
@@ -7,10 +51,20 @@ const useMessagesManagement = () => {
   const channelSocketRef = useRef(null);
   const currentDmGroupId = useRef(null);
   const currentChannelId = useRef(null);
+  const dmSeq = useRef(null);
+  const channelSeq = useRef(null);
   const token = localStorage.getItem("accessToken");
 
   const fetchChannelMessages = async (channelId) => {
     try {
+      // Channels are public; history and live updates are for members only.
+      await fetch(
+        `https://backend-7tz9.onrender.com/api/channels/${channelId}/membership/`,
+        {
+          method: "POST",
+          headers: { Authorization: `Bearer ${token}` },
+        }
+      );
       const res = await fetch(
         `https://backend-7tz9.onrender.com/api/channels/${channelId}/messages/`,
         {
@@ -18,7 +72,8 @@ const useMessagesManagement = () => {
         }
       );
       const data = await res.json();
-      setMessages(data);
+      setMessages(data.results);
+      channelSeq.current = null;
       connectToChannelSocket(channelId);
     } catch (err) {
       console.error("Error loading channel messages:", err);
@@ -34,7 +89,8 @@ const useMessagesManagement = () => {
         }
       );
       const data = await res.json();
-      setDirectMessages(data);
+      setDirectMessages(data.results);
+      dmSeq.current = null;
       connectToDMSocket(dmGroupId);
     } catch (err) {
       console.error("Error loading DM messages:", err);
@@ -49,6 +105,7 @@ const useMessagesManagement = () => {
       return;
 
     if (channelSocketRef.current) channelSocketRef.current.close();
+    if (currentChannelId.current !== channelId) channelSeq.current = null;
 
     currentChannelId.current = channelId;
     // const socket = new WebSocket(
@@ -56,16 +113,29 @@ const useMessagesManagement = () => {
     // );
 
     const socket = new WebSocket(
-      `wss://https://backend-7tz9.onrender.com/ws/chat/channel_${channelId}/?token=${token}`
+      socketUrl(`channel_${channelId}`, token, channelSeq)
     );
     
     channelSocketRef.current = socket;
+    keepAlive(socket);
 
     socket.onopen = () =>
       console.log(`✅ WebSocket connected to channel ${channelId}`);
-    socket.onmessage = () => fetchChannelMessages(channelId);
+    socket.onmessage = (event) =>
+      handleSocketFrame(setMessages, event, channelSeq, () =>
+        fetchChannelMessages(channelId)
+      );
     socket.onerror = (err) => console.error("❌ Channel WS error:", err);
-    socket.onclose = () => console.log("🔌 Channel WS closed");
+    socket.onclose = () => {
+      console.log("🔌 Channel WS closed");
+      // Dropped rather than replaced: resume from the last seq we saw.
+      if (channelSocketRef.current === socket) {
+        setTimeout(() => {
+          if (channelSocketRef.current === socket)
+            connectToChannelSocket(channelId);
+        }, RECONNECT_DELAY_MS);
+      }
+    };
   };
 
   const connectToDMSocket = (dmGroupId) => {
@@ -76,22 +146,30 @@ const useMessagesManagement = () => {
       return;
 
     if (dmSocketRef.current) dmSocketRef.current.close();
+    if (currentDmGroupId.current !== dmGroupId) dmSeq.current = null;
 
     currentDmGroupId.current = dmGroupId;
-    const socket = new WebSocket(
-      `wss://https://backend-7tz9.onrender.com/ws/chat/dm_${dmGroupId}/?token=${token}`
-    );
+    const socket = new WebSocket(socketUrl(`dm_${dmGroupId}`, token, dmSeq));
     dmSocketRef.current = socket;
+    keepAlive(socket);
 
     socket.onopen = () =>
       console.log(`✅ WebSocket connected to DM group ${dmGroupId}`);
 
-    socket.onmessage = () => {
-      fetchDirectMessages(dmGroupId); // Reload latest messages
-    };
+    socket.onmessage = (event) =>
+      handleSocketFrame(setDirectMessages, event, dmSeq, () =>
+        fetchDirectMessages(dmGroupId)
+      );
 
     socket.onerror = (error) => console.error("❌ DM WS error:", error);
-    socket.onclose = () => console.log("🔌 DM WS closed");
+    socket.onclose = () => {
+      console.log("🔌 DM WS closed");
+      if (dmSocketRef.current === socket) {
+        setTimeout(() => {
+          if (dmSocketRef.current === socket) connectToDMSocket(dmGroupId);
+        }, RECONNECT_DELAY_MS);
+      }
+    };
   };
 
   const handleSendMessage = async (
@@ -117,16 +195,8 @@ const useMessagesManagement = () => {
         }
       );
 
-      const newMsg = await res.json();
-
-      if (channelSocketRef.current?.readyState === WebSocket.OPEN) {
-        channelSocketRef.current.send(
-          JSON.stringify({
-            message: newMsg.content,
-            sender: newMsg.sender?.username || "unknown",
-          })
-        );
-      }
+      // The server broadcasts the saved message to the channel socket.
+      await res.json();
     } catch (err) {
       console.error("Failed to send channel message:", err);
     }
@@ -149,18 +219,8 @@ const useMessagesManagement = () => {
         }
       );
 
+      // The server broadcasts the saved message to the DM socket.
       await res.json();
-
-      if (dmSocketRef.current?.readyState === WebSocket.OPEN) {
-        dmSocketRef.current.send(
-          JSON.stringify({
-            message: text,
-            sender: "self",
-          })
-        );
-      }
-
-      fetchDirectMessages(dmGroupId); // 👈 ensure latest message shown
     } catch (err) {
       console.error("Failed to send DM message:", err);
     }